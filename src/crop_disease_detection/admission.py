@@ -0,0 +1,147 @@
+"""Admission control and per-request deadlines for the inference endpoints.
+
+A fixed number of requests may be inside the inference path at once and a
+bounded number more may wait for a slot; anything beyond that is turned
+away immediately with a Retry-After hint instead of queueing behind the
+model until the client times out. Every admitted request carries a
+deadline, and work whose deadline has passed is dropped before it reaches
+the forward pass.
+"""
+import asyncio
+import contextlib
+import math
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+
+# -----------------------------
+# Admission Configuration
+# -----------------------------
+# Requests allowed in the inference path at once (per server process)
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", 32))
+# Requests allowed to wait for a slot before new ones get 429
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", 64))
+# Deadline for requests without an X-Request-Timeout header; 0 means none
+REQUEST_TIMEOUT_MS = float(os.getenv("REQUEST_TIMEOUT_MS", 10000))
+# Upper bound on a client-supplied X-Request-Timeout
+MAX_REQUEST_TIMEOUT_MS = float(os.getenv("MAX_REQUEST_TIMEOUT_MS", 60000))
+# Smallest Retry-After sent with 429/503; busier servers ask for longer
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 1))
+RETRY_AFTER_MAX_SECONDS = 30
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+
+class OverloadedError(RuntimeError):
+    """Raised when both the in-flight slots and the wait queue are full"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised for work whose caller's deadline has already passed"""
+
+
+# -----------------------------
+# Deadlines
+# -----------------------------
+class Deadline:
+    """Absolute point on the monotonic clock after which a result is useless"""
+
+    def __init__(self, timeout_ms: Optional[float]):
+        self.at = time.monotonic() + timeout_ms / 1000.0 if timeout_ms else None
+
+    @classmethod
+    def from_header(cls, value: Optional[str], default_ms: float = REQUEST_TIMEOUT_MS) -> "Deadline":
+        """Deadline from an X-Request-Timeout header in milliseconds, else ``default_ms``"""
+        if value is None:
+            return cls(default_ms)
+        try:
+            timeout_ms = float(value)
+        except ValueError:
+            raise ValueError("X-Request-Timeout must be a number of milliseconds") from None
+        if not 0 < timeout_ms <= MAX_REQUEST_TIMEOUT_MS:
+            raise ValueError(f"X-Request-Timeout must be between 1 and {MAX_REQUEST_TIMEOUT_MS:.0f} ms")
+        return cls(timeout_ms)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a deadline"""
+        return None if self.at is None else max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+    def check(self) -> None:
+        if self.expired:
+            raise DeadlineExceededError("Request deadline exceeded")
+
+    def guard(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap ``fn`` so it refuses to start once the deadline has passed.
+
+        For blocking calls handed to the inference pool: the check runs on
+        the worker thread, after the call has waited its turn.
+        """
+        def run(*args: Any, **kwargs: Any) -> Any:
+            self.check()
+            return fn(*args, **kwargs)
+
+        return run
+
+
+# -----------------------------
+# Admission Controller
+# -----------------------------
+class AdmissionController:
+    """Bounds the requests in the inference path and the queue in front of it.
+
+    Only used from the event loop thread, so the counters need no lock.
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT_REQUESTS, max_queued: int = MAX_QUEUED_REQUESTS):
+        if max_inflight < 1:
+            raise ValueError("max_inflight must be at least 1")
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.inflight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_inflight)
+        # Moving average of how long admitted requests hold their slot
+        self._avg_seconds = 0.0
+
+    def retry_after(self) -> int:
+        """Whole seconds until the current backlog should have cleared"""
+        backlog = (self.waiting + 1) * self._avg_seconds / self.max_inflight
+        return min(RETRY_AFTER_MAX_SECONDS, max(RETRY_AFTER_SECONDS, math.ceil(backlog)))
+
+    @contextlib.asynccontextmanager
+    async def admit(self, deadline: Deadline) -> AsyncIterator[None]:
+        """Hold an in-flight slot for the duration of the block.
+
+        Waits for a slot while fewer than ``max_queued`` requests are
+        waiting, otherwise fails fast with ``OverloadedError``. Gives up with
+        ``DeadlineExceededError`` if no slot frees up before ``deadline``.
+        """
+        if self._slots.locked():
+            if self.waiting >= self.max_queued:
+                raise OverloadedError("Server is busy. Try again later.", self.retry_after())
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), deadline.remaining())
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError("Request deadline passed while waiting in the queue") from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        self.inflight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._slots.release()
+            self._avg_seconds += 0.1 * (time.monotonic() - start - self._avg_seconds)
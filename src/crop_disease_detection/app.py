@@ -1,12 +1,15 @@
+# Older single-process app that runs predict() on the event loop; serve main:app instead
 from fastapi import FastAPI, File, UploadFile, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
+import asyncio
 import os
 
 from model import load_model, predict
+from responses import class_id_of, describe, render_prediction
+from uploads import UploadTooLargeError, read_upload, save_upload
 
 # -------------------------------
 # FastAPI app setup
@@ -49,22 +52,24 @@ async def home(request: Request):
 @app.post("/predict", response_class=HTMLResponse)
 async def predict_disease(request: Request, file: UploadFile = File(...)):
     try:
-        # Save uploaded file temporarily
+        # Read upload into memory; the display copy is written alongside
         upload_dir = "static/uploads"
         os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        content = await read_upload(file)
+        saved = asyncio.get_running_loop().run_in_executor(
+            None, save_upload, content, file.filename, upload_dir
+        )
 
         # Predict
-        with open(file_path, "rb") as img_file:
-            result = predict(img_file.read(), model)
+        result = predict(content, model)
+        result = {**result, **describe(class_id_of(result))}
+        stored_name = await saved
 
         # Prepare context for HTML
         context = {
             "request": request,
             "result": result,
-            "image_path": "/" + file_path.replace("\\", "/"),
+            "image_path": f"/{upload_dir}/{stored_name}",
             "error": None
         }
         return templates.TemplateResponse("index.html", context)
@@ -83,18 +88,15 @@ async def predict_disease_api(file: UploadFile = File(...)):
     """JSON API endpoint for React frontend"""
     try:
         # Read file content
-        content = await file.read()
+        content = await read_upload(file)
         
         # Predict
         result = predict(content, model)
         
         # Return JSON response
-        return JSONResponse({
-            "label": result["label"],
-            "confidence": result["confidence"],
-            "description": result["description"],
-            "remedy": result["remedy"]
-        })
+        return Response(content=render_prediction(result), media_type="application/json")
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -0,0 +1,212 @@
+import logging
+import os
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Backend Configuration
+# -----------------------------
+# One of: eager, torchscript, onnx
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager").lower()
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exported")
+TORCHSCRIPT_MODEL_PATH = os.getenv("TORCHSCRIPT_MODEL_PATH", os.path.join(EXPORT_DIR, "model.ts"))
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(EXPORT_DIR, "model.onnx"))
+ONNX_OPSET = int(os.getenv("ONNX_OPSET", 17))
+# Max absolute difference in softmax probabilities tolerated versus eager mode
+PARITY_ATOL = float(os.getenv("PARITY_ATOL", 1e-4))
+
+BACKENDS = ("eager", "torchscript", "onnx")
+# Quantized kernels: x86/fbgemm on Intel/AMD servers, qnnpack on ARM
+QUANT_ENGINE = os.getenv(
+    "QUANT_ENGINE",
+    "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack",
+)
+
+
+def example_input(image_size: int, batch_size: int = 1, in_channels: int = 3) -> torch.Tensor:
+    return torch.rand(batch_size, in_channels, image_size, image_size)
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def export_torchscript(model: nn.Module, path: str, image_size: int) -> torch.jit.ScriptModule:
+    """Trace the eager model, freeze it, and save it to ``path``"""
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_input(image_size))
+        frozen = torch.jit.freeze(traced)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.jit.save(frozen, path)
+    logger.info(f"Saved frozen TorchScript model to {path}")
+    return frozen
+
+
+def export_onnx(model: nn.Module, path: str, image_size: int, opset: int = ONNX_OPSET) -> str:
+    """Export the eager model to ONNX with a dynamic batch dimension"""
+    model.eval()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example_input(image_size),),
+            path,
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+        )
+    logger.info(f"Saved ONNX model to {path}")
+    return path
+
+
+def check_parity(
+    reference: nn.Module,
+    candidate,
+    image_size: int,
+    batch_size: int = 4,
+    atol: float = PARITY_ATOL,
+    device: torch.device = torch.device("cpu"),
+) -> dict:
+    """Compare a backend against the eager model on random inputs.
+
+    Raises ``RuntimeError`` if the softmax outputs differ by more than
+    ``atol`` or any top-1 label disagrees.
+    """
+    inputs = example_input(image_size, batch_size).to(device)
+    with torch.no_grad():
+        expected = torch.softmax(reference(inputs), dim=1)
+        actual = torch.softmax(candidate(inputs).float(), dim=1)
+
+    max_abs_diff = float((expected - actual).abs().max())
+    top1_agreement = float((expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean())
+    report = {"max_abs_diff": max_abs_diff, "top1_agreement": top1_agreement}
+    if max_abs_diff > atol or top1_agreement < 1.0:
+        raise RuntimeError(f"Backend output does not match eager mode: {report}")
+    logger.info(f"Parity check passed: {report}")
+    return report
+
+
+# -----------------------------
+# Runtime Backends
+# -----------------------------
+class OnnxBackend:
+    """Callable wrapper so an ONNX Runtime session can stand in for the nn.Module"""
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("INFERENCE_BACKEND=onnx requires the 'onnxruntime' package") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = path
+
+    def __call__(self, xb: torch.Tensor) -> torch.Tensor:
+        array = xb.detach().cpu().contiguous().numpy()
+        (logits,) = self.session.run(None, {self.input_name: array})
+        return torch.from_numpy(logits)
+
+    def eval(self) -> "OnnxBackend":
+        return self
+
+
+def load_quantized(path: str, image_size: int) -> torch.jit.ScriptModule:
+    """Load an INT8 TorchScript model written by ``quantize.py`` (CPU only)"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"INT8 model not found at {path}; run quantize.py calibrate first")
+    torch.backends.quantized.engine = QUANT_ENGINE
+    runner = torch.jit.load(path, map_location="cpu")
+    runner.eval()
+    with torch.no_grad():
+        runner(example_input(image_size))
+    logger.info(f"Loaded INT8 model from {path} (engine={QUANT_ENGINE})")
+    return runner
+
+
+def _digest_path(artifact_path: str) -> str:
+    return artifact_path + ".sha256"
+
+
+def record_weights(artifact_path: str, weights_sha256: Optional[str]) -> None:
+    """Note which checkpoint an exported artifact was built from, next to it"""
+    if weights_sha256:
+        with open(_digest_path(artifact_path), "w", encoding="utf-8") as f:
+            f.write(weights_sha256 + "\n")
+
+
+def artifact_matches(artifact_path: str, weights_sha256: Optional[str]) -> bool:
+    """An artifact exists and, when the weights' digest is known, was exported from them"""
+    if not os.path.exists(artifact_path):
+        return False
+    if weights_sha256 is None:
+        return True
+    try:
+        with open(_digest_path(artifact_path), encoding="utf-8") as f:
+            return f.read().strip() == weights_sha256
+    except FileNotFoundError:
+        return False
+
+
+def build_backend(
+    model: nn.Module,
+    backend: str = INFERENCE_BACKEND,
+    image_size: int = 256,
+    device: torch.device = torch.device("cpu"),
+    artifact_dir: Optional[str] = None,
+    weights_sha256: Optional[str] = None,
+):
+    """Return the callable that ``predict`` should run for ``backend``.
+
+    Previously exported artifacts are reused when they were built from the
+    same weights (``weights_sha256``, recorded in a ``.sha256`` file next to
+    the artifact); otherwise the loaded eager model is exported on the spot.
+    Either way the result is checked against eager mode before it is
+    returned, and a reused artifact that fails the check is re-exported.
+    ``artifact_dir`` keeps the artifacts of a separately loaded model
+    version apart from the default ones.
+    """
+    if backend == "eager":
+        return model
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}', expected one of {BACKENDS}")
+    if device.type != "cpu":
+        logger.warning(f"INFERENCE_BACKEND={backend} targets CPU; falling back to eager on {device}")
+        return model
+
+    torchscript_path, onnx_path = TORCHSCRIPT_MODEL_PATH, ONNX_MODEL_PATH
+    if artifact_dir is not None:
+        torchscript_path = os.path.join(artifact_dir, os.path.basename(TORCHSCRIPT_MODEL_PATH))
+        onnx_path = os.path.join(artifact_dir, os.path.basename(ONNX_MODEL_PATH))
+
+    path = torchscript_path if backend == "torchscript" else onnx_path
+
+    def export():
+        if backend == "torchscript":
+            runner = export_torchscript(model, path, image_size)
+        else:
+            runner = OnnxBackend(export_onnx(model, path, image_size))
+        record_weights(path, weights_sha256)
+        return runner
+
+    if artifact_matches(path, weights_sha256):
+        runner = torch.jit.load(path, map_location=device) if backend == "torchscript" else OnnxBackend(path)
+        try:
+            check_parity(model, runner, image_size)
+        except RuntimeError as e:
+            logger.warning(f"{path} does not match the loaded weights ({e}); re-exporting")
+            runner = export()
+            check_parity(model, runner, image_size)
+    else:
+        runner = export()
+        check_parity(model, runner, image_size)
+    logger.info(f"Using {backend} inference backend")
+    return runner
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from admission import Deadline, DeadlineExceededError
+from model import DEVICE, TTA_MODE, predict_tensors
+from workers import InferencePool
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Batching Configuration
+# -----------------------------
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 16))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10))
+
+
+# -----------------------------
+# Micro-batching Scheduler
+# -----------------------------
+class MicroBatcher:
+    """Coalesces concurrent single-image requests into one batched forward pass.
+
+    Callers ``await submit(tensor)`` and get back their own result dict. A
+    background task waits for the first queued item, then keeps collecting
+    until either ``max_batch_size`` items are gathered or ``max_wait_ms`` has
+    passed since that first item arrived.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        device: torch.device = DEVICE,
+        pool: Optional[InferencePool] = None,
+        match: Optional[Callable] = None,
+        gate: Optional[Callable] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.device = device
+        self.pool = pool
+        # Near-duplicate lookup handed to predict_tensors (see EmbeddingIndex.match)
+        self.match = match
+        # Cheap first stage handed to predict_tensors (see cascade.Cascade)
+        self.gate = gate
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Items taken off the queue and not yet answered (future is each item's last field)
+        self._current: list = []
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Micro-batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Fail anything still waiting, queued or mid-batch, so callers don't hang
+        futures = [item[-1] for item in self._current]
+        while not self._queue.empty():
+            futures.append(self._queue.get_nowait()[-1])
+        self._current = []
+        for future in futures:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    @property
+    def depth(self) -> int:
+        """Requests waiting to be picked up into a batch"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(
+        self,
+        image_tensor: torch.Tensor,
+        crop: Optional[str] = None,
+        tta: str = TTA_MODE,
+        deadline: Optional[Deadline] = None,
+        embed: bool = False,
+    ) -> dict:
+        """Queue one (C, H, W) tensor and wait for its prediction.
+
+        ``crop`` (a canonical name from ``resolve_crop``) and ``tta`` apply to
+        just this item; items with different options still share a batch.
+        Past ``deadline`` the wait ends with ``DeadlineExceededError`` and the
+        item is dropped if it hasn't reached the model yet. With ``embed`` (or
+        a ``match`` lookup) the result carries its ``embedding``.
+        """
+        if self._task is None:
+            raise RuntimeError("Batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_tensor, (crop, tta, embed), deadline, future))
+        if deadline is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, deadline.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("Request deadline exceeded") from None
+
+    async def _collect(self) -> List[Tuple[torch.Tensor, Tuple[Optional[str], str, bool], Optional[Deadline], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = self._current = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _forward(self, tensors: torch.Tensor, options: List[Tuple[Optional[str], str, bool]]) -> List[dict]:
+        crops = [crop for crop, _, _ in options]
+        tta = [mode for _, mode, _ in options]
+        # One pass yields embeddings for the whole batch or for none of it
+        embed = any(e for _, _, e in options)
+        args = (tensors, self.model, self.device, crops, tta, embed, self.match, self.gate)
+        if self.pool is not None:
+            return await self.pool.execute(predict_tensors, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, predict_tensors, *args)
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+
+            # Skip callers that disconnected or whose deadline passed while waiting
+            batch = self._current = [
+                (t, o, f) for t, o, d, f in batch if not f.done() and not (d is not None and d.expired)
+            ]
+            if not batch:
+                continue
+
+            tensors = torch.stack([t for t, _, _ in batch])
+            try:
+                results = await self._forward(tensors, [o for _, o, _ in batch])
+            except Exception as e:
+                logger.exception("Batched prediction failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError(f"Prediction failed: {e}"))
+                continue
+
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
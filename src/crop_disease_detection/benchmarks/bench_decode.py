@@ -0,0 +1,153 @@
+"""Decode-stage benchmark: full decode + transform vs. draft/reduce fast path.
+
+Usage (from src/crop_disease_detection):
+    python -m benchmarks.bench_decode --megapixels 12 48 --formats jpeg png
+
+    # Accuracy parity of the two paths with the served weights on real photos,
+    # before turning on FAST_DECODE
+    python -m benchmarks.bench_decode --parity-images samples/
+
+Each (format, size, path) combination runs in a fresh subprocess so the
+peak RSS numbers are not polluted by earlier runs. Results are printed as
+JSON (and written to --output if given).
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import peak_rss_mb, synthetic_photo, write_report
+
+PATHS = ("baseline", "fast")
+
+
+def run_worker(path: str, image_file: str, repeat: int) -> dict:
+    """Time one decode path in this process and report its peak RSS"""
+    os.environ["FAST_DECODE"] = "1" if path == "fast" else "0"
+    import model  # noqa: E402  (env must be set before import)
+
+    with open(image_file, "rb") as f:
+        content = f.read()
+    baseline_rss = peak_rss_mb()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.preprocess(content)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "peak_rss_mb": peak_rss_mb(),
+        "decode_rss_mb": peak_rss_mb() - baseline_rss,
+    }
+
+
+def accuracy_parity(image_dir: str, batch_size: int = 16) -> dict:
+    """Served model's answers on ``image_dir`` with the full decode vs. the fast path.
+
+    With images in folders named after a class (ImageFolder layout) the
+    accuracy of each path is reported too.
+    """
+    import torch
+    from PIL import Image
+
+    import model
+    from images import list_images
+
+    net = model.load_model(token=os.getenv("HF_TOKEN"), backend="eager", precision="fp32")
+    paths = list_images(image_dir)
+    agree = labelled = correct_full = correct_fast = 0
+    deltas = []
+    for start in range(0, len(paths), batch_size):
+        full, fast, labels = [], [], []
+        for path in paths[start:start + batch_size]:
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+                full.append(model.transform(Image.open(io.BytesIO(content)).convert("RGB")))
+                fast.append(model.image_to_tensor(model.decode_image(content)))
+            except Exception as e:
+                print(f"Skipping {path}: {e}", file=sys.stderr)
+                continue
+            folder = os.path.basename(os.path.dirname(path))
+            labels.append(model.class_names.index(folder) if folder in model.class_names else -1)
+        if not full:
+            continue
+        with torch.inference_mode():
+            probs_full = model.class_probabilities(model.forward_logits(torch.stack(full), net))
+            probs_fast = model.class_probabilities(model.forward_logits(torch.stack(fast), net))
+        top_full, top_fast = probs_full.argmax(dim=1), probs_fast.argmax(dim=1)
+        agree += int((top_full == top_fast).sum())
+        rows = torch.arange(len(full))
+        deltas.extend((probs_fast[rows, top_full] - probs_full[rows, top_full]).abs().tolist())
+        for label, a, b in zip(labels, top_full.tolist(), top_fast.tolist()):
+            if label >= 0:
+                labelled += 1
+                correct_full += a == label
+                correct_fast += b == label
+
+    if not deltas:
+        raise RuntimeError(f"No images could be decoded under {image_dir}")
+    return {
+        "images": len(deltas),
+        "top1_agreement": agree / len(deltas),
+        "mean_abs_confidence_delta": statistics.mean(deltas),
+        "max_abs_confidence_delta": max(deltas),
+        "labelled": labelled,
+        "accuracy_full": correct_full / labelled if labelled else None,
+        "accuracy_fast": correct_fast / labelled if labelled else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark image decode paths")
+    parser.add_argument("--megapixels", nargs="+", type=float, default=[12, 48])
+    parser.add_argument("--formats", nargs="+", default=["jpeg", "png"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--parity-images", help="Compare the two paths' predictions on this folder instead")
+    parser.add_argument("--output")
+    parser.add_argument("--worker", nargs=2, metavar=("PATH", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker[0], args.worker[1], args.repeat)))
+        return
+    if args.parity_images:
+        write_report("decode-parity", [accuracy_parity(args.parity_images)], args.output)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats:
+            for megapixels in args.megapixels:
+                image_file = os.path.join(tmp, f"{megapixels}mp.{fmt}")
+                with open(image_file, "wb") as f:
+                    f.write(synthetic_photo(megapixels, fmt))
+                for path in PATHS:
+                    out = subprocess.run(
+                        [sys.executable, "-m", "benchmarks.bench_decode",
+                         "--repeat", str(args.repeat), "--worker", path, image_file],
+                        check=True, capture_output=True, text=True,
+                    )
+                    row = {"format": fmt, "megapixels": megapixels, "path": path,
+                           "file_mb": os.path.getsize(image_file) / 1e6}
+                    row.update(json.loads(out.stdout.strip().splitlines()[-1]))
+                    results.append(row)
+                    print(
+                        f"{fmt:>5} {megapixels:>5.0f} MP {path:>8}: "
+                        f"{row['median_ms']:8.1f} ms  decode RSS {row['decode_rss_mb']:7.1f} MB",
+                        file=sys.stderr,
+                    )
+
+    write_report("decode", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Shared helpers for the benchmark scripts (synthetic data, RSS, output)"""
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_photo(megapixels: float, fmt: str = "jpeg", seed: int = 0) -> bytes:
+    """Smooth gradients plus noise, so JPEG sizes resemble real leaf photos"""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (60 + 80 * xs * ys).astype(np.uint8)
+    image[..., 1] = (120 + 100 * ys).astype(np.uint8)
+    image[..., 2] = (40 + 60 * xs).astype(np.uint8)
+    image = np.clip(image + rng.integers(-12, 12, image.shape), 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format=fmt.upper(), quality=90)
+    return buffer.getvalue()
+
+
+def write_random_checkpoint(path: str, seed: int = 0) -> str:
+    """Randomly initialised ResNet9 weights, so benchmarks never need the hub"""
+    import torch
+    from model import IN_CHANNELS, ResNet9, class_names
+
+    torch.manual_seed(seed)
+    model = ResNet9(in_channels=IN_CHANNELS, num_classes=len(class_names))
+    torch.save({"model_state_dict": model.state_dict(), "num_classes": len(class_names)}, path)
+    return path
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> float:
+    """Peak resident set size of ``pid`` (default: this process) in MB"""
+    # VmHWM resets on exec; ru_maxrss can carry over the parent's high-water mark
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is not None:
+        return float("nan")
+    import resource
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def environment() -> dict:
+    """Enough context to tell two result files apart"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import torch
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_report(name: str, results: list, output: Optional[str], **extra) -> None:
+    report = {"benchmark": name, "environment": environment(), **extra, "results": results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
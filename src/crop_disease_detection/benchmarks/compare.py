@@ -0,0 +1,49 @@
+"""Compare two benchmark reports produced by the scripts in this package.
+
+Usage:
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+from typing import Tuple
+
+METRIC_SUFFIXES = ("_ms", "_mb", "images_per_sec")
+
+
+def is_metric(name: str) -> bool:
+    return name.endswith(METRIC_SUFFIXES)
+
+
+def row_key(row: dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in row.items() if not is_metric(k) and k not in ("ok", "statuses", "wall_s")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Diff two benchmark JSON reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    if before["benchmark"] != after["benchmark"]:
+        raise SystemExit(f"Cannot compare '{before['benchmark']}' with '{after['benchmark']}'")
+
+    print(f"{before['environment'].get('commit')} -> {after['environment'].get('commit')} ({before['benchmark']})")
+    baseline = {row_key(row): row for row in before["results"]}
+    for row in after["results"]:
+        old = baseline.get(row_key(row))
+        if old is None:
+            continue
+        label = " ".join(f"{k}={v}" for k, v in row_key(row))
+        for name, value in row.items():
+            if not is_metric(name) or not isinstance(value, (int, float)) or not old.get(name):
+                continue
+            change = 100 * (value - old[name]) / old[name]
+            print(f"{label:<40} {name:<16} {old[name]:10.2f} -> {value:10.2f} ({change:+6.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
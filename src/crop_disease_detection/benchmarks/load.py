@@ -0,0 +1,180 @@
+"""Load test for POST /api/predict.
+
+Usage (from src/crop_disease_detection):
+    # Start main:app with random weights, then load it at several concurrencies
+    python -m benchmarks.load --concurrency 1 8 32 --requests 200 --output load.json
+
+    # Or point it at a server that is already running
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 16
+
+Reports p50/p95/p99 latency, images/sec and (for a server it started
+itself) the server's peak RSS.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+from benchmarks.common import peak_rss_mb, percentile, synthetic_photo, write_random_checkpoint, write_report
+
+
+def multipart_body(content: bytes, filename: str = "leaf.jpg") -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post_once(url: str, body: bytes, content_type: str, timeout: float) -> Tuple[int, float]:
+    parsed = urlparse(url)
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+    try:
+        conn.request("POST", "/api/predict", body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = 0
+    finally:
+        conn.close()
+    return status, (time.perf_counter() - start) * 1000
+
+
+def run_level(url: str, bodies: List[Tuple[bytes, str]], concurrency: int, requests: int, timeout: float) -> dict:
+    def task(i: int) -> Tuple[int, float]:
+        body, content_type = bodies[i % len(bodies)]
+        return post_once(url, body, content_type, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(task, range(requests)))
+    wall = time.perf_counter() - start
+
+    ok = [ms for status, ms in outcomes if status == 200]
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(ok),
+        "statuses": statuses,
+        "p50_ms": percentile(ok, 50),
+        "p95_ms": percentile(ok, 95),
+        "p99_ms": percentile(ok, 99),
+        "images_per_sec": len(ok) / wall if wall else 0.0,
+        "wall_s": wall,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, env_overrides: dict, startup_timeout: float) -> subprocess.Popen:
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    checkpoint = os.path.join(tmp, "random.pth")
+    write_random_checkpoint(checkpoint)
+
+    env = dict(os.environ)
+    env.update({
+        "MODEL_PATH": checkpoint,
+        "MODEL_OFFLINE": "1",
+        "MODEL_VERSION": "benchmark-random",
+        # Every request should pay for inference, not hit the result cache
+        "PREDICTION_CACHE_SIZE": "0",
+        "PREDICTION_CACHE_DIR": "",
+        # Random weights are never confident, so auto TTA would run on every
+        # request; use --server-env TTA_MODE=always to measure that path
+        "TTA_MODE": "off",
+    })
+    env.update(env_overrides)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env,
+    )
+
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError("Server did not become ready in time")
+
+
+def parse_env(pairs: List[str]) -> dict:
+    return dict(pair.split("=", 1) for pair in pairs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test /api/predict")
+    parser.add_argument("--url", help="Existing server; if omitted main:app is started with random weights")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--megapixels", type=float, default=3)
+    parser.add_argument("--unique-images", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--server-env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the spawned server, e.g. BATCH_MAX_SIZE=32")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    bodies = [multipart_body(synthetic_photo(args.megapixels, "jpeg", seed=i)) for i in range(args.unique_images)]
+
+    server: Optional[subprocess.Popen] = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        server = start_server(port, parse_env(args.server_env), args.startup_timeout)
+        url = f"http://127.0.0.1:{port}"
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            row = run_level(url, bodies, concurrency, args.requests, args.timeout)
+            results.append(row)
+            print(
+                f"c={concurrency:<4} ok={row['ok']:<5} p50={row['p50_ms']:8.1f} ms "
+                f"p95={row['p95_ms']:8.1f} ms p99={row['p99_ms']:8.1f} ms {row['images_per_sec']:7.2f} img/s",
+                file=sys.stderr,
+            )
+        server_rss = peak_rss_mb(server.pid) if server is not None else None
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    write_report(
+        "load", results, args.output,
+        config={"url": args.url or "spawned", "megapixels": args.megapixels,
+                "requests": args.requests, "server_env": parse_env(args.server_env)},
+        server_peak_rss_mb=server_rss,
+    )
+
+
+if __name__ == "__main__":
+    main()
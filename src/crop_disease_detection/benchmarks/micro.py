@@ -0,0 +1,102 @@
+"""Microbenchmarks for the inference hot path.
+
+Usage (from src/crop_disease_detection):
+    python -m benchmarks.micro --batch-sizes 1 4 16 --threads 1 2 4 --output micro.json
+
+Times decode, ``transform``, ``ResNet9.forward`` (per batch size and torch
+thread count) and the full ``predict()`` on synthetic images with randomly
+initialised weights, so it runs offline.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from PIL import Image
+
+from benchmarks.common import peak_rss_mb, percentile, synthetic_photo, write_random_checkpoint, write_report
+
+
+def time_call(fn: Callable[[], object], repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": percentile(timings, 95),
+        "min_ms": min(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark the crop disease inference path")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, os.cpu_count() or 1])
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--tta", default="off", help="TTA mode for predict(); off so it times one forward pass")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("MODEL_PATH", os.path.join(tmp, "random.pth"))
+    os.environ.setdefault("MODEL_VERSION", "benchmark-random")
+
+    import torch
+    import model
+
+    if not os.path.exists(os.environ["MODEL_PATH"]):
+        write_random_checkpoint(os.environ["MODEL_PATH"])
+    net = model.load_model(device=torch.device("cpu"))
+
+    content = synthetic_photo(args.megapixels, "jpeg")
+    pil_image = Image.open(io.BytesIO(content)).convert("RGB")
+    decoded = model.decode_image(content)
+    results = []
+
+    def record(stage: str, timing: dict, **params) -> None:
+        row = {"stage": stage, **params, **timing}
+        results.append(row)
+        label = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"{stage:>10} {label:<24} {timing['median_ms']:9.2f} ms", file=sys.stderr)
+
+    with torch.inference_mode():
+        record("decode", time_call(lambda: model.decode_image(content), args.repeat, args.warmup), path="fast")
+        record("decode", time_call(
+            lambda: Image.open(io.BytesIO(content)).convert("RGB"), args.repeat, args.warmup,
+        ), path="full")
+        record("transform", time_call(lambda: model.transform(pil_image), args.repeat, args.warmup), path="torchvision")
+        record("transform", time_call(lambda: model.image_to_tensor(decoded), args.repeat, args.warmup), path="numpy")
+
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                batch = torch.rand(batch_size, model.IN_CHANNELS, model.IMAGE_SIZE, model.IMAGE_SIZE)
+                batch = batch.contiguous(memory_format=torch.channels_last if model.CHANNELS_LAST else torch.contiguous_format)
+                timing = time_call(lambda: net(batch), args.repeat, args.warmup)
+                timing["images_per_sec"] = 1000 * batch_size / timing["median_ms"]
+                record("forward", timing, threads=threads, batch_size=batch_size)
+
+            timing = time_call(lambda: model.predict(content, net, tta=args.tta), args.repeat, args.warmup)
+            timing["images_per_sec"] = 1000 / timing["median_ms"]
+            record("predict", timing, threads=threads)
+
+    write_report(
+        "micro", results, args.output,
+        config={"megapixels": args.megapixels, "repeat": args.repeat, "image_size": model.IMAGE_SIZE,
+                "backend": model.INFERENCE_BACKEND, "precision": model.MODEL_PRECISION, "tta": args.tta},
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Offline bulk inference over a directory tree or a manifest of image paths.
+
+Usage (from src/crop_disease_detection):
+    python bulk_infer.py --input-dir ../../backend/uploads/disease-images --output scores.jsonl
+    python bulk_infer.py --manifest paths.txt --output scores.csv --workers 8 --batch-size 64
+    python bulk_infer.py --input-dir archive/ --output scores.parquet   # needs pyarrow
+
+Images are decoded and transformed in DataLoader worker processes while the
+main process runs batched inference. Completed paths are appended to
+``<output>.ckpt`` after each flush; re-running the same command skips them,
+so an interrupted run resumes where it stopped (at-least-once: a crash
+between a flush and its checkpoint can repeat that one chunk).
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from typing import Iterable, List, Optional, Set
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from images import walk_images
+from model import DEVICE, TTA_MODES, load_model, predict_tensors, preprocess
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ["path", "label", "confidence", "error"]
+
+
+# -----------------------------
+# Inputs
+# -----------------------------
+def read_manifest(path: str) -> Iterable[str]:
+    """One path per line, or a CSV with a 'path' column"""
+    with open(path, newline="", encoding="utf-8") as f:
+        first = f.readline()
+        f.seek(0)
+        if path.endswith(".csv") and "path" in first.split(","):
+            for row in csv.DictReader(f):
+                yield row["path"]
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+
+
+class ImageFileDataset(Dataset):
+    """Decodes in the DataLoader workers; failures travel as error strings"""
+
+    def __init__(self, paths: List[str]):
+        self.paths = paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: int):
+        path = self.paths[index]
+        try:
+            with open(path, "rb") as f:
+                return path, preprocess(f.read()), None
+        except Exception as e:
+            return path, None, str(e)
+
+
+def collate(items):
+    ok = [(path, tensor) for path, tensor, _ in items if tensor is not None]
+    failed = [(path, error) for path, tensor, error in items if tensor is None]
+    batch = torch.stack([tensor for _, tensor in ok]) if ok else None
+    return [path for path, _ in ok], batch, failed
+
+
+def init_worker(_: int) -> None:
+    # Decode workers are single-threaded; the cores belong to the forward pass
+    torch.set_num_threads(1)
+
+
+# -----------------------------
+# Outputs
+# -----------------------------
+class ResultWriter:
+    """Appends result rows as JSONL, CSV or Parquet part files"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lstrip(".").lower()
+        if self.format not in ("jsonl", "csv", "parquet"):
+            raise ValueError("Output must end in .jsonl, .csv or .parquet")
+        if self.format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise RuntimeError("Parquet output requires the 'pyarrow' package") from e
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, rows: List[dict]) -> None:
+        if not rows:
+            return
+        if self.format == "jsonl":
+            with open(self.path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        elif self.format == "csv":
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # A directory of part files, since Parquet files can't be appended to
+            schema = pa.schema([("path", pa.string()), ("label", pa.string()),
+                                ("confidence", pa.float64()), ("error", pa.string())])
+            table = pa.Table.from_pylist([{k: row.get(k) for k in FIELDS} for row in rows], schema=schema)
+            part = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+            pq.write_table(table, part)
+
+
+class Checkpoint:
+    def __init__(self, output: str):
+        self.path = f"{output.rstrip(os.sep)}.ckpt"
+
+    def load(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def mark(self, paths: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(f"{p}\n" for p in paths)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def run(
+    paths: List[str],
+    output: str,
+    workers: int,
+    batch_size: int,
+    flush_every: int,
+    limit: Optional[int] = None,
+    tta: str = "off",
+) -> dict:
+    checkpoint = Checkpoint(output)
+    done = checkpoint.load()
+    todo = [p for p in paths if p not in done]
+    if limit is not None:
+        todo = todo[:limit]
+    logger.info(f"{len(paths)} images listed, {len(done)} already done, {len(todo)} to score")
+    if not todo:
+        return {"scored": 0, "failed": 0, "skipped": len(done)}
+
+    model = load_model()
+    writer = ResultWriter(output)
+    loader = DataLoader(
+        ImageFileDataset(todo),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=collate,
+        worker_init_fn=init_worker if workers > 0 else None,
+        prefetch_factor=4 if workers > 0 else None,
+        persistent_workers=False,
+    )
+
+    pending_rows: List[dict] = []
+    pending_paths: List[str] = []
+    scored = failed = 0
+    start = time.perf_counter()
+
+    def flush() -> None:
+        writer.write(pending_rows)
+        checkpoint.mark(pending_paths)
+        pending_rows.clear()
+        pending_paths.clear()
+
+    for batch_paths, batch, errors in loader:
+        if batch is not None:
+            results = predict_tensors(batch, model, DEVICE, tta=[tta] * len(batch_paths))
+            for path, result in zip(batch_paths, results):
+                pending_rows.append({"path": path, "label": result["label"],
+                                     "confidence": result["confidence"], "error": None})
+            scored += len(batch_paths)
+        for path, error in errors:
+            pending_rows.append({"path": path, "label": None, "confidence": None, "error": error})
+        failed += len(errors)
+        pending_paths.extend(batch_paths + [path for path, _ in errors])
+
+        if len(pending_rows) >= flush_every:
+            flush()
+            elapsed = time.perf_counter() - start
+            logger.info(f"{scored + failed}/{len(todo)} images, {scored / elapsed:.1f} img/s")
+    flush()
+
+    elapsed = time.perf_counter() - start
+    return {"scored": scored, "failed": failed, "skipped": len(done),
+            "seconds": elapsed, "images_per_sec": scored / elapsed if elapsed else 0.0}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk crop disease inference")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir")
+    source.add_argument("--manifest")
+    parser.add_argument("--output", required=True, help="Results file: .jsonl, .csv or .parquet")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode worker processes (0 decodes in the main process)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--flush-every", type=int, default=512, help="Rows between output flushes/checkpoints")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--tta", choices=TTA_MODES, default="off",
+                        help="Test-time augmentation; off by default so throughput and scores are reproducible")
+    args = parser.parse_args()
+
+    # Per-image top-5 logging from predict is far too chatty for archives
+    logging.getLogger("model").setLevel(logging.WARNING)
+
+    paths = list(walk_images(args.input_dir) if args.input_dir else read_manifest(args.manifest))
+    summary = run(paths, args.output, args.workers, args.batch_size, args.flush_every, args.limit, args.tta)
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Cache Configuration
+# -----------------------------
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 1024))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", 24 * 3600))
+# Empty disables the on-disk tier
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "")
+# Most files kept in the on-disk tier; the least recently used go first
+PREDICTION_CACHE_DISK_ENTRIES = int(os.getenv("PREDICTION_CACHE_DISK_ENTRIES", 50_000))
+# How often expired and surplus files are removed from the on-disk tier
+PREDICTION_CACHE_SWEEP_SECONDS = float(os.getenv("PREDICTION_CACHE_SWEEP_SECONDS", 300))
+
+
+def cache_key(image_bytes: bytes, model_version: str, variant: str = "") -> str:
+    """Content hash of the raw upload, scoped to the model that scored it.
+
+    ``variant`` separates results computed with different request options,
+    e.g. a crop restriction; the default leaves existing keys unchanged.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_version.encode("utf-8"))
+    digest.update(b"\0")
+    if variant:
+        digest.update(variant.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+# -----------------------------
+# Prediction Cache
+# -----------------------------
+class PredictionCache:
+    """Size-bounded LRU + TTL cache of prediction results.
+
+    Entries live in memory first; when ``directory`` is set every entry is
+    also written there as a small JSON file so results survive restarts.
+    A memory miss falls back to disk and promotes the entry back into memory.
+    The disk tier is bounded by ``sweep``, which drops expired files and then
+    the least recently used ones beyond ``max_disk_entries``. Async callers
+    use ``aget``/``aset``, which keep the file I/O off the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = PREDICTION_CACHE_SIZE,
+        ttl_seconds: float = PREDICTION_CACHE_TTL,
+        directory: Optional[str] = PREDICTION_CACHE_DIR or None,
+        max_disk_entries: int = PREDICTION_CACHE_DISK_ENTRIES,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Files seen by the last sweep, after it removed what it had to
+        self.disk_entries = 0
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self._get_memory(key)
+        return result if result is not None else self._get_disk(key)
+
+    def set(self, key: str, result: dict) -> None:
+        expires_at = self._set_memory(key, result)
+        self._write_disk(key, expires_at, result)
+
+    async def aget(self, key: str) -> Optional[dict]:
+        """``get`` for async handlers: memory hits inline, the disk tier on a thread"""
+        result = self._get_memory(key)
+        if result is not None:
+            return result
+        if not self.directory:
+            return self._get_disk(key)
+        return await asyncio.get_running_loop().run_in_executor(None, self._get_disk, key)
+
+    async def aset(self, key: str, result: dict) -> None:
+        """``set`` for async handlers: the file is written on a thread"""
+        expires_at = self._set_memory(key, result)
+        if self.directory:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_disk, key, expires_at, result)
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                del self._entries[key]
+        return None
+
+    def _get_disk(self, key: str) -> Optional[dict]:
+        """Disk lookup after a memory miss; counts the lookup's outcome"""
+        entry = self._read_disk(key, time.time())
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, *entry)
+        return dict(entry[1])
+
+    def _set_memory(self, key: str, result: dict) -> float:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, dict(result))
+        return expires_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_entries": self.disk_entries,
+            }
+
+    def _store(self, key: str, expires_at: float, result: dict) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # -----------------------------
+    # Disk Tier
+    # -----------------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, dict]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+
+        if data.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            # The file's mtime is its last use, for the sweep's LRU order
+            os.utime(path)
+        except OSError:
+            pass
+        return data["expires_at"], data["result"]
+
+    def _write_disk(self, key: str, expires_at: float, result: dict) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "result": result}, f, ensure_ascii=False)
+            # Atomic so concurrent readers never see a half-written file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache file {path}: {e}")
+
+    def sweep(self) -> int:
+        """Remove expired files, then the least recently used beyond ``max_disk_entries``.
+
+        A file's mtime is when it was last written or read, and its entry
+        expires ``ttl`` after it was written, so anything untouched for
+        ``ttl`` is expired. Returns the number of files removed.
+        """
+        if not self.directory:
+            return 0
+        now = time.time()
+        files: List[Tuple[float, str]] = []
+        removed = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                try:
+                    mtime = item.stat().st_mtime
+                    if item.name.endswith(".tmp"):
+                        # Left by a writer that died, unless it is still being written
+                        if mtime < now - 60:
+                            os.remove(item.path)
+                        continue
+                    if mtime < now - self.ttl:
+                        os.remove(item.path)
+                        removed += 1
+                    else:
+                        files.append((mtime, item.path))
+                except OSError:
+                    continue
+        surplus = len(files) - self.max_disk_entries
+        if surplus > 0:
+            files.sort()
+            for _, path in files[:surplus]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        self.disk_entries = min(len(files), self.max_disk_entries)
+        if removed:
+            logger.info(f"Removed {removed} prediction cache files; {self.disk_entries} left")
+        return removed
@@ -0,0 +1,393 @@
+"""Two-stage cascade: a small healthy/diseased gate in front of ResNet9.
+
+The gate is a five-layer strided CNN (about 0.3% of ResNet9's multiply-adds)
+that sees the same preprocessed input as the full model and predicts one
+of the crops' ``*___healthy`` classes or "diseased". When it calls an
+image healthy with at least CASCADE_THRESHOLD confidence, that is the
+answer; everything else goes through the full model. It is distilled from
+ResNet9's own predictions, so no labels are needed to train it.
+
+Usage:
+    # Distill a gate from the served ResNet9 on a folder of unlabelled leaves
+    python cascade.py distill --images samples/ --output exported/gate.pth
+
+    # Compute saved and accuracy impact on a labelled (ImageFolder) folder
+    python cascade.py evaluate --images labelled/ --gate exported/gate.pth
+
+Serve it with CASCADE_GATE_PATH=exported/gate.pth.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from backends import example_input
+from images import iter_batches, list_images
+from metrics import CASCADE_DECISIONS, stage_timer
+from model import (
+    DEVICE,
+    IMAGE_SIZE,
+    IN_CHANNELS,
+    MODEL_VERSION,
+    OPTIMIZE_FOR_INFERENCE,
+    class_names,
+    crop_of,
+    fold_batchnorm,
+    load_checkpoint,
+    load_model,
+)
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Cascade Configuration
+# -----------------------------
+# Distilled gate checkpoint; empty disables the cascade
+CASCADE_GATE_PATH = os.getenv("CASCADE_GATE_PATH", "")
+# Gate confidence from which a healthy call skips the full model
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", 0.9))
+GATE_WIDTH = 16
+
+# Gate outputs: each healthy class, then everything else as "diseased"
+HEALTHY_IDS = [i for i, name in enumerate(class_names) if name.endswith("___healthy")]
+GATE_LABELS = [class_names[i] for i in HEALTHY_IDS] + ["diseased"]
+
+
+# -----------------------------
+# Gate Model
+# -----------------------------
+class HealthGate(nn.Module):
+    """Strided conv stack: IMAGE_SIZE input down to 1/32 scale, then one Linear"""
+
+    def __init__(self, in_channels: int = IN_CHANNELS, num_outputs: int = len(GATE_LABELS), width: int = GATE_WIDTH):
+        super().__init__()
+        self.width = width
+
+        def down_block(in_c: int, out_c: int) -> nn.Sequential:
+            return nn.Sequential(
+                nn.Conv2d(in_c, out_c, kernel_size=3, stride=2, padding=1, bias=False),
+                nn.BatchNorm2d(out_c),
+                nn.ReLU(inplace=True),
+            )
+
+        self.features = nn.Sequential(
+            down_block(in_channels, width),
+            down_block(width, 2 * width),
+            down_block(2 * width, 4 * width),
+            down_block(4 * width, 8 * width),
+            down_block(8 * width, 8 * width),
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+        )
+        self.classifier = nn.Linear(8 * width, num_outputs)
+
+    def forward(self, xb: torch.Tensor) -> torch.Tensor:
+        return self.classifier(self.features(xb))
+
+
+def gate_targets(probs: torch.Tensor) -> torch.Tensor:
+    """(N, num_classes) full-model probabilities -> (N, len(GATE_LABELS)) gate probabilities"""
+    healthy = probs[:, HEALTHY_IDS]
+    return torch.cat([healthy, (1 - healthy.sum(dim=1, keepdim=True)).clamp_(min=0)], dim=1)
+
+
+def gate_decisions(
+    probs: torch.Tensor,
+    crops: Sequence[Optional[str]],
+    threshold: float = CASCADE_THRESHOLD,
+) -> List[Optional[Tuple[int, float]]]:
+    """(class id, confidence) for rows the gate confidently calls healthy, else None.
+
+    A healthy call for another crop than the row's ``crops`` restriction
+    doesn't count, so those rows go to the full model as well.
+    """
+    confidence, index = probs.max(dim=1)
+    decisions = []
+    for conf, i, crop in zip(confidence.tolist(), index.tolist(), crops):
+        if i < len(HEALTHY_IDS) and conf >= threshold:
+            class_id = HEALTHY_IDS[i]
+            if crop is None or crop_of(class_names[class_id]) == crop:
+                decisions.append((class_id, conf))
+                continue
+        decisions.append(None)
+    return decisions
+
+
+class Cascade:
+    """First stage handed to ``predict_tensors`` as ``gate``"""
+
+    def __init__(self, gate: nn.Module, device: torch.device = DEVICE, threshold: float = CASCADE_THRESHOLD):
+        self.gate = gate
+        self.device = device
+        self.threshold = threshold
+
+    def __call__(self, batch: torch.Tensor, crops: Sequence[Optional[str]]) -> List[Optional[dict]]:
+        """Result for each row the gate settles, None for rows that need the full model"""
+        with torch.inference_mode(), stage_timer("gate"):
+            probs = F.softmax(self.gate(batch.to(self.device)), dim=1).cpu()
+        results = []
+        for decision in gate_decisions(probs, crops, self.threshold):
+            if decision is None:
+                CASCADE_DECISIONS.labels("full").inc()
+                results.append(None)
+            else:
+                CASCADE_DECISIONS.labels("gate").inc()
+                class_id, confidence = decision
+                results.append({"label": class_names[class_id], "class_id": class_id, "confidence": confidence})
+        return results
+
+
+def load_gate(path: str, device: torch.device = DEVICE) -> Tuple[HealthGate, dict]:
+    """Gate module in eval mode, plus the checkpoint's metadata"""
+    checkpoint = load_checkpoint(path, device)
+    if checkpoint.get("labels") != GATE_LABELS:
+        raise RuntimeError(f"{path} was distilled for a different set of classes")
+    gate = HealthGate(width=checkpoint.get("width", GATE_WIDTH))
+    gate.load_state_dict(checkpoint["model_state_dict"])
+    gate.to(device).eval()
+    if OPTIMIZE_FOR_INFERENCE:
+        fold_batchnorm(gate)
+    metadata = {k: v for k, v in checkpoint.items() if k != "model_state_dict"}
+    return gate, metadata
+
+
+def open_cascade(version: str, path: str = CASCADE_GATE_PATH, device: torch.device = DEVICE) -> Optional[Cascade]:
+    """The cascade for model ``version``; None when disabled or the gate was distilled from another version"""
+    if not path:
+        return None
+    try:
+        gate, metadata = load_gate(path, device)
+    except Exception as e:
+        logger.warning(f"Cascade disabled for '{version}': could not load gate from {path} ({e})")
+        return None
+    if metadata.get("teacher_version") != version:
+        logger.warning(
+            f"Cascade disabled for '{version}': {path} was distilled from '{metadata.get('teacher_version')}'"
+        )
+        return None
+    logger.info(f"Cascade gate loaded from {path} (threshold {CASCADE_THRESHOLD})")
+    return Cascade(gate, device)
+
+
+# -----------------------------
+# Distillation
+# -----------------------------
+def distill(
+    teacher: nn.Module,
+    paths: List[str],
+    epochs: int = 10,
+    batch_size: int = 32,
+    lr: float = 3e-3,
+    temperature: float = 2.0,
+    width: int = GATE_WIDTH,
+) -> HealthGate:
+    """Train a gate on CPU to match the teacher's healthy/diseased probabilities.
+
+    Teacher targets are computed once; images are decoded again each epoch
+    (with random flips) instead of being held in memory.
+    """
+    kept, targets = [], []
+    with torch.inference_mode():
+        for chunk, batch in iter_batches(paths, batch_size):
+            kept.extend(chunk)
+            targets.append(gate_targets(F.softmax(teacher(batch) / temperature, dim=1)))
+    if not kept:
+        raise RuntimeError("No training images could be decoded")
+    soft = dict(zip(kept, torch.cat(targets)))
+    hard = torch.cat(targets).argmax(dim=1)
+    logger.info(
+        f"Distilling from {len(kept)} images "
+        f"({int((hard < len(HEALTHY_IDS)).sum())} healthy per the teacher)"
+    )
+
+    gate = HealthGate(width=width)
+    optimizer = torch.optim.AdamW(gate.parameters(), lr=lr, weight_decay=1e-4)
+    steps = epochs * -(-len(kept) // batch_size)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=lr, total_steps=steps)
+    for epoch in range(epochs):
+        gate.train()
+        order = random.sample(kept, len(kept))
+        total = 0.0
+        for chunk, batch in iter_batches(order, batch_size):
+            flip = torch.rand(len(chunk)) < 0.5
+            batch[flip] = batch[flip].flip(-1)
+            target = torch.stack([soft[path] for path in chunk])
+            log_probs = F.log_softmax(gate(batch) / temperature, dim=1)
+            loss = F.kl_div(log_probs, target, reduction="batchmean") * temperature ** 2
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += loss.item() * len(chunk)
+        logger.info(f"Epoch {epoch + 1}/{epochs}: distillation loss {total / len(kept):.4f}")
+    return gate.eval()
+
+
+def save_gate(gate: HealthGate, path: str, teacher_version: str = MODEL_VERSION) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.save({
+        "model_state_dict": gate.state_dict(),
+        "width": gate.width,
+        "labels": GATE_LABELS,
+        "teacher_version": teacher_version,
+        "image_size": IMAGE_SIZE,
+    }, path)
+    logger.info(f"Saved gate to {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
+
+
+# -----------------------------
+# Evaluation Report
+# -----------------------------
+def count_macs(model: nn.Module, image_size: int = IMAGE_SIZE) -> int:
+    """Multiply-accumulates of the Conv2d and Linear layers for one image"""
+    macs = 0
+
+    def hook(module: nn.Module, inputs: tuple, output: torch.Tensor) -> None:
+        nonlocal macs
+        if isinstance(module, nn.Conv2d):
+            kh, kw = module.kernel_size
+            macs += output.numel() * (module.in_channels // module.groups) * kh * kw
+        else:
+            macs += output.numel() * module.in_features
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    try:
+        with torch.inference_mode():
+            model(example_input(image_size))
+    finally:
+        for handle in handles:
+            handle.remove()
+    return macs
+
+
+def evaluate(
+    teacher: nn.Module,
+    gate: nn.Module,
+    paths: List[str],
+    thresholds: Sequence[float] = (CASCADE_THRESHOLD,),
+    batch_size: int = 16,
+) -> dict:
+    """Share of images the gate settles, compute saved, and accuracy versus the full model.
+
+    Both models score every image once; each threshold is then replayed on
+    the stored outputs. With images in folders named after a class
+    (ImageFolder layout) accuracy against those labels is reported too,
+    including how many diseased leaves the gate passed as healthy.
+    """
+    full_ids, gate_probs, labels = [], [], []
+    full_time = gate_time = 0.0
+    with torch.inference_mode():
+        for chunk, batch in iter_batches(paths, batch_size):
+            begin = time.perf_counter()
+            full_ids.append(teacher(batch).argmax(dim=1))
+            full_time += time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            gate_probs.append(F.softmax(gate(batch), dim=1))
+            gate_time += time.perf_counter() - begin
+
+            for path in chunk:
+                folder = os.path.basename(os.path.dirname(path))
+                labels.append(class_names.index(folder) if folder in class_names else -1)
+    if not full_ids:
+        raise RuntimeError("No evaluation images could be decoded")
+
+    full_ids, gate_probs, labels = torch.cat(full_ids), torch.cat(gate_probs), torch.tensor(labels)
+    images = len(full_ids)
+    labelled = labels >= 0
+    healthy = torch.zeros(len(class_names), dtype=torch.bool)
+    healthy[HEALTHY_IDS] = True
+    full_macs, gate_macs = count_macs(teacher), count_macs(gate)
+    full_ms, gate_ms = 1000 * full_time / images, 1000 * gate_time / images
+
+    report = {
+        "images": images,
+        "labelled": int(labelled.sum()),
+        "full_macs_per_image": full_macs,
+        "gate_macs_per_image": gate_macs,
+        "full_ms_per_image": full_ms,
+        "gate_ms_per_image": gate_ms,
+    }
+    if labelled.any():
+        report["full_accuracy"] = float((full_ids == labels)[labelled].float().mean())
+    report["thresholds"] = []
+
+    for threshold in thresholds:
+        gated = torch.tensor([d is not None for d in gate_decisions(gate_probs, [None] * images, threshold)])
+        cascade_ids = full_ids.clone()
+        cascade_ids[gated] = torch.tensor(HEALTHY_IDS)[gate_probs[gated].argmax(dim=1)]
+        share = float(gated.float().mean())
+        entry = {
+            "threshold": threshold,
+            "gated_fraction": share,
+            "agreement_with_full": float((cascade_ids == full_ids).float().mean()),
+            # Leaves the full model calls diseased that never reach it
+            "diseased_passed_as_healthy": int((gated & ~healthy[full_ids]).sum()),
+            "compute_saved": 1 - (gate_macs + (1 - share) * full_macs) / full_macs,
+            "estimated_ms_per_image": gate_ms + (1 - share) * full_ms,
+            "estimated_speedup": full_ms / (gate_ms + (1 - share) * full_ms),
+        }
+        if labelled.any():
+            entry["accuracy"] = float((cascade_ids == labels)[labelled].float().mean())
+            entry["labelled_diseased_passed_as_healthy"] = int((gated & labelled & ~healthy[labels.clamp(min=0)]).sum())
+        report["thresholds"].append(entry)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Healthy/diseased gate for a two-stage ResNet9 cascade")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dis = sub.add_parser("distill", help="Distill a gate from ResNet9 and write its checkpoint")
+    dis.add_argument("--images", required=True)
+    dis.add_argument("--output", default=CASCADE_GATE_PATH or "exported/gate.pth")
+    dis.add_argument("--epochs", type=int, default=10)
+    dis.add_argument("--batch-size", type=int, default=32)
+    dis.add_argument("--lr", type=float, default=3e-3)
+    dis.add_argument("--temperature", type=float, default=2.0)
+    dis.add_argument("--width", type=int, default=GATE_WIDTH)
+    dis.add_argument("--max-images", type=int, default=20000)
+
+    ev = sub.add_parser("evaluate", help="Measure compute saved and accuracy impact of a gate")
+    ev.add_argument("--images", required=True)
+    ev.add_argument("--gate", default=CASCADE_GATE_PATH or "exported/gate.pth")
+    ev.add_argument("--thresholds", default=f"0.8,0.9,0.95,0.99,{CASCADE_THRESHOLD}")
+    ev.add_argument("--batch-size", type=int, default=16)
+    ev.add_argument("--report", help="Also write the JSON report to this path")
+
+    for command in (dis, ev):
+        command.add_argument("--weights", help="Teacher checkpoint (default: the served weights)")
+
+    dis.add_argument("--teacher-version", default=MODEL_VERSION, help="Model version the gate will serve with")
+
+    args = parser.parse_args()
+    cpu = torch.device("cpu")
+    teacher = load_model(
+        device=cpu, token=os.getenv("HF_TOKEN"), backend="eager", precision="fp32", weights_path=args.weights,
+    )
+
+    if args.command == "distill":
+        paths = list_images(args.images)[:args.max_images]
+        gate = distill(teacher, paths, args.epochs, args.batch_size, args.lr, args.temperature, args.width)
+        save_gate(gate, args.output, args.teacher_version)
+        return
+
+    gate, _ = load_gate(args.gate, cpu)
+    thresholds = sorted({float(t) for t in args.thresholds.split(",") if t.strip()})
+    report = evaluate(teacher, gate, list_images(args.images), thresholds, args.batch_size)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
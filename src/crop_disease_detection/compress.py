@@ -0,0 +1,393 @@
+"""Channel pruning plus distillation fine-tuning to shrink ResNet9 for small CPUs.
+
+Usage:
+    # Prune to a quarter of the multiply-adds, fine-tune, report and save
+    python compress.py --images samples/ --flops-budget 0.25 --output exported/model_pruned.pth
+
+    # Prune until one image takes at most 60 ms on one thread of this machine
+    python compress.py --images samples/ --latency-budget-ms 60 --threads 1 --eval-images holdout/
+
+Channels of every conv_block are ranked by the magnitude of their
+BatchNorm scale, normalised per layer. One global cut on those scores is
+bisected until the narrower model fits the budget, widths are rounded to
+multiples of 8, and the surviving channels' weights are copied into the
+smaller ResNet9. It is then fine-tuned on CPU to match the current model's
+softened predictions (plus the folder labels when the images are in
+ImageFolder layout).
+
+The checkpoint records its ``widths``, so load_model reads it like any
+other: serve it with MODEL_PATH, or deploy it as a new version.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from backends import EXPORT_DIR, example_input
+from images import iter_batches, list_images
+from model import (
+    CHANNELS_LAST,
+    IMAGE_SIZE,
+    IN_CHANNELS,
+    MODEL_FILENAME,
+    MODEL_VERSION,
+    REPO_ID,
+    ResNet9,
+    class_names,
+    load_checkpoint,
+    model_from_checkpoint,
+    optimize_for_inference,
+)
+from model_store import resolve_weights
+
+logger = logging.getLogger(__name__)
+
+WIDTH_MULTIPLE = 8
+
+
+# -----------------------------
+# Channel Importance
+# -----------------------------
+def _bn(block: nn.Sequential) -> nn.BatchNorm2d:
+    return block[1]
+
+
+def channel_groups(model: ResNet9) -> Dict[str, List[nn.BatchNorm2d]]:
+    """BatchNorms whose output channels make up each width in ``ResNet9.widths``.
+
+    Blocks joined by a residual add share their channels, so they are
+    pruned together.
+    """
+    return {
+        "conv1": [_bn(model.conv1)],
+        "conv2": [_bn(model.conv2), _bn(model.res1[1])],
+        "res1": [_bn(model.res1[0])],
+        "conv3": [_bn(model.conv3)],
+        "conv4": [_bn(model.conv4), _bn(model.res2[1])],
+        "res2": [_bn(model.res2[0])],
+    }
+
+
+def channel_importance(model: ResNet9) -> Dict[str, torch.Tensor]:
+    """Per-channel |BatchNorm scale|, summed over a group and scaled so each group's best is 1"""
+    scores = {}
+    for group, norms in channel_groups(model).items():
+        score = sum(bn.weight.detach().abs() for bn in norms)
+        scores[group] = score / score.max().clamp(min=1e-12)
+    return scores
+
+
+def select_channels(importance: Dict[str, torch.Tensor], cut: float) -> Dict[str, torch.Tensor]:
+    """Sorted indices of the channels kept per group: those scoring above ``cut``, in [0, 1)"""
+    keep = {}
+    for group, score in importance.items():
+        count = int((score > cut).sum())
+        count = -(-count // WIDTH_MULTIPLE) * WIDTH_MULTIPLE
+        count = min(len(score), max(WIDTH_MULTIPLE, count))
+        keep[group] = torch.topk(score, count).indices.sort().values
+    return keep
+
+
+# -----------------------------
+# Cost Model
+# -----------------------------
+def resnet9_macs(widths: Dict[str, int], num_classes: int = len(class_names), image_size: int = IMAGE_SIZE) -> int:
+    """Multiply-adds of one forward pass: 3x3 convs at their feature-map size plus the Linear"""
+    w = widths
+    s = image_size
+    convs = (
+        s * s * (IN_CHANNELS * w["conv1"] + w["conv1"] * w["conv2"])
+        + (s // 2) ** 2 * (2 * w["conv2"] * w["res1"] + w["conv2"] * w["conv3"])
+        + (s // 4) ** 2 * w["conv3"] * w["conv4"]
+        + (s // 8) ** 2 * 2 * w["conv4"] * w["res2"]
+    )
+    return 9 * convs + w["conv4"] * num_classes
+
+
+def measure_latency(model: nn.Module, threads: int = 1, runs: int = 10) -> float:
+    """Median milliseconds for one image through the inference-optimized model on ``threads`` threads"""
+    model = optimize_for_inference(copy.deepcopy(model).cpu().eval(), verify=False)
+    memory_format = torch.channels_last if CHANNELS_LAST else torch.contiguous_format
+    xb = example_input(IMAGE_SIZE).to(memory_format=memory_format)
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        timings = []
+        with torch.inference_mode():
+            for i in range(runs + 2):
+                start = time.perf_counter()
+                model(xb)
+                if i >= 2:
+                    timings.append(1000 * (time.perf_counter() - start))
+    finally:
+        torch.set_num_threads(previous)
+    return statistics.median(timings)
+
+
+def fit_budget(
+    model: ResNet9,
+    fits: Callable[[Dict[str, int]], bool],
+    steps: int = 12,
+) -> Dict[str, torch.Tensor]:
+    """Channels to keep: the mildest global cut whose widths satisfy ``fits``"""
+    importance = channel_importance(model)
+    checked: Dict[Tuple[int, ...], bool] = {}
+
+    def ok(cut: float) -> bool:
+        widths = {group: len(idx) for group, idx in select_channels(importance, cut).items()}
+        key = tuple(widths.values())
+        if key not in checked:
+            checked[key] = fits(widths)
+            logger.info(f"Widths {widths}: {'within' if checked[key] else 'over'} budget")
+        return checked[key]
+
+    if fits(model.widths):
+        logger.info("The unpruned model already fits the budget")
+        return {group: torch.arange(width) for group, width in model.widths.items()}
+    if not ok(1.0):
+        raise ValueError("The budget can't be met even with every layer at its minimum width")
+    low, high = 0.0, 1.0
+    for _ in range(steps):
+        mid = (low + high) / 2
+        if ok(mid):
+            high = mid
+        else:
+            low = mid
+    return select_channels(importance, high)
+
+
+# -----------------------------
+# Pruning
+# -----------------------------
+def _copy_block(src: nn.Sequential, dst: nn.Sequential, out_idx: torch.Tensor, in_idx: torch.Tensor) -> None:
+    conv, bn = src[0], src[1]
+    dst[0].weight.copy_(conv.weight[out_idx][:, in_idx])
+    dst[0].bias.copy_(conv.bias[out_idx])
+    for name in ("weight", "bias", "running_mean", "running_var"):
+        getattr(dst[1], name).copy_(getattr(bn, name)[out_idx])
+
+
+def prune(model: ResNet9, keep: Dict[str, torch.Tensor]) -> ResNet9:
+    """Narrower ResNet9 holding only the ``keep`` channels of ``model``"""
+    widths = {group: len(idx) for group, idx in keep.items()}
+    num_classes = model.classifier[2].out_features
+    pruned = ResNet9(in_channels=IN_CHANNELS, num_classes=num_classes, widths=widths)
+    k = keep
+    inputs = torch.arange(IN_CHANNELS)
+    with torch.no_grad():
+        _copy_block(model.conv1, pruned.conv1, k["conv1"], inputs)
+        _copy_block(model.conv2, pruned.conv2, k["conv2"], k["conv1"])
+        _copy_block(model.res1[0], pruned.res1[0], k["res1"], k["conv2"])
+        _copy_block(model.res1[1], pruned.res1[1], k["conv2"], k["res1"])
+        _copy_block(model.conv3, pruned.conv3, k["conv3"], k["conv2"])
+        _copy_block(model.conv4, pruned.conv4, k["conv4"], k["conv3"])
+        _copy_block(model.res2[0], pruned.res2[0], k["res2"], k["conv4"])
+        _copy_block(model.res2[1], pruned.res2[1], k["conv4"], k["res2"])
+        pruned.classifier[2].weight.copy_(model.classifier[2].weight[:, k["conv4"]])
+        pruned.classifier[2].bias.copy_(model.classifier[2].bias)
+    return pruned.eval()
+
+
+# -----------------------------
+# Data
+# -----------------------------
+def load_dataset(paths: Sequence[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Decoded images as one uint8 (N, C, H, W) tensor, plus folder labels (-1 if not a class)"""
+    images, labels = [], []
+    for kept, batch in iter_batches(paths, batch_size=64):
+        images.append(batch.mul_(255).round_().to(torch.uint8))
+        for path in kept:
+            folder = os.path.basename(os.path.dirname(path))
+            labels.append(class_names.index(folder) if folder in class_names else -1)
+    if not images:
+        raise RuntimeError("No images could be decoded")
+    return torch.cat(images), torch.tensor(labels)
+
+
+def _as_input(images: torch.Tensor) -> torch.Tensor:
+    return images.float().div_(255)
+
+
+def logits_of(model: nn.Module, images: torch.Tensor, batch_size: int = 32, flip: bool = False) -> torch.Tensor:
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, len(images), batch_size):
+            xb = _as_input(images[start:start + batch_size])
+            outputs.append(model(xb.flip(-1) if flip else xb))
+    return torch.cat(outputs)
+
+
+# -----------------------------
+# Distillation
+# -----------------------------
+def distill(
+    student: ResNet9,
+    teacher: nn.Module,
+    images: torch.Tensor,
+    labels: torch.Tensor,
+    epochs: int = 5,
+    batch_size: int = 16,
+    lr: float = 5e-4,
+    temperature: float = 4.0,
+    alpha: float = 0.9,
+) -> ResNet9:
+    """Fine-tune ``student`` on CPU to match ``teacher``'s softened outputs.
+
+    Teacher logits for every image and its mirror are computed once up
+    front. Labelled images (label >= 0) add a cross-entropy term weighted
+    ``1 - alpha``.
+    """
+    targets = {False: logits_of(teacher, images), True: logits_of(teacher, images, flip=True)}
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    steps = epochs * -(-len(images) // batch_size)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, steps)
+
+    for epoch in range(epochs):
+        student.train()
+        order = torch.randperm(len(images))
+        total = 0.0
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            flip = random.random() < 0.5
+            xb = _as_input(images[idx])
+            outputs = student(xb.flip(-1) if flip else xb)
+            soft = F.softmax(targets[flip][idx] / temperature, dim=1)
+            loss = F.kl_div(
+                F.log_softmax(outputs / temperature, dim=1), soft, reduction="batchmean"
+            ) * temperature ** 2
+            known = labels[idx] >= 0
+            if known.any():
+                loss = alpha * loss + (1 - alpha) * F.cross_entropy(outputs[known], labels[idx][known])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += loss.item() * len(idx)
+        logger.info(f"Epoch {epoch + 1}/{epochs}: loss {total / len(images):.4f}")
+    return student.eval()
+
+
+# -----------------------------
+# Report
+# -----------------------------
+def describe(
+    model: ResNet9,
+    images: torch.Tensor,
+    labels: torch.Tensor,
+    reference: Optional[torch.Tensor],
+    threads: int,
+) -> dict:
+    """Cost and quality of ``model`` on the evaluation images"""
+    predicted = logits_of(model, images).argmax(dim=1)
+    report = {
+        "widths": dict(model.widths),
+        "macs_per_image": resnet9_macs(model.widths, model.classifier[2].out_features),
+        "parameters": sum(p.numel() for p in model.parameters()),
+        "latency_ms": measure_latency(model, threads),
+    }
+    if reference is not None:
+        report["top1_agreement"] = float((predicted == reference).float().mean())
+    known = labels >= 0
+    if known.any():
+        report["accuracy"] = float((predicted[known] == labels[known]).float().mean())
+    return report
+
+
+def save_compressed(model: ResNet9, path: str, report: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.save({
+        "model_state_dict": model.state_dict(),
+        "num_classes": model.classifier[2].out_features,
+        "widths": dict(model.widths),
+        "image_size": IMAGE_SIZE,
+        "compressed_from": MODEL_VERSION,
+        "compression": report,
+    }, path)
+    logger.info(f"Saved compressed model to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prune and distill ResNet9 to a FLOPs or latency budget")
+    parser.add_argument("--images", required=True, help="Training images (ImageFolder layout adds labels)")
+    parser.add_argument("--eval-images", help="Held-out images for the report (default: a split of --images)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of --images held out without --eval-images")
+    parser.add_argument("--weights", help="Checkpoint to compress (default: the served weights)")
+    parser.add_argument("--output", default=os.path.join(EXPORT_DIR, "model_pruned.pth"))
+    budget = parser.add_mutually_exclusive_group(required=True)
+    budget.add_argument("--flops-budget", type=float, help="Multiply-adds to keep, as a fraction of the current model")
+    budget.add_argument("--latency-budget-ms", type=float, help="Single-image latency to reach on --threads threads")
+    parser.add_argument("--threads", type=int, default=1, help="Intra-op threads for latency measurements")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=5e-4)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.9, help="Weight of the distillation term versus labels")
+    parser.add_argument("--max-images", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Also write the JSON report to this path")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    weights = args.weights or resolve_weights(REPO_ID, MODEL_FILENAME, token=os.getenv("HF_TOKEN"))
+    teacher = model_from_checkpoint(load_checkpoint(weights, torch.device("cpu"))).eval()
+
+    paths = list_images(args.images)[:args.max_images]
+    if args.eval_images:
+        eval_paths = list_images(args.eval_images)
+    else:
+        random.shuffle(paths)
+        split = max(1, int(len(paths) * args.holdout))
+        paths, eval_paths = paths[split:], paths[:split]
+    images, labels = load_dataset(paths)
+    eval_images, eval_labels = load_dataset(eval_paths)
+    logger.info(f"{len(images)} training and {len(eval_images)} evaluation images")
+
+    num_classes = teacher.classifier[2].out_features
+    base_macs = resnet9_macs(teacher.widths, num_classes)
+
+    def fits(widths: Dict[str, int]) -> bool:
+        if args.flops_budget is not None:
+            return resnet9_macs(widths, num_classes) <= args.flops_budget * base_macs
+        candidate = ResNet9(in_channels=IN_CHANNELS, num_classes=num_classes, widths=widths)
+        return measure_latency(candidate, args.threads, runs=5) <= args.latency_budget_ms
+
+    pruned = prune(teacher, fit_budget(teacher, fits))
+
+    original = describe(teacher, eval_images, eval_labels, None, args.threads)
+    reference = logits_of(teacher, eval_images).argmax(dim=1)
+    report = {
+        "threads": args.threads,
+        "image_size": IMAGE_SIZE,
+        "budget": {"flops": args.flops_budget, "latency_ms": args.latency_budget_ms},
+        "original": original,
+        "pruned": describe(pruned, eval_images, eval_labels, reference, args.threads),
+    }
+    # Serving speed of the teacher doesn't matter here, only its outputs
+    fast_teacher = optimize_for_inference(copy.deepcopy(teacher), verify=False)
+    student = distill(
+        pruned, fast_teacher, images, labels, args.epochs, args.batch_size, args.lr, args.temperature, args.alpha,
+    )
+    report["distilled"] = describe(student, eval_images, eval_labels, reference, args.threads)
+    report["speedup"] = original["latency_ms"] / report["distilled"]["latency_ms"]
+    report["macs_ratio"] = report["distilled"]["macs_per_image"] / original["macs_per_image"]
+
+    save_compressed(student, args.output, report)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
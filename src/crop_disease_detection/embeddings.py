@@ -0,0 +1,275 @@
+"""In-process index of past uploads' embeddings for near-duplicate and similar-case lookups.
+
+Vectors are the model's L2-normalised 512-d pooled features (see
+``ResNet9.features``; pruned models have fewer), computed in the same
+forward pass as the prediction and kept as float16 in preallocated NumPy
+arrays: 1 KB per image, so a few hundred thousand past uploads fit in a
+few hundred MB. Search is a brute-force matrix product over every vector.
+It goes through torch, because NumPy has no fast float16 matmul. Once the
+index is full the oldest entries are overwritten.
+
+Reusing past diagnoses is opt-in (``EMBEDDING_DUPLICATE_THRESHOLD`` at or
+below 1). Only then are uploads indexed and embeddings computed on every
+request: an exact re-upload is answered from the index by its hash before
+any inference, and a near-duplicate by embedding gets the stored diagnosis
+in place of classification and TTA (the embedding itself still needs the
+forward pass).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from model import CROPS, class_names
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Embedding Index Configuration
+# -----------------------------
+# Most vectors kept per model version; 0 disables the index
+EMBEDDING_INDEX_SIZE = int(os.getenv("EMBEDDING_INDEX_SIZE", 100_000))
+# Empty keeps the index in memory only
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "")
+EMBEDDING_INDEX_SAVE_SECONDS = float(os.getenv("EMBEDDING_INDEX_SAVE_SECONDS", 300))
+# Cosine similarity from which an upload counts as a near-duplicate and gets the
+# stored diagnosis; above 1 (the default) turns reuse, and indexing uploads, off
+EMBEDDING_DUPLICATE_THRESHOLD = float(os.getenv("EMBEDDING_DUPLICATE_THRESHOLD", 1.01))
+EMBEDDING_DIM = 512
+
+_INITIAL_ROWS = 1024
+# Crop restrictions are stored as small ints: 0 for none, else 1 + index in CROPS
+_CROP_CODES = {crop: i + 1 for i, crop in enumerate(CROPS)}
+
+
+def _crop_code(crop: Optional[str]) -> int:
+    return _CROP_CODES.get(crop, 0) if crop else 0
+
+
+def _empty_columns(rows: int, dim: int) -> Dict[str, np.ndarray]:
+    return {
+        "vectors": np.zeros((rows, dim), dtype=np.float16),
+        # sha256 hex of the upload, as used for stored upload names
+        "image_ids": np.zeros(rows, dtype="S64"),
+        "class_ids": np.zeros(rows, dtype=np.int16),
+        "confidences": np.zeros(rows, dtype=np.float32),
+        "crops": np.zeros(rows, dtype=np.int8),
+        "created": np.zeros(rows, dtype=np.float64),
+    }
+
+
+class EmbeddingIndex:
+    """Fixed-capacity ring of past uploads' embeddings and diagnoses.
+
+    ``add`` is called from the event loop and ``search``/``match`` from the
+    inference workers. Writers take a lock; searches read a snapshot of the
+    columns without one, so a search racing an overwrite of the oldest row
+    can at worst score that single row against stale data.
+    """
+
+    def __init__(
+        self,
+        capacity: int = EMBEDDING_INDEX_SIZE,
+        path: Optional[str] = None,
+        dim: int = EMBEDDING_DIM,
+        duplicate_threshold: float = EMBEDDING_DUPLICATE_THRESHOLD,
+    ):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.path = path
+        self.dim = dim
+        self.duplicate_threshold = duplicate_threshold
+        self.dirty = False
+        self._columns = _empty_columns(min(capacity, _INITIAL_ROWS), dim)
+        self._size = 0
+        self._next = 0
+        # image id -> row, so a re-indexed image replaces its old row
+        self._rows: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matching(self) -> bool:
+        """Whether past diagnoses are reused (and so uploads are indexed at all)"""
+        return self.duplicate_threshold <= 1
+
+    def stats(self) -> dict:
+        return {
+            "vectors": self._size,
+            "capacity": self.capacity,
+            "bytes": sum(column.nbytes for column in self._columns.values()),
+        }
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def _grow(self) -> None:
+        rows = min(self.capacity, 2 * len(self._columns["vectors"]))
+        columns = _empty_columns(rows, self.dim)
+        for name, column in self._columns.items():
+            columns[name][:self._size] = column[:self._size]
+        self._columns = columns
+
+    def add(self, embedding: np.ndarray, image_id: str, result: dict, crop: Optional[str] = None) -> None:
+        """Index one upload's normalised embedding with its diagnosis"""
+        key = image_id.encode("ascii")
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                if self._size == len(self._columns["vectors"]) and self._size < self.capacity:
+                    self._grow()
+                row = self._next
+                if self._size == self.capacity:
+                    self._rows.pop(bytes(self._columns["image_ids"][row]), None)
+                else:
+                    self._size += 1
+                self._next = (row + 1) % self.capacity
+            columns = self._columns
+            columns["vectors"][row] = embedding
+            columns["image_ids"][row] = key
+            columns["class_ids"][row] = result["class_id"]
+            columns["confidences"][row] = result["confidence"]
+            columns["crops"][row] = _crop_code(crop)
+            columns["created"][row] = time.time()
+            self._rows[key] = row
+            self.dirty = True
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def search(self, queries: np.ndarray, k: int = 5) -> List[List[tuple]]:
+        """Top ``k`` (row, cosine similarity) pairs for each (M, dim) query row"""
+        size, columns = self._size, self._columns
+        if size == 0:
+            return [[] for _ in range(len(queries))]
+        vectors = torch.from_numpy(columns["vectors"][:size])
+        scores = (vectors @ torch.from_numpy(np.asarray(queries, dtype=np.float16)).T).T.float()
+        top = torch.topk(scores, min(k, size), dim=1)
+        return [
+            [(int(row), float(score)) for score, row in zip(scores_row, rows)]
+            for scores_row, rows in zip(top.values, top.indices)
+        ]
+
+    def describe_row(self, row: int, similarity: float) -> dict:
+        columns = self._columns
+        crop = int(columns["crops"][row])
+        return {
+            "image_id": columns["image_ids"][row].decode("ascii"),
+            "label": class_names[int(columns["class_ids"][row])],
+            "confidence": round(float(columns["confidences"][row]), 4),
+            "crop": CROPS[crop - 1] if crop else None,
+            "similarity": round(similarity, 4),
+            "seen_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(columns["created"][row])),
+        }
+
+    def similar(self, embedding: np.ndarray, k: int = 5) -> List[dict]:
+        """Past cases most like one upload, best first"""
+        return [self.describe_row(row, score) for row, score in self.search(embedding[None, :], k)[0]]
+
+    def _diagnosis(self, row: int) -> dict:
+        class_id = int(self._columns["class_ids"][row])
+        return {
+            "label": class_names[class_id],
+            "class_id": class_id,
+            "confidence": float(self._columns["confidences"][row]),
+        }
+
+    def lookup(self, image_id: str, crop: Optional[str] = None) -> Optional[dict]:
+        """Stored diagnosis of these exact bytes under the same crop restriction, if indexed"""
+        if not self.matching:
+            return None
+        row = self._rows.get(image_id.encode("ascii"))
+        if row is None or self._columns["crops"][row] != _crop_code(crop):
+            return None
+        return self._diagnosis(row)
+
+    def match(self, embeddings: np.ndarray, crops: Sequence[Optional[str]]) -> List[Optional[dict]]:
+        """Closest past case for each near-duplicate row, else None.
+
+        A past case only counts if it was scored under the same crop
+        restriction, since that changes which labels were possible.
+        """
+        if self._size == 0 or not self.matching:
+            return [None] * len(embeddings)
+        columns = self._columns
+        matches = []
+        for (best,), crop in zip(self.search(embeddings, k=1), crops):
+            row, score = best
+            if score >= self.duplicate_threshold and columns["crops"][row] == _crop_code(crop):
+                matches.append(self._diagnosis(row))
+            else:
+                matches.append(None)
+        return matches
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the index as one uncompressed .npz of float16 vectors and metadata"""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            # Oldest first, so a reload keeps overwriting in the same order
+            order = np.arange(self._size)
+            if self._size == self.capacity:
+                order = np.roll(order, -self._next)
+            snapshot = {name: column[order] for name, column in self._columns.items()}
+            self.dirty = False
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(snapshot['vectors'])} embeddings to {path}")
+
+    def load(self, path: Optional[str] = None) -> int:
+        """Replace the contents with a saved index; returns the number of vectors loaded"""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        with np.load(path) as saved:
+            if saved["vectors"].shape[1] != self.dim:
+                logger.warning(f"Ignoring {path}: embeddings are {saved['vectors'].shape[1]}-d, expected {self.dim}")
+                return 0
+            # Keep the newest entries if the capacity has shrunk since
+            loaded = {name: saved[name][-self.capacity:] for name in _empty_columns(0, self.dim)}
+
+        size = len(loaded["vectors"])
+        with self._lock:
+            self._columns = _empty_columns(max(size, min(self.capacity, _INITIAL_ROWS)), self.dim)
+            for name, column in loaded.items():
+                self._columns[name][:size] = column
+            self._size = size
+            self._next = size % self.capacity
+            self._rows = {bytes(key): row for row, key in enumerate(self._columns["image_ids"][:size])}
+        logger.info(f"Loaded {size} embeddings from {path}")
+        return size
+
+
+def index_path_for(version: str) -> Optional[str]:
+    """Per-version index file, or None when the index isn't persisted"""
+    if not EMBEDDING_INDEX_DIR:
+        return None
+    return os.path.join(EMBEDDING_INDEX_DIR, re.sub(r"[^A-Za-z0-9._-]+", "_", version) + ".npz")
+
+
+def open_index(version: str, dim: int = EMBEDDING_DIM) -> Optional[EmbeddingIndex]:
+    """The embedding index for ``version``, restored from disk if saved; None when disabled"""
+    if EMBEDDING_INDEX_SIZE <= 0:
+        return None
+    index = EmbeddingIndex(path=index_path_for(version), dim=dim)
+    try:
+        index.load()
+    except Exception as e:
+        logger.warning(f"Could not load embedding index for '{version}': {e}")
+    return index
@@ -0,0 +1,56 @@
+"""Export the served checkpoint to TorchScript and/or ONNX.
+
+Usage:
+    python export.py --format torchscript onnx
+
+Each artifact is checked against the eager model before the command
+succeeds, and the checkpoint's sha256 is recorded next to it so the server
+only reuses it for those weights. Point INFERENCE_BACKEND (and optionally
+TORCHSCRIPT_MODEL_PATH / ONNX_MODEL_PATH) at the result to serve it.
+"""
+import argparse
+import logging
+import os
+
+from backends import (
+    ONNX_MODEL_PATH,
+    TORCHSCRIPT_MODEL_PATH,
+    OnnxBackend,
+    check_parity,
+    export_onnx,
+    export_torchscript,
+    record_weights,
+)
+from model import IMAGE_SIZE, MODEL_FILENAME, REPO_ID, load_model
+from model_store import resolve_weights, sha256_file
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export ResNet9 for optimized inference")
+    parser.add_argument("--format", nargs="+", choices=["torchscript", "onnx"], default=["torchscript", "onnx"])
+    parser.add_argument("--torchscript-path", default=TORCHSCRIPT_MODEL_PATH)
+    parser.add_argument("--onnx-path", default=ONNX_MODEL_PATH)
+    parser.add_argument("--parity-batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    weights_path = resolve_weights(REPO_ID, MODEL_FILENAME, token=os.getenv("HF_TOKEN"))
+    weights_sha256 = sha256_file(weights_path)
+    model = load_model(backend="eager", weights_path=weights_path)
+
+    if "torchscript" in args.format:
+        scripted = export_torchscript(model, args.torchscript_path, IMAGE_SIZE)
+        report = check_parity(model, scripted, IMAGE_SIZE, args.parity_batch_size)
+        record_weights(args.torchscript_path, weights_sha256)
+        print(f"torchscript: {args.torchscript_path} {report}")
+
+    if "onnx" in args.format:
+        export_onnx(model, args.onnx_path, IMAGE_SIZE)
+        report = check_parity(model, OnnxBackend(args.onnx_path), IMAGE_SIZE, args.parity_batch_size)
+        record_weights(args.onnx_path, weights_sha256)
+        print(f"onnx: {args.onnx_path} {report}")
+
+
+if __name__ == "__main__":
+    main()
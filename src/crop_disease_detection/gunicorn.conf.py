@@ -0,0 +1,62 @@
+"""Multi-worker serving with one shared copy of the model weights.
+
+Usage (from src/crop_disease_detection):
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the gunicorn master (``preload_app``), so the
+weights are downloaded/loaded and optimized a single time and every forked
+worker maps the same physical pages read-only (copy-on-write, never
+written during inference). See README_SETUP.md for the sizing policy.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+cores = os.cpu_count() or 1
+
+# -----------------------------
+# Sizing policy
+# -----------------------------
+# Processes: half the cores by default, each running INFERENCE_WORKERS
+# pool threads whose torch ops get cores / (processes * pool threads) threads.
+workers = int(os.getenv("WEB_CONCURRENCY", max(1, cores // 2)))
+os.environ.setdefault("SERVER_WORKERS", str(workers))
+# One pool thread per process is usually best once there are several processes
+os.environ.setdefault("INFERENCE_WORKERS", "1")
+
+# Workers write their Prometheus metrics to files here and /metrics sums them
+# (set before the app, and so prometheus_client, is imported); cleared per start
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(
+        tempfile.gettempdir(), f"crop-disease-metrics-{os.getpid()}"
+    )
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # Move everything allocated while loading the model out of the GC's reach,
+    # so collections in the workers don't write to (and un-share) those pages
+    gc.freeze()
+    server.log.info(f"Model preloaded; forking {workers} workers sharing its weights")
+
+
+def post_fork(server, worker):
+    from workers import configure_torch_threads
+
+    # torch resets its intra-op pool in a forked child; size it for this worker
+    configure_torch_threads()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the exited worker's live gauges (queue depths, cache size)
+    multiprocess.mark_process_dead(worker.pid)
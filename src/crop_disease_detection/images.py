@@ -0,0 +1,48 @@
+"""Finding image files on disk and loading them as model-input batches.
+
+Shared by the offline tools (bulk_infer, quantize, cascade, compress) and
+by uploads.py, so they all agree on what counts as an image file.
+"""
+import logging
+import os
+from typing import Iterator, List, Sequence, Tuple
+
+import torch
+
+from model import preprocess
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def is_image_path(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def walk_images(root: str) -> Iterator[str]:
+    """Image files under ``root``, lazily, sorted within each directory"""
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            if is_image_path(name):
+                yield os.path.join(directory, name)
+
+
+def list_images(folder: str) -> List[str]:
+    """All image files under ``folder``, sorted for reproducible runs"""
+    return sorted(walk_images(folder))
+
+
+def iter_batches(paths: Sequence[str], batch_size: int) -> Iterator[Tuple[List[str], torch.Tensor]]:
+    """(paths, batch) pairs; undecodable images are skipped, so the paths are those actually in the batch"""
+    for start in range(0, len(paths), batch_size):
+        kept, tensors = [], []
+        for path in paths[start:start + batch_size]:
+            try:
+                with open(path, "rb") as f:
+                    tensors.append(preprocess(f.read()))
+                kept.append(path)
+            except Exception as e:
+                logger.warning(f"Skipping {path}: {e}")
+        if tensors:
+            yield kept, torch.stack(tensors)
@@ -1,12 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, File, Form, UploadFile, Request, HTTPException, Header, Query
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from model import load_model, predict  # Changed: import predict instead of get_prediction_from_path
-import shutil
+from model import MODEL_VERSION, PREDICT_BATCH_SIZE, TTA_MODE, TTA_MODES, load_model, predict, predict_batch, preprocess, resolve_crop, supports_embeddings  # Changed: import predict instead of get_prediction_from_path
+from responses import DISEASE_INDEX, class_id_of, describe, dumps, parse_fields, parse_lang, render_batch, render_prediction
+from tiling import TILE_MAX_TILES, TILE_POOLING, TILE_TOP_K, check_options, predict_tiled
+from video import VIDEO_FRAME_DIFF, VIDEO_MAX_BYTES, VIDEO_MAX_FILES, VIDEO_MAX_FRAMES, VIDEO_TIMEOUT_MS, diagnose_row
+from registry import ModelNotFoundError, ModelRegistry, VersionConflictError, artifact_dir_for
+from workers import InferencePool, QueueFullError, configure_torch_threads
+from admission import TIMEOUT_HEADER, AdmissionController, Deadline, DeadlineExceededError, OverloadedError
+from cache import PREDICTION_CACHE_SWEEP_SECONDS, PredictionCache, cache_key
+from model_store import MODEL_PATH
+from uploads import MAX_UPLOAD_BYTES, UploadTooLargeError, content_length_too_large, read_upload, read_uploads, save_upload
+from metrics import (METRICS_SAMPLE_SECONDS, PROMETHEUS_MULTIPROC_DIR, QUEUE_DEPTH, REJECTIONS, register_cache,
+                     render_latest, sample_metrics, stage_timer, track_gauge)
+import anyio
+import asyncio
+import contextlib
+import hashlib
+import hmac
 import os
 import logging
+import threading
+from typing import Dict, List, Optional
+import numpy as np
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 
 # -------------------------------
 # App Setup
@@ -41,6 +60,58 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
 
+# Single-image routes whose Content-Length can be rejected before parsing
+SINGLE_UPLOAD_ROUTES = {"/predict", "/api/predict"}
+# Routes that go through admission control and carry a deadline
+INFERENCE_ROUTES = {"/predict", "/api/predict", "/api/predict/batch", "/api/similar"}
+# Streamed responses outlive the middleware's call_next, so these admit themselves
+STREAMING_ROUTES = {"/api/predict/video"}
+# Most past cases /api/similar returns
+SIMILAR_MAX_K = 50
+# Most images per /api/predict/batch request
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", 64))
+
+# Required in the X-Admin-Token header of the admin routes; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+# Registered first, so it sits inside reject_oversized_uploads: oversized uploads
+# are turned away before they take an inference slot
+@app.middleware("http")
+async def admit_inference_requests(request: Request, call_next):
+    """Bound the requests in the inference path and give each a deadline"""
+    if request.method != "POST" or request.url.path not in INFERENCE_ROUTES | STREAMING_ROUTES:
+        return await call_next(request)
+    if shutting_down or not registry.loaded:
+        return retry_later(503, "Model is not loaded. Try again later.", "unavailable")
+    if request.url.path in STREAMING_ROUTES:
+        return await call_next(request)
+    try:
+        request.state.deadline = Deadline.from_header(request.headers.get(TIMEOUT_HEADER))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    try:
+        async with admission.admit(request.state.deadline):
+            return await call_next(request)
+    except OverloadedError as e:
+        return retry_later(429, str(e), "overloaded", e.retry_after)
+    except DeadlineExceededError as e:
+        return deadline_exceeded(e)
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    if request.method == "POST" and request.url.path in SINGLE_UPLOAD_ROUTES:
+        if content_length_too_large(request.headers.get("content-length")):
+            return JSONResponse(status_code=413, content={"error": "File too large."})
+    if request.method == "POST" and request.url.path == "/api/predict/batch":
+        if content_length_too_large(request.headers.get("content-length"), MAX_BATCH_FILES * MAX_UPLOAD_BYTES):
+            return JSONResponse(status_code=413, content={"error": "Files too large."})
+    if request.method == "POST" and request.url.path in STREAMING_ROUTES:
+        if content_length_too_large(request.headers.get("content-length"), VIDEO_MAX_BYTES):
+            return JSONResponse(status_code=413, content={"error": "Files too large."})
+    return await call_next(request)
+
 
 # -------------------------------
 # Helper function to validate files
@@ -48,13 +119,129 @@ ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def retry_later(status_code: int, message: str, reason: str, retry_after: Optional[int] = None) -> JSONResponse:
+    """429/503 rejection with a Retry-After hint sized to the current backlog"""
+    REJECTIONS.labels(reason).inc()
+    retry_after = retry_after or admission.retry_after()
+    return JSONResponse(status_code=status_code, content={"error": message}, headers={"Retry-After": str(retry_after)})
+
+
+def deadline_exceeded(error: DeadlineExceededError) -> JSONResponse:
+    REJECTIONS.labels("deadline").inc()
+    return JSONResponse(status_code=504, content={"error": str(error)})
+
+
+def index_upload(entry, embedding: np.ndarray, content: bytes, result: dict, crop: Optional[str]) -> None:
+    """Remember a freshly scored upload for duplicate and similar-case lookups, when reuse is on"""
+    if entry.index is not None and entry.index.matching and result["inference_path"] != "duplicate":
+        entry.index.add(embedding, hashlib.sha256(content).hexdigest(), result, crop)
+
+
+def known_diagnosis(entry, content: bytes, crop: Optional[str]) -> Optional[dict]:
+    """Stored diagnosis of an exact re-upload, answered without inference when reuse is on"""
+    if entry.index is None or not entry.index.matching:
+        return None
+    result = entry.index.lookup(hashlib.sha256(content).hexdigest(), crop)
+    if result is not None:
+        result["inference_path"] = "duplicate"
+    return result
+
+# Decode and inference run in a bounded worker pool, never on the event loop
+configure_torch_threads()
+pool = InferencePool()
+
+# Re-uploads and retries of the same photo are answered from here
+prediction_cache = PredictionCache()
+register_cache(prediction_cache)
+track_gauge(QUEUE_DEPTH.labels("pool"), lambda: pool.pending)
+
+# Caps requests in the inference path; the rest wait briefly or get 429
+admission = AdmissionController()
+track_gauge(QUEUE_DEPTH.labels("admission"), lambda: admission.waiting)
+
+hf_token = os.getenv("HF_TOKEN")  # optional for private HF repo
+
+
+def loader_for(version: str, spec: dict):
+    """Loader for a deployed version; ``spec`` is {"path"} or {"revision"}, {} for the default weights"""
+    def loader():
+        return load_model(token=hf_token, weights_path=spec.get("path"), revision=spec.get("revision"),
+                          artifact_dir=artifact_dir_for(version))
+    return loader
+
+
+# Loaded model versions; each has its own batcher coalescing /api/predict uploads
+registry = ModelRegistry(pool, loader_for)
+track_gauge(
+    QUEUE_DEPTH.labels("batcher"), lambda: sum(entry.batcher.depth for entry in registry.versions())
+)
+
+# Startup state reported by /healthz and /readyz
+startup_error: Optional[str] = None
+shutting_down = False
+warmup_task: Optional[asyncio.Task] = None
+sweep_task: Optional[asyncio.Task] = None
+metrics_task: Optional[asyncio.Task] = None
+
 try:
-    hf_token = os.getenv("HF_TOKEN")  # optional for private HF repo
-    model = load_model(token=hf_token)
+    registry.add(MODEL_VERSION, load_model(token=hf_token), source="startup")
     logger.info("Model loaded successfully at startup")
 except Exception as e:
     logger.error(f"Failed to load model: {e}")
-    model = None
+    startup_error = str(e)
+
+
+async def warm_startup_models():
+    for entry in registry.versions():
+        try:
+            await registry.warm(entry)
+        except Exception:
+            logger.exception(f"Warm-up of model version '{entry.version}' failed")
+
+
+async def sweep_cache_periodically():
+    """Keep the on-disk cache tier within its TTL and size bound"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, prediction_cache.sweep)
+        except Exception:
+            logger.exception("Sweeping the prediction cache failed")
+        await asyncio.sleep(PREDICTION_CACHE_SWEEP_SECONDS)
+
+
+async def sample_metrics_periodically():
+    """Publish this worker's queue depths and cache counters for the other processes' scrapes"""
+    while True:
+        sample_metrics()
+        await asyncio.sleep(METRICS_SAMPLE_SECONDS)
+
+
+@app.on_event("startup")
+async def start_batcher():
+    global warmup_task, sweep_task, metrics_task
+    await registry.start()
+    # Warm up in the background so /healthz answers meanwhile; /readyz waits for it
+    warmup_task = asyncio.create_task(warm_startup_models())
+    if prediction_cache.directory:
+        sweep_task = asyncio.create_task(sweep_cache_periodically())
+    if PROMETHEUS_MULTIPROC_DIR:
+        metrics_task = asyncio.create_task(sample_metrics_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    global shutting_down
+    shutting_down = True
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if sweep_task is not None:
+        sweep_task.cancel()
+    if metrics_task is not None:
+        metrics_task.cancel()
+    await registry.stop()
+    pool.shutdown()
 
 # -------------------------------
 # Routes
@@ -67,25 +254,35 @@ async def home(request: Request):
 async def predict_disease(request: Request, file: UploadFile = File(...)):
     if not allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="Invalid file type. Only JPG, JPEG, PNG allowed.")
-    
-    if model is None:
-        raise HTTPException(status_code=500, detail="Model is not loaded. Try again later.")
-
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
 
+    deadline: Deadline = request.state.deadline
     try:
-        # Save uploaded file to static/uploads directory
-        with open(file_path, "wb") as buffer:       
-            shutil.copyfileobj(file.file, buffer)
+        # Decode straight from memory; the display copy is written alongside
+        content = await read_upload(file)
+        loop = asyncio.get_running_loop()
+        saved = loop.run_in_executor(None, save_upload, content, file.filename, UPLOAD_DIR)
 
         # Get prediction using the predict function from model.py
-        with open(file_path, "rb") as img_file:
-            result = predict(img_file.read(), model)
+        with registry.acquire(content) as entry:
+            key = cache_key(content, entry.version)
+            result = await prediction_cache.aget(key)
+            if result is None:
+                result = await pool.run(deadline.guard(predict), content, entry.model, gate=entry.cascade)
+                await prediction_cache.aset(key, result)
+        stored_name = await saved
         
         # Extract label and confidence from result
         label = result["label"]
         confidence = result["confidence"]
 
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        REJECTIONS.labels("queue_full").inc()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(admission.retry_after())})
+    except DeadlineExceededError as e:
+        REJECTIONS.labels("deadline").inc()
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {e}")
 
@@ -97,28 +294,424 @@ async def predict_disease(request: Request, file: UploadFile = File(...)):
         "result": {
             "label": label,
             "confidence": confidence,
-            "description": result.get("description", ""),
-            "remedy": result.get("remedy", "")
+            **describe(class_id_of(result)),
+            "model_version": entry.version
         },
-        "image_path": f"/static/uploads/{file.filename}"
+        "image_path": f"/static/uploads/{stored_name}"
     }
 )
 
 # JSON API endpoint for React/frontend
 @app.post("/api/predict")
-async def predict_disease_api(file: UploadFile = File(...)):
+async def predict_disease_api(
+    request: Request,
+    file: UploadFile = File(...),
+    crop: Optional[str] = Form(None),
+    fields: Optional[str] = Query(None),
+    lang: Optional[str] = Query(None),
+    mode: str = Query("single"),
+    pooling: str = Query(TILE_POOLING),
+    top_k: int = Query(TILE_TOP_K),
+    max_tiles: int = Query(TILE_MAX_TILES),
+    tta: str = Query(TTA_MODE),
+    embed: bool = Query(False),
+):
+    """``fields=label,confidence`` trims the response; ``lang`` picks the description language.
+
+    ``mode=tiled`` scores overlapping tiles of a large field photo in one
+    batch and pools them (``pooling``, ``top_k``, ``max_tiles``). ``tta``
+    (off/auto/always) controls test-time augmentation of single images;
+    ``inference_path`` in the response says which path ran (``cache`` for
+    a cached result, ``duplicate`` for the stored diagnosis of a past
+    upload, ``gate`` when the cascade gate answered). ``embed=true`` adds
+    the image's 512-d ``embedding`` from the same forward pass.
+    """
     if not allowed_file(file.filename):
         return JSONResponse(status_code=400, content={"error": "Invalid file type. Only JPG, JPEG, PNG allowed."})
-    if model is None:
-        return JSONResponse(status_code=500, content={"error": "Model is not loaded. Try again later."})
+    deadline: Deadline = request.state.deadline
     try:
-        content = await file.read()
-        result = predict(content, model)
-        return JSONResponse({
-            "label": result["label"],
-            "confidence": result["confidence"],
-            "description": result.get("description", ""),
-            "remedy": result.get("remedy", "")
-        })
+        # Restrict the answer to the crop the farmer already named
+        crop = resolve_crop(crop)
+        fields, lang = parse_fields(fields), parse_lang(lang)
+        if mode not in ("single", "tiled"):
+            raise ValueError("mode must be 'single' or 'tiled'")
+        if mode == "tiled":
+            check_options(pooling, top_k, max_tiles)
+        if tta not in TTA_MODES:
+            raise ValueError(f"tta must be one of {', '.join(TTA_MODES)}")
+        if embed and mode == "tiled":
+            raise ValueError("embed is only available with mode=single")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    variant = crop or ""
+    if mode == "tiled":
+        variant += f"|tiled:{pooling}:{top_k}:{max_tiles}"
+    elif tta != TTA_MODE:
+        variant += f"|tta:{tta}"
+    try:
+        content = await read_upload(file)
+        embedding = None
+        with registry.acquire(content) as entry:
+            if embed and not supports_embeddings(entry.model):
+                return JSONResponse(status_code=400, content={"error": "Embeddings need the eager inference backend."})
+            key = cache_key(content, entry.version, variant=variant)
+            # Cached results don't keep their embedding
+            result = None if embed else await prediction_cache.aget(key)
+            if result is not None:
+                result["inference_path"] = "cache"
+            else:
+                if mode == "tiled":
+                    # The tiles are already one batch, so skip the micro-batcher
+                    result = await pool.run(
+                        deadline.guard(predict_tiled), content, entry.model,
+                        crop=crop, pooling=pooling, top_k=top_k, max_tiles=max_tiles,
+                    )
+                else:
+                    result = None if embed else known_diagnosis(entry, content, crop)
+                    if result is None:
+                        image_tensor = await pool.run(deadline.guard(preprocess), content)
+                        result = await entry.batcher.submit(image_tensor, crop, tta, deadline, embed)
+                        embedding = result.pop("embedding", None)
+                        if embedding is not None:
+                            index_upload(entry, embedding, content, result, crop)
+                await prediction_cache.aset(key, result)
+        with stage_timer("response"):
+            dynamic = {"model_version": entry.version, "crop": crop}
+            if embed:
+                dynamic["embedding"] = np.round(embedding.astype(np.float64), 5).tolist()
+            body = render_prediction(result, fields, lang, **dynamic)
+            return Response(content=body, media_type="application/json")
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except QueueFullError as e:
+        return retry_later(503, str(e), "queue_full")
+    except DeadlineExceededError as e:
+        return deadline_exceeded(e)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e), "message": "Failed to process image"})
+
+
+# Batch JSON API endpoint for survey uploads (many leaves at once)
+@app.post("/api/predict/batch")
+async def predict_disease_batch_api(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    crop: List[str] = Form([]),
+    fields: Optional[str] = Query(None),
+    lang: Optional[str] = Query(None),
+    tta: str = Query(TTA_MODE),
+):
+    """``crop`` may be given once for every file or once per file, in order"""
+    deadline: Deadline = request.state.deadline
+    if len(files) > MAX_BATCH_FILES:
+        return JSONResponse(status_code=413, content={"error": f"At most {MAX_BATCH_FILES} files per request."})
+    if len(crop) not in (0, 1, len(files)):
+        return JSONResponse(status_code=400, content={"error": "Give one crop for all files or one per file."})
+    try:
+        crops = [resolve_crop(c) for c in crop]
+        fields, lang = parse_fields(fields), parse_lang(lang)
+        if tta not in TTA_MODES:
+            raise ValueError(f"tta must be one of {', '.join(TTA_MODES)}")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if not crops:
+        crops = [None] * len(files)
+    elif len(crops) == 1:
+        crops = crops * len(files)
+
+    results = [None] * len(files)
+    accepted, contents = [], []
+    for i, file in enumerate(files):
+        if not allowed_file(file.filename):
+            results[i] = {"error": "Invalid file type. Only JPG, JPEG, PNG allowed."}
+            continue
+        try:
+            contents.append(await read_upload(file))
+        except UploadTooLargeError as e:
+            results[i] = {"error": str(e)}
+            continue
+        accepted.append(i)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            # Each image goes to the version the split assigns it, one batch per version
+            groups: Dict[str, list] = {}
+            for i, content in zip(accepted, contents):
+                entry = stack.enter_context(registry.acquire(content))
+                groups.setdefault(entry.version, [entry, [], []])
+                groups[entry.version][1].append(i)
+                groups[entry.version][2].append(content)
+            for entry, indices, group in groups.values():
+                # Exact re-uploads are answered from the index; only the rest are scored
+                predictions = [known_diagnosis(entry, content, crops[i]) for i, content in zip(indices, group)]
+                todo = [j for j, prediction in enumerate(predictions) if prediction is None]
+                match = entry.index.match if entry.index is not None and entry.index.matching else None
+                # One pool task per chunk, so other requests interleave and an
+                # expired deadline stops the batch between chunks
+                for start in range(0, len(todo), PREDICT_BATCH_SIZE):
+                    chunk = todo[start:start + PREDICT_BATCH_SIZE]
+                    scored = await pool.run(
+                        deadline.guard(predict_batch), [group[j] for j in chunk], entry.model,
+                        crops=[crops[indices[j]] for j in chunk], tta=tta, match=match, gate=entry.cascade,
+                    )
+                    for j, prediction in zip(chunk, scored):
+                        predictions[j] = prediction
+                for i, content, prediction in zip(indices, group, predictions):
+                    embedding = prediction.pop("embedding", None)
+                    if embedding is not None:
+                        index_upload(entry, embedding, content, prediction, crops[i])
+                    results[i] = {**prediction, "model_version": entry.version, "crop": crops[i]}
+    except QueueFullError as e:
+        return retry_later(503, str(e), "queue_full")
+    except DeadlineExceededError as e:
+        return deadline_exceeded(e)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e), "message": "Failed to process images"})
+
+    body = render_batch(zip((file.filename for file in files), results), fields, lang)
+    return Response(content=body, media_type="application/json")
+
+
+# Crop-row videos and photo bursts, answered as NDJSON while frames are scored
+@app.post("/api/predict/video")
+async def predict_video_api(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    crop: Optional[str] = Form(None),
+    lang: Optional[str] = Query(None),
+    tta: str = Query("off"),
+    max_frames: int = Query(VIDEO_MAX_FRAMES),
+    min_change: float = Query(VIDEO_FRAME_DIFF),
+):
+    """One video, or several photos in capture order.
+
+    Streams a ``{"type": "frame"}`` line per scored frame, then one
+    ``{"type": "summary"}`` line with the row-level diagnosis. A failure
+    after streaming has started ends the stream with a ``{"type": "error"}``
+    line.
+    """
+    try:
+        if len(files) > VIDEO_MAX_FILES:
+            raise ValueError(f"At most {VIDEO_MAX_FILES} files per request")
+        crop, lang = resolve_crop(crop), parse_lang(lang)
+        if tta not in TTA_MODES:
+            raise ValueError(f"tta must be one of {', '.join(TTA_MODES)}")
+        deadline = Deadline.from_header(request.headers.get(TIMEOUT_HEADER), default_ms=VIDEO_TIMEOUT_MS)
+        contents = await read_uploads(files, VIDEO_MAX_BYTES)
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    # Held until the stream ends (or the client goes away)
+    stack = contextlib.AsyncExitStack()
+    try:
+        await stack.enter_async_context(admission.admit(deadline))
+        entry = stack.enter_context(registry.acquire(contents[0]))
+        events = diagnose_row(
+            contents, entry.model, crop=crop, tta=tta, max_frames=max_frames, min_change=min_change,
+            gate=entry.cascade,
+        )
+        # A step may still be running on a worker when the client goes away;
+        # closing the generator (and its decoder) has to wait for it
+        step = threading.Lock()
+
+        def advance():
+            with step:
+                return next(events, None)
+
+        def close_events():
+            with step:
+                events.close()
+
+        stack.push_async_callback(pool.execute, close_events)
+        # The first chunk runs before any bytes are sent, so bad input still gets a status code
+        first = await pool.run(deadline.guard(advance))
+    except OverloadedError as e:
+        await stack.aclose()
+        return retry_later(429, str(e), "overloaded", e.retry_after)
+    except QueueFullError as e:
+        await stack.aclose()
+        return retry_later(503, str(e), "queue_full")
+    except DeadlineExceededError as e:
+        await stack.aclose()
+        return deadline_exceeded(e)
+    except ValueError as e:
+        await stack.aclose()
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        await stack.aclose()
+        return JSONResponse(status_code=500, content={"error": str(e), "message": "Failed to process video"})
+
+    async def stream():
+        chunk = first
+        try:
+            while chunk is not None:
+                for event in chunk:
+                    if event["type"] == "summary":
+                        event.update(describe(event["class_id"], lang), model_version=entry.version)
+                    yield dumps(event) + b"\n"
+                chunk = await pool.run(deadline.guard(advance))
+        except Exception as e:
+            logger.warning(f"Video stream stopped early: {e}")
+            yield dumps({"type": "error", "error": str(e)}) + b"\n"
+        finally:
+            # Shielded: on disconnect this runs inside the cancelled response task
+            with anyio.CancelScope(shield=True):
+                await stack.aclose()
+
+    # stream() may never start, or be left suspended, if the client disconnects;
+    # close the decoder and release the slot regardless
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(stack.aclose))
+
+
+# Static class metadata; clients cache it and revalidate with If-None-Match
+@app.get("/api/diseases")
+async def list_diseases(request: Request, lang: Optional[str] = Query(None)):
+    try:
+        body, etag = DISEASE_INDEX[parse_lang(lang)]
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Past uploads that look like this one, for operators reviewing a case
+@app.post("/api/similar")
+async def similar_cases(
+    request: Request,
+    file: UploadFile = File(...),
+    k: int = Query(5),
+    x_admin_token: Optional[str] = Header(None),
+):
+    check_admin(x_admin_token)
+    if not 1 <= k <= SIMILAR_MAX_K:
+        return JSONResponse(status_code=400, content={"error": f"k must be between 1 and {SIMILAR_MAX_K}"})
+    deadline: Deadline = request.state.deadline
+    try:
+        content = await read_upload(file)
+        with registry.acquire(content) as entry:
+            if entry.index is None:
+                return JSONResponse(status_code=400, content={"error": "This model version has no embedding index."})
+            image_tensor = await pool.run(deadline.guard(preprocess), content)
+            result = await entry.batcher.submit(image_tensor, None, "off", deadline, embed=True)
+            cases = await pool.run(deadline.guard(entry.index.similar), result["embedding"], k)
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except QueueFullError as e:
+        return retry_later(503, str(e), "queue_full")
+    except DeadlineExceededError as e:
+        return deadline_exceeded(e)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e), "message": "Failed to look up similar cases"})
+    return {
+        "model_version": entry.version,
+        "label": result["label"],
+        "confidence": result["confidence"],
+        "indexed": len(entry.index),
+        "similar": cases,
+    }
+
+
+# -------------------------------
+# Health checks
+# -------------------------------
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up; the body describes the model state"""
+    return {
+        "status": "ok",
+        "model_loaded": registry.loaded,
+        "warm": registry.ready,
+        "error": startup_error,
+        "traffic": registry.traffic,
+    }
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 only once a model is loaded and warmed up"""
+    if shutting_down:
+        status = "shutting_down"
+    elif startup_error is not None and not registry.loaded:
+        status = "failed"
+    elif not registry.loaded:
+        status = "loading"
+    elif not registry.ready:
+        status = "warming_up"
+    else:
+        return {"status": "ready", "traffic": registry.traffic}
+    return JSONResponse(status_code=503, content={"status": status, "error": startup_error})
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {"model_versions": registry.traffic, **prediction_cache.stats()}
+
+
+# -------------------------------
+# Model registry (deploys, A/B splits)
+# -------------------------------
+def check_admin(token: Optional[str]) -> None:
+    """Admin routes fail closed: without ADMIN_TOKEN configured nobody may use them"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.")
+    if not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.get("/api/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    """The answering process's versions, and the shared state generation it has applied"""
+    check_admin(x_admin_token)
+    return registry.describe()
+
+
+@app.post("/api/models", status_code=202)
+async def deploy_model(body: dict, x_admin_token: Optional[str] = Header(None)):
+    """Load a new version in every server process; {"version", "path" or "revision", "traffic"}"""
+    check_admin(x_admin_token)
+    version = body.get("version")
+    if not version:
+        raise HTTPException(status_code=400, detail="'version' is required.")
+    path, revision = body.get("path"), body.get("revision")
+    if path and not os.path.exists(path):
+        raise HTTPException(status_code=400, detail=f"Checkpoint {path} does not exist.")
+    if revision and MODEL_PATH:
+        raise HTTPException(status_code=400, detail="MODEL_PATH is set, so hub revisions can't be deployed; pass 'path' instead.")
+    traffic = body.get("traffic", 100)
+    if not isinstance(traffic, int) or isinstance(traffic, bool) or not 0 <= traffic <= 100:
+        raise HTTPException(status_code=400, detail="'traffic' must be an integer between 0 and 100.")
+
+    try:
+        state = await registry.plan_deploy(version, {"path": path, "revision": revision}, traffic)
+    except VersionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"version": version, "status": "loading", "traffic": traffic, "generation": state["generation"]}
+
+
+@app.put("/api/models/traffic")
+async def update_traffic(split: Dict[str, int], x_admin_token: Optional[str] = Header(None)):
+    """Replace the split, e.g. {"v1": 90, "v2": 10}; versions left out are retired.
+
+    Every server process applies it within REGISTRY_SYNC_SECONDS; compare
+    ``generation`` with the one GET /api/models reports.
+    """
+    check_admin(x_admin_token)
+    try:
+        state = await registry.plan_traffic(split)
+        return {"traffic": state["traffic"], "generation": state["generation"]}
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,181 @@
+import contextlib
+import logging
+import os
+import random
+import time
+from typing import Callable, Iterator, List, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Multi-process Configuration
+# -----------------------------
+# Set by gunicorn.conf.py: every process writes its metrics to files here and
+# /metrics aggregates all of them (must be set before prometheus_client is imported)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+# How often each process publishes its sampled gauges (queue depths, cache) in that mode
+METRICS_SAMPLE_SECONDS = float(os.getenv("METRICS_SAMPLE_SECONDS", 1))
+
+# -----------------------------
+# Profiler Configuration
+# -----------------------------
+# Fraction of forward passes traced with torch.profiler (0 disables it)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+STAGES = ("decode", "transform", "gate", "forward", "postprocess", "tta", "response")
+
+# -----------------------------
+# Metrics
+# -----------------------------
+STAGE_LATENCY = Histogram(
+    "predict_stage_seconds",
+    "Time spent in each stage of a prediction",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+BATCH_SIZE = Histogram(
+    "predict_batch_size",
+    "Images per model forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+# multiprocess_mode says how each process's value is combined; "live" drops exited workers
+QUEUE_DEPTH = Gauge(
+    "inference_queue_depth", "Work waiting for or running on the model", ["queue"], multiprocess_mode="livesum"
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "model_load_seconds", "Wall time of the last load_model call", multiprocess_mode="livemax"
+)
+WARMUP_SECONDS = Gauge("model_warmup_seconds", "Wall time of the last model warm-up", multiprocess_mode="livemax")
+PREDICTIONS = Counter("predictions_total", "Predictions returned, by label", ["label"])
+REJECTIONS = Counter(
+    "requests_rejected_total",
+    "Inference requests turned away or dropped, by reason",
+    ["reason"],
+)
+CASCADE_DECISIONS = Counter(
+    "cascade_decisions_total",
+    "Images answered by the cascade gate or passed on to the full model",
+    ["outcome"],
+)
+
+# Resolve label children once so the hot path is a dict lookup
+_STAGE_CHILDREN = {stage: STAGE_LATENCY.labels(stage) for stage in STAGES}
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Record how long the wrapped block takes as ``stage``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _STAGE_CHILDREN[stage].observe(time.perf_counter() - start)
+
+
+class CacheCollector:
+    """Exposes PredictionCache's own counters without double bookkeeping"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        lookups = CounterMetricFamily(
+            "prediction_cache_lookups", "Prediction cache lookups by outcome", labels=["result"]
+        )
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["disk_hit"], stats["disk_hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield GaugeMetricFamily("prediction_cache_entries", "Entries held in memory", value=stats["entries"])
+        yield GaugeMetricFamily("prediction_cache_hit_ratio", "Hits / lookups since start", value=stats["hit_rate"])
+
+
+# Gauges whose value is read from the live object; see track_gauge
+_SAMPLED: List[Tuple[Callable[[], float], Callable[[], None]]] = []
+
+
+def track_gauge(child, read: Callable[[], float]) -> None:
+    """Report ``read()`` as the value of gauge ``child``.
+
+    In a single process the value is read at scrape time. Across processes a
+    scrape only reaches one of them, so each process publishes its value every
+    METRICS_SAMPLE_SECONDS instead (see sample_metrics).
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        _SAMPLED.append(lambda: child.set(read()))
+    else:
+        child.set_function(read)
+
+
+def register_cache(cache) -> None:
+    if not PROMETHEUS_MULTIPROC_DIR:
+        REGISTRY.register(CacheCollector(cache))
+        return
+
+    # Custom collectors only see their own process, so publish the cache's
+    # counters into multi-process metrics; the hit ratio doesn't sum and is
+    # left to PromQL (rate of hit / rate of all lookups)
+    lookups = Counter("prediction_cache_lookups", "Prediction cache lookups by outcome", ["result"])
+    entries = Gauge("prediction_cache_entries", "Entries held in memory", multiprocess_mode="livesum")
+    published = {"hit": 0, "disk_hit": 0, "miss": 0}
+
+    def publish():
+        stats = cache.stats()
+        for result, key in (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses")):
+            lookups.labels(result).inc(stats[key] - published[result])
+            published[result] = stats[key]
+        entries.set(stats["entries"])
+
+    _SAMPLED.append(publish)
+
+
+def sample_metrics() -> None:
+    """Publish this process's sampled values (multi-process mode only)"""
+    for publish in _SAMPLED:
+        try:
+            publish()
+        except Exception:
+            logger.exception("Publishing a sampled metric failed")
+
+
+def render_latest() -> tuple:
+    """Body and content type for the /metrics endpoint"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import CollectorRegistry, multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# -----------------------------
+# Sampling Profiler Hook
+# -----------------------------
+@contextlib.contextmanager
+def maybe_profile(name: str) -> Iterator[None]:
+    """Trace the wrapped block with torch.profiler for a sampled fraction of calls.
+
+    Costs one random() call when sampling is off; sampled traces are written
+    as Chrome trace JSON to PROFILE_DIR.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        yield
+        return
+
+    from torch.profiler import ProfilerActivity, profile
+
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True, with_stack=True) as prof:
+        yield
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.time_ns()}-{os.getpid()}.json")
+        prof.export_chrome_trace(path)
+        logger.info(f"Wrote profiler trace {path}")
+    except OSError as e:
+        logger.warning(f"Could not write profiler trace: {e}")
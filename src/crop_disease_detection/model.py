@@ -1,13 +1,21 @@
+import copy
+import itertools
 import logging
 import os
 import io
-from typing import Union, BinaryIO, Optional
+import re
+from typing import Any, Callable, Dict, Union, BinaryIO, Iterable, Iterator, Optional, List, Sequence, Tuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torchvision.transforms as transforms
 from PIL import Image
-from huggingface_hub import hf_hub_download
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from metrics import BATCH_SIZE, MODEL_LOAD_SECONDS, PREDICTIONS, maybe_profile, stage_timer
+from model_store import resolve_weights, sha256_file
+from backends import EXPORT_DIR, INFERENCE_BACKEND, build_backend, check_parity, load_quantized
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +29,33 @@ IN_CHANNELS = 3
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 REPO_ID = os.getenv("HF_REPO_ID", "kritimbista/my-model-weights")
 MODEL_FILENAME = os.getenv("HF_MODEL_FILENAME", "model_weights.pth")
+# Tags cached results so new weights never serve stale predictions
+MODEL_VERSION = os.getenv("MODEL_VERSION", f"{REPO_ID}/{MODEL_FILENAME}")
+PREDICT_BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", 32))
+# "int8" serves the statically quantized model produced by quantize.py
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32").lower()
+INT8_MODEL_PATH = os.getenv("INT8_MODEL_PATH", os.path.join(EXPORT_DIR, "model_int8.ts"))
+# Inference-time graph rewrites applied inside load_model
+OPTIMIZE_FOR_INFERENCE = os.getenv("OPTIMIZE_FOR_INFERENCE", "1") == "1"
+CHANNELS_LAST = os.getenv("CHANNELS_LAST", "1") == "1"
+VERIFY_OPTIMIZATION = os.getenv("VERIFY_OPTIMIZATION", "1") == "1"
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "0") == "1"
+# Decode large uploads close to IMAGE_SIZE instead of at full resolution. Off
+# by default: the pixels differ slightly from the training-time transform, so
+# enable it only after benchmarks/bench_decode.py --parity-images shows parity
+FAST_DECODE = os.getenv("FAST_DECODE", "0") == "1"
+# Test-time augmentation: "off", "auto" (only below the threshold) or "always";
+# off by default since it can cost up to 7 extra views per image
+TTA_MODE = os.getenv("TTA_MODE", "off").lower()
+TTA_CONFIDENCE_THRESHOLD = float(os.getenv("TTA_CONFIDENCE_THRESHOLD", 0.6))
+# Side of the corner/centre crops, as a fraction of IMAGE_SIZE
+TTA_CROP_SCALE = float(os.getenv("TTA_CROP_SCALE", 0.875))
+TTA_MODES = ("off", "auto", "always")
+# Output channels of each conv_block group in the original architecture.
+# conv2/res1 and conv4/res2 are joined by residual adds, so the second
+# block of res1 (res2) always has conv2's (conv4's) width; "res1"/"res2"
+# only size the inner block. Pruned checkpoints store their own widths.
+RESNET9_WIDTHS = {"conv1": 64, "conv2": 128, "res1": 128, "conv3": 256, "conv4": 512, "res2": 512}
 
 
 # -----------------------------
@@ -29,8 +64,12 @@ MODEL_FILENAME = os.getenv("HF_MODEL_FILENAME", "model_weights.pth")
 class ResNet9(nn.Module):
     """ResNet9 architecture for plant disease classification"""
 
-    def __init__(self, in_channels: int, num_classes: int):
+    def __init__(self, in_channels: int, num_classes: int, widths: Optional[Dict[str, int]] = None):
         super().__init__()
+        unknown = set(widths or {}) - set(RESNET9_WIDTHS)
+        if unknown:
+            raise ValueError(f"Unknown ResNet9 layers in widths: {', '.join(sorted(unknown))}")
+        w = self.widths = {**RESNET9_WIDTHS, **(widths or {})}
 
         def conv_block(in_c: int, out_c: int, pool: bool = False) -> nn.Sequential:
             layers = [
@@ -42,27 +81,45 @@ class ResNet9(nn.Module):
                 layers.append(nn.MaxPool2d(2))
             return nn.Sequential(*layers)
 
-        self.conv1 = conv_block(in_channels, 64)
-        self.conv2 = conv_block(64, 128, pool=True)
-        self.res1 = nn.Sequential(conv_block(128, 128), conv_block(128, 128))
-        self.conv3 = conv_block(128, 256, pool=True)
-        self.conv4 = conv_block(256, 512, pool=True)
-        self.res2 = nn.Sequential(conv_block(512, 512), conv_block(512, 512))
+        self.conv1 = conv_block(in_channels, w["conv1"])
+        self.conv2 = conv_block(w["conv1"], w["conv2"], pool=True)
+        self.res1 = nn.Sequential(conv_block(w["conv2"], w["res1"]), conv_block(w["res1"], w["conv2"]))
+        self.conv3 = conv_block(w["conv2"], w["conv3"], pool=True)
+        self.conv4 = conv_block(w["conv3"], w["conv4"], pool=True)
+        self.res2 = nn.Sequential(conv_block(w["conv4"], w["res2"]), conv_block(w["res2"], w["conv4"]))
         self.classifier = nn.Sequential(
             nn.AdaptiveAvgPool2d(1),
             nn.Flatten(),
-            nn.Linear(512, num_classes),
+            nn.Linear(w["conv4"], num_classes),
         )
 
-    def forward(self, xb: torch.Tensor) -> torch.Tensor:
+    def features(self, xb: torch.Tensor) -> torch.Tensor:
+        """(N, widths["conv4"]) pooled features, i.e. the input of the final Linear (512 unpruned)"""
         out = self.conv1(xb)
         out = self.conv2(out)
         out = self.res1(out) + out
         out = self.conv3(out)
         out = self.conv4(out)
         out = self.res2(out) + out
-        out = self.classifier(out)
-        return out
+        return self.classifier[1](self.classifier[0](out))
+
+    def forward(self, xb: torch.Tensor) -> torch.Tensor:
+        return self.classifier[2](self.features(xb))
+
+    def forward_with_embedding(self, xb: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Logits and pooled features from a single pass"""
+        features = self.features(xb)
+        return self.classifier[2](features), features
+
+
+def supports_embeddings(model: nn.Module) -> bool:
+    """Eager (or torch.compile'd) ResNet9; exported and INT8 graphs only return logits"""
+    return hasattr(model, "forward_with_embedding")
+
+
+def embedding_dim(model: nn.Module) -> int:
+    """Size of the pooled features; smaller than 512 for pruned checkpoints"""
+    return model.classifier[2].in_features
 
 
 # -----------------------------
@@ -110,6 +167,53 @@ class_names = [
 ]
 
 
+# -----------------------------
+# Crop -> Class Masks
+# -----------------------------
+def crop_of(label: str) -> str:
+    """'Corn_(maize)___Common_rust_' -> 'Corn_(maize)'"""
+    return label.split("___", 1)[0]
+
+
+def _crop_aliases(crop: str) -> List[str]:
+    # Full name plus its first word, so 'corn', 'pepper' and 'cherry' work too
+    full = crop.lower()
+    short = re.split(r"[_,(]", full, maxsplit=1)[0]
+    return [full, short] if short != full else [full]
+
+
+CROPS = sorted({crop_of(name) for name in class_names})
+CROP_CLASS_INDICES: Dict[str, List[int]] = {
+    crop: [i for i, name in enumerate(class_names) if crop_of(name) == crop] for crop in CROPS
+}
+# Boolean (num_classes,) masks, built once; a request only looks one up
+CROP_MASKS: Dict[str, torch.Tensor] = {}
+for _crop, _indices in CROP_CLASS_INDICES.items():
+    _mask = torch.zeros(len(class_names), dtype=torch.bool)
+    _mask[_indices] = True
+    CROP_MASKS[_crop] = _mask
+_CROP_LOOKUP = {alias: crop for crop in CROPS for alias in _crop_aliases(crop)}
+_NO_MASK = torch.ones(len(class_names), dtype=torch.bool)
+
+
+def resolve_crop(crop: Optional[str]) -> Optional[str]:
+    """Canonical crop name for user input such as 'tomato' or 'Corn'; None/'' means any crop"""
+    if crop is None or not crop.strip():
+        return None
+    key = crop.strip().lower().replace(" ", "_")
+    if key not in _CROP_LOOKUP:
+        raise ValueError(f"Unknown crop '{crop}'. Expected one of: {', '.join(CROPS)}")
+    return _CROP_LOOKUP[key]
+
+
+def restrict_logits(outputs: torch.Tensor, crops: Sequence[Optional[str]]) -> torch.Tensor:
+    """Set the logits of classes outside each row's crop to -inf (one crop per row)"""
+    if outputs.shape[1] != len(class_names):
+        return outputs
+    mask = torch.stack([CROP_MASKS[crop] if crop else _NO_MASK for crop in crops]).to(outputs.device)
+    return outputs.masked_fill(~mask, float("-inf"))
+
+
 # -----------------------------
 # Disease Info (Descriptions + Remedies)
 # -----------------------------
@@ -310,80 +414,479 @@ transform = transforms.Compose([
 ])
 
 
+# -----------------------------
+# Inference Optimization
+# -----------------------------
+def fold_batchnorm(model: nn.Module) -> nn.Module:
+    """Fold every Conv2d -> BatchNorm2d pair into a single Conv2d, in place.
+
+    The BatchNorm is dropped from its Sequential rather than left behind as
+    an Identity, so the conv sits right next to its ReLU and INT8 FX
+    quantization can still fuse the two. Later layers in the same
+    Sequential shift down one index; load weights before folding.
+    """
+    for module in list(model.modules()):
+        if not isinstance(module, nn.Sequential):
+            continue
+        i = 0
+        while i < len(module) - 1:
+            conv, bn = module[i], module[i + 1]
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(conv, bn)
+                del module[i + 1]
+            i += 1
+    return model
+
+
+def optimize_for_inference(
+    model: nn.Module,
+    channels_last: bool = CHANNELS_LAST,
+    verify: bool = VERIFY_OPTIMIZATION,
+) -> nn.Module:
+    """Fold BatchNorm into the convolutions and switch to channels_last.
+
+    With ``verify`` the optimized model is checked against an unoptimized
+    copy before it is returned.
+    """
+    model.eval()
+    reference = copy.deepcopy(model) if verify else None
+    fold_batchnorm(model)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    if reference is not None:
+        device = next(model.parameters()).device
+        check_parity(reference, model, IMAGE_SIZE, device=device)
+    logger.info(f"Optimized model for inference (bn folded, channels_last={channels_last})")
+    return model
+
+
 # -----------------------------
 # Load Model Function
 # -----------------------------
-def load_model(device: torch.device = DEVICE, token: Optional[str] = None) -> nn.Module:
+def load_checkpoint(path: str, device: torch.device = DEVICE):
+    """torch.load, memory-mapping the file when its format allows it"""
     try:
-        logger.info(f"Downloading weights from HF repo='{REPO_ID}' filename='{MODEL_FILENAME}'")
-        model_path = hf_hub_download(repo_id=REPO_ID, filename=MODEL_FILENAME, token=token)
-        checkpoint = torch.load(model_path, map_location=device)
-
-        # Determine number of classes
-        num_classes = len(class_names)
-        if isinstance(checkpoint, dict) and "num_classes" in checkpoint:
-            num_classes = checkpoint["num_classes"]
-        
-        model = ResNet9(in_channels=IN_CHANNELS, num_classes=num_classes)
-
-        if isinstance(checkpoint, dict):
-            if "model_state_dict" in checkpoint:
-                model.load_state_dict(checkpoint["model_state_dict"], strict=False)
-            else:
-                model.load_state_dict(checkpoint, strict=False)
-        else:
-            model.load_state_dict(checkpoint, strict=False)
+        return torch.load(path, map_location=device, mmap=True)
+    except RuntimeError:
+        # Legacy (non-zipfile) checkpoints can't be memory-mapped
+        return torch.load(path, map_location=device)
+
+
+def model_from_checkpoint(checkpoint: Any) -> ResNet9:
+    """Build a ResNet9 shaped like ``checkpoint`` and load its weights.
+
+    Accepts a bare state dict or a dict with ``model_state_dict`` plus the
+    optional ``num_classes`` and ``widths`` (written by compress.py for
+    pruned models) metadata.
+    """
+    num_classes, widths = len(class_names), None
+    if isinstance(checkpoint, dict):
+        num_classes = checkpoint.get("num_classes", num_classes)
+        widths = checkpoint.get("widths")
+
+    model = ResNet9(in_channels=IN_CHANNELS, num_classes=num_classes, widths=widths)
+    if isinstance(checkpoint, dict) and "model_state_dict" in checkpoint:
+        model.load_state_dict(checkpoint["model_state_dict"], strict=False)
+    else:
+        model.load_state_dict(checkpoint, strict=False)
+    return model
+
+
+@MODEL_LOAD_SECONDS.time()
+def load_model(
+    device: torch.device = DEVICE,
+    token: Optional[str] = None,
+    backend: str = INFERENCE_BACKEND,
+    precision: str = MODEL_PRECISION,
+    weights_path: Optional[str] = None,
+    revision: Optional[str] = None,
+    artifact_dir: Optional[str] = None,
+) -> nn.Module:
+    """Load, optimize and wrap the model for serving.
+
+    By default the weights come from the local store (see model_store.py).
+    ``weights_path`` loads a specific checkpoint instead (an INT8 TorchScript
+    file when ``precision`` is int8) and ``revision`` picks another hub
+    revision; both are used by the registry to bring up new model versions.
+    """
+    if precision == "int8":
+        try:
+            return load_quantized(weights_path or INT8_MODEL_PATH, IMAGE_SIZE)
+        except Exception as e:
+            logger.exception("Failed to load INT8 model")
+            raise RuntimeError(f"Model loading failed: {e}") from e
 
+    try:
+        if weights_path:
+            model_path = weights_path
+        elif revision:
+            model_path = resolve_weights(REPO_ID, MODEL_FILENAME, revision=revision, token=token)
+        else:
+            model_path = resolve_weights(REPO_ID, MODEL_FILENAME, token=token)
+        model = model_from_checkpoint(load_checkpoint(model_path, device))
         model.to(device)
         model.eval()
+        if OPTIMIZE_FOR_INFERENCE:
+            model = optimize_for_inference(model)
         logger.info(f"Model loaded successfully on {device} (from {model_path})")
-        return model
+
+        # Exported artifacts are only reused for the exact weights they came from
+        weights_sha256 = sha256_file(model_path) if backend != "eager" else None
+        runner = build_backend(
+            model, backend, IMAGE_SIZE, device, artifact_dir=artifact_dir, weights_sha256=weights_sha256,
+        )
+        if TORCH_COMPILE and runner is model:
+            # Batch size varies with load, so avoid a recompile per shape
+            runner = torch.compile(model, dynamic=True)
+        return runner
     except Exception as e:
         logger.exception("Failed to load model")
         raise RuntimeError(f"Model loading failed: {e}") from e
 
 
 # -----------------------------
-# Predict Function
+# Predict Helpers
 # -----------------------------
-def predict(image_bytes: Union[bytes, BinaryIO], model: nn.Module, device: torch.device = DEVICE) -> dict:
-    try:
+def decode_image(image_bytes: Union[bytes, BinaryIO], size: int = IMAGE_SIZE) -> Image.Image:
+    """Decode an upload straight to a (size, size) RGB image.
+
+    JPEGs are decoded with DCT-domain downscaling (``Image.draft``), so a
+    48 MP phone photo is never materialised at full resolution. Other
+    formats must be fully decoded, but are shrunk with a cheap integer
+    ``reduce()`` before the final antialiased resize.
+    """
+    if isinstance(image_bytes, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image_bytes))
+    else:
+        image = Image.open(image_bytes)
+
+    if image.format == "JPEG":
+        # Picks the smallest 1/1..1/8 scale that is still >= size on both sides
+        image.draft("RGB", (size, size))
+    image = image.convert("RGB")
+
+    factor = min(image.width, image.height) // size
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize((size, size), Image.BILINEAR)
+
+
+def image_to_tensor(image: Image.Image) -> torch.Tensor:
+    """HWC uint8 PIL image -> CHW float tensor in [0, 1], same as ToTensor()"""
+    # np.array (not asarray) so the buffer is writable and torch can share it
+    array = np.array(image, dtype=np.uint8)
+    return torch.from_numpy(array).permute(2, 0, 1).float().div_(255)
+
+
+def preprocess(image_bytes: Union[bytes, BinaryIO]) -> torch.Tensor:
+    """Decode an upload and return its (C, H, W) input tensor"""
+    if FAST_DECODE:
+        with stage_timer("decode"):
+            image = decode_image(image_bytes)
+        with stage_timer("transform"):
+            return image_to_tensor(image)
+
+    with stage_timer("decode"):
         if isinstance(image_bytes, (bytes, bytearray)):
             image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
         else:
             image = Image.open(image_bytes).convert("RGB")
+    with stage_timer("transform"):
+        return transform(image)
+
+
+def build_result(probs: torch.Tensor) -> dict:
+    """Turn one row of class probabilities into a label, class id and confidence"""
+    # Get top 5 for debugging
+    top5_probs, top5_indices = torch.topk(probs, min(5, len(class_names)))
+
+    logger.info("Top 5 predictions:")
+    for i in range(min(5, len(class_names))):
+        idx = int(top5_indices[i].item())
+        prob = float(top5_probs[i].item())
+        logger.info(f"  {i+1}. {class_names[idx]}: {prob:.4f}")
+
+    confidence, predicted_idx = torch.max(probs, dim=0)
+    class_id = int(predicted_idx.item())
+    label = class_names[class_id]
+    PREDICTIONS.labels(label).inc()
+
+    # Description and remedy are static per class; responses.py adds them
+    return {
+        "label": label,
+        "class_id": class_id,
+        "confidence": float(confidence.item()),
+    }
+
+
+def forward_logits(batch: torch.Tensor, model: nn.Module, device: torch.device = DEVICE) -> torch.Tensor:
+    """Raw model outputs for a stacked (N, C, H, W) batch; call under inference_mode"""
+    BATCH_SIZE.observe(batch.shape[0])
+    memory_format = torch.channels_last if CHANNELS_LAST else torch.contiguous_format
+    with stage_timer("forward"):
+        return model(batch.to(device, memory_format=memory_format))
+
+
+def forward_with_embeddings(
+    batch: torch.Tensor, model: nn.Module, device: torch.device = DEVICE
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Logits plus L2-normalised (N, 512) CPU embeddings from the same pass"""
+    BATCH_SIZE.observe(batch.shape[0])
+    memory_format = torch.channels_last if CHANNELS_LAST else torch.contiguous_format
+    with stage_timer("forward"):
+        outputs, features = model.forward_with_embedding(batch.to(device, memory_format=memory_format))
+    return outputs, torch.nn.functional.normalize(features.float(), dim=1).cpu()
+
+
+def class_probabilities(outputs: torch.Tensor, crops: Optional[Sequence[Optional[str]]] = None) -> torch.Tensor:
+    """Softmax over the classes (restricted per row by ``crops``), on the CPU"""
+    if crops is not None and any(crops):
+        outputs = restrict_logits(outputs, crops)
+    return torch.nn.functional.softmax(outputs, dim=1).cpu()
+
+
+# -----------------------------
+# Test-Time Augmentation
+# -----------------------------
+def tta_views(batch: torch.Tensor, crop_scale: float = TTA_CROP_SCALE) -> torch.Tensor:
+    """(N, C, H, W) -> (N, V, C, H, W): flips plus centre and corner crops of each image.
+
+    The unaugmented image is not included; callers already have its output.
+    """
+    n, c, h, w = batch.shape
+    ch, cw = round(h * crop_scale), round(w * crop_scale)
+    crops = [
+        batch[:, :, (h - ch) // 2:(h - ch) // 2 + ch, (w - cw) // 2:(w - cw) // 2 + cw],
+        batch[:, :, :ch, :cw],
+        batch[:, :, :ch, w - cw:],
+        batch[:, :, h - ch:, :cw],
+        batch[:, :, h - ch:, w - cw:],
+    ]
+    resized = torch.nn.functional.interpolate(
+        torch.cat(crops), size=(h, w), mode="bilinear", align_corners=False
+    ).view(len(crops), n, c, h, w)
+    flips = torch.stack([batch.flip(-1), batch.flip(-2)])
+    return torch.cat([flips, resized]).transpose(0, 1)
+
+
+def tta_probabilities(
+    batch: torch.Tensor,
+    probs: torch.Tensor,
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    crops: Optional[Sequence[Optional[str]]] = None,
+) -> torch.Tensor:
+    """Average ``probs`` (from the plain images) with the softmax of their TTA views.
+
+    All views of an image share one forward pass; with many images they are
+    chunked so a pass holds about PREDICT_BATCH_SIZE views.
+    """
+    views = tta_views(batch)
+    n, v = views.shape[:2]
+    per_pass = max(1, PREDICT_BATCH_SIZE // v)
+    averaged = []
+    for start in range(0, n, per_pass):
+        chunk = views[start:start + per_pass]
+        outputs = forward_logits(chunk.flatten(0, 1), model, device)
+        chunk_crops = None
+        if crops is not None:
+            chunk_crops = [crop for crop in crops[start:start + per_pass] for _ in range(v)]
+        view_probs = class_probabilities(outputs, chunk_crops).view(len(chunk), v, -1)
+        averaged.append((probs[start:start + per_pass] + view_probs.sum(dim=1)) / (v + 1))
+    return torch.cat(averaged)
+
+
+def predict_tensors(
+    batch: torch.Tensor,
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    crops: Optional[Sequence[Optional[str]]] = None,
+    tta: Optional[Sequence[str]] = None,
+    embed: bool = False,
+    match: Optional[Callable[[np.ndarray, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+    gate: Optional[Callable[[torch.Tensor, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+) -> List[dict]:
+    """Run one forward pass over a stacked (N, C, H, W) batch, one result per row.
+
+    ``crops`` optionally gives each row a canonical crop name (see
+    ``resolve_crop``) whose classes the answer is restricted to. ``tta``
+    gives each row a TTA mode (default ``TTA_MODE``); rows that need it are
+    re-scored from augmented views in one extra batched pass, and each
+    result's ``inference_path`` says whether that happened.
+
+    With ``embed`` (or ``match``) every result also carries its normalised
+    ``embedding`` as a float32 array. ``match`` looks those up among past
+    cases (see embeddings.py); rows with a near-duplicate get that case's
+    stored diagnosis instead of being classified and re-scored with TTA,
+    reported as ``inference_path="duplicate"``.
+
+    ``gate`` is a cheap first stage (see cascade.py) that answers the rows
+    it is confident about as ``inference_path="gate"``; only the rest go
+    through ``model``. Gated rows carry no embedding, and an explicit
+    ``embed`` bypasses the gate.
+    """
+    n = batch.shape[0]
+    tta = tta if tta is not None else [TTA_MODE] * n
+    crops = crops if crops is not None else [None] * n
+    if gate is not None and not embed:
+        results = gate(batch, crops)
+        rest = [i for i, result in enumerate(results) if result is None]
+        for result in results:
+            if result is not None:
+                PREDICTIONS.labels(result["label"]).inc()
+                result["inference_path"] = "gate"
+        if rest:
+            full = predict_tensors(
+                batch[rest], model, device, [crops[i] for i in rest], [tta[i] for i in rest], embed, match,
+            )
+            for i, result in zip(rest, full):
+                results[i] = result
+        return results
+    embed = embed or match is not None
+    with torch.inference_mode(), maybe_profile("forward"):
+        if embed:
+            outputs, embeddings = forward_with_embeddings(batch, model, device)
+            embeddings = embeddings.numpy()
+        else:
+            outputs = forward_logits(batch, model, device)
+        with stage_timer("postprocess"):
+            probs = class_probabilities(outputs, crops)
+
+        matches = match(embeddings, crops) if match is not None else [None] * n
+        confidence = probs.max(dim=1).values
+        rows = [
+            i for i, mode in enumerate(tta)
+            if matches[i] is None
+            and (mode == "always" or (mode == "auto" and confidence[i] < TTA_CONFIDENCE_THRESHOLD))
+        ]
+        if rows:
+            row_crops = [crops[i] for i in rows]
+            with stage_timer("tta"):
+                probs[rows] = tta_probabilities(batch[rows], probs[rows], model, device, row_crops)
+
+        with stage_timer("postprocess"):
+            results = [build_result(row) if matches[i] is None else dict(matches[i]) for i, row in enumerate(probs)]
+    augmented = set(rows)
+    for i, result in enumerate(results):
+        if matches[i] is not None:
+            PREDICTIONS.labels(result["label"]).inc()
+            result["inference_path"] = "duplicate"
+        else:
+            result["inference_path"] = "tta" if i in augmented else "single"
+        if embed:
+            result["embedding"] = embeddings[i]
+    return results
 
-        image_tensor = transform(image).unsqueeze(0).to(device)
-
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            probs = torch.nn.functional.softmax(outputs, dim=1)
-            
-            # Get top 5 for debugging
-            top5_probs, top5_indices = torch.topk(probs, min(5, len(class_names)), dim=1)
-            
-            logger.info("Top 5 predictions:")
-            for i in range(min(5, len(class_names))):
-                idx = int(top5_indices[0][i].item())
-                prob = float(top5_probs[0][i].item())
-                logger.info(f"  {i+1}. {class_names[idx]}: {prob:.4f}")
-            
-            confidence, predicted_idx = torch.max(probs, dim=1)
-            label = class_names[int(predicted_idx.item())]
-            confidence_value = float(confidence.item())
-
-        info = disease_info.get(label, {
-            "description": "No detailed info available for this class.",
-            "remedy": "Please consult an agricultural expert."
-        })
-
-        return {
-            "label": label,
-            "confidence": confidence_value,
-            "description": info["description"],
-            "remedy": info["remedy"]
-        }
+
+# -----------------------------
+# Predict Function
+# -----------------------------
+def predict(
+    image_bytes: Union[bytes, BinaryIO],
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    crop: Optional[str] = None,
+    tta: str = TTA_MODE,
+    gate: Optional[Callable[[torch.Tensor, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+) -> dict:
+    """Predict one image, optionally only among the classes of ``crop``.
+
+    With ``tta="auto"`` a low-confidence answer is re-scored from flipped
+    and cropped views; ``"always"`` does so for every image. ``gate`` is
+    passed on to ``predict_tensors``.
+    """
+    crop = resolve_crop(crop)
+    if tta not in TTA_MODES:
+        raise ValueError(f"tta must be one of {', '.join(TTA_MODES)}")
+    try:
+        image_tensor = preprocess(image_bytes).unsqueeze(0)
+        return predict_tensors(image_tensor, model, device, crops=[crop], tta=[tta], gate=gate)[0]
 
     except Exception as e:
         logger.exception("Prediction failed")
         raise RuntimeError(f"Prediction failed: {e}") from e
+
+
+# -----------------------------
+# Batch Predict Function
+# -----------------------------
+def predict_batch(
+    images: Sequence[Union[bytes, BinaryIO]],
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    batch_size: int = PREDICT_BATCH_SIZE,
+    crops: Optional[Sequence[Optional[str]]] = None,
+    tta: str = TTA_MODE,
+    embed: bool = False,
+    match: Optional[Callable[[np.ndarray, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+    gate: Optional[Callable[[torch.Tensor, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+) -> List[dict]:
+    """Predict many images, returning one result per input in input order.
+
+    Images are decoded individually so a corrupt file only produces an
+    ``{"error": ...}`` entry for that position; the rest are stacked and run
+    through the model ``batch_size`` at a time to bound peak memory.
+    ``crops``, if given, holds one crop (or None) per image; ``embed``,
+    ``match`` and ``gate`` are passed on to ``predict_tensors``.
+    """
+    if crops is not None and len(crops) != len(images):
+        raise ValueError("crops must have one entry per image")
+    crops = [resolve_crop(c) for c in crops] if crops is not None else [None] * len(images)
+    results: List[Optional[dict]] = [None] * len(images)
+    pending: List[Tuple[int, torch.Tensor]] = []
+
+    for i, image_bytes in enumerate(images):
+        try:
+            pending.append((i, preprocess(image_bytes)))
+        except Exception as e:
+            logger.warning(f"Skipping image {i}: could not decode ({e})")
+            results[i] = {"error": f"Could not decode image: {e}"}
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        try:
+            outputs = predict_tensors(
+                torch.stack([t for _, t in chunk]), model, device,
+                crops=[crops[i] for i, _ in chunk], tta=[tta] * len(chunk),
+                embed=embed, match=match, gate=gate,
+            )
+        except Exception as e:
+            logger.exception("Batch prediction failed")
+            outputs = [{"error": f"Prediction failed: {e}"} for _ in chunk]
+        for (i, _), result in zip(chunk, outputs):
+            results[i] = result
+
+    return results
+
+
+# -----------------------------
+# Frame Stream Predict Function
+# -----------------------------
+def predict_stream(
+    frames: Iterable[Tuple[Any, torch.Tensor]],
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    batch_size: int = PREDICT_BATCH_SIZE,
+    crop: Optional[str] = None,
+    tta: str = "off",
+    gate: Optional[Callable[[torch.Tensor, Sequence[Optional[str]]], List[Optional[dict]]]] = None,
+) -> Iterator[List[Tuple[Any, dict]]]:
+    """Predict a lazy stream of (tag, (C, H, W) tensor) frames ``batch_size`` at a time.
+
+    Yields each batch's (tag, result) pairs as soon as it is scored, and
+    only pulls the next frames from ``frames`` when asked for the next
+    batch, so decoding, inference and the consumer proceed in step.
+    """
+    crop = resolve_crop(crop)
+    if tta not in TTA_MODES:
+        raise ValueError(f"tta must be one of {', '.join(TTA_MODES)}")
+    frames = iter(frames)
+    while True:
+        chunk = list(itertools.islice(frames, batch_size))
+        if not chunk:
+            return
+        results = predict_tensors(
+            torch.stack([tensor for _, tensor in chunk]), model, device,
+            crops=[crop] * len(chunk), tta=[tta] * len(chunk), gate=gate,
+        )
+        yield [(tag, result) for (tag, _), result in zip(chunk, results)]
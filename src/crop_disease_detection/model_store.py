@@ -0,0 +1,168 @@
+"""Local, checksummed store for model weights.
+
+load_model resolves weights through here, so once a file has been fetched
+the service boots from local disk without touching the Hugging Face Hub.
+
+Usage:
+    python model_store.py prefetch            # download + checksum once
+    python model_store.py verify              # re-check stored files
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Store Configuration
+# -----------------------------
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "model_store")
+MODEL_REVISION = os.getenv("HF_MODEL_REVISION", "main")
+# Never contact the hub; fail if the weights are not already in the store
+MODEL_OFFLINE = os.getenv("MODEL_OFFLINE", os.getenv("HF_HUB_OFFLINE", "0")) == "1"
+# Explicit checkpoint path; bypasses the store and the hub entirely
+MODEL_PATH = os.getenv("MODEL_PATH", "")
+
+MANIFEST_NAME = "manifest.json"
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def entry_dir(repo_id: str, revision: str, store_dir: str = MODEL_STORE_DIR) -> str:
+    return os.path.join(store_dir, repo_id.replace("/", "--"), revision)
+
+
+def read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def verify(repo_id: str, filename: str, revision: str = MODEL_REVISION, store_dir: str = MODEL_STORE_DIR) -> bool:
+    """True if the stored file exists and matches its recorded checksum"""
+    directory = entry_dir(repo_id, revision, store_dir)
+    record = read_manifest(directory).get(filename)
+    path = os.path.join(directory, filename)
+    if record is None or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != record["size"]:
+        return False
+    return sha256_file(path) == record["sha256"]
+
+
+def fetch(
+    repo_id: str,
+    filename: str,
+    revision: str = MODEL_REVISION,
+    token: Optional[str] = None,
+    store_dir: str = MODEL_STORE_DIR,
+) -> str:
+    """Download one file from the hub into the store and record its checksum"""
+    from huggingface_hub import hf_hub_download
+
+    directory = entry_dir(repo_id, revision, store_dir)
+    os.makedirs(directory, exist_ok=True)
+    logger.info(f"Downloading weights from HF repo='{repo_id}' filename='{filename}' revision='{revision}'")
+    downloaded = hf_hub_download(repo_id=repo_id, filename=filename, revision=revision, token=token)
+
+    path = os.path.join(directory, filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copyfile(downloaded, tmp_path)
+    checksum = sha256_file(tmp_path)
+    os.replace(tmp_path, path)
+
+    manifest = read_manifest(directory)
+    manifest[filename] = {
+        "repo_id": repo_id,
+        "revision": revision,
+        "sha256": checksum,
+        "size": os.path.getsize(path),
+        "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    _write_manifest(directory, manifest)
+    logger.info(f"Stored {filename} in {directory} (sha256={checksum[:12]}...)")
+    return path
+
+
+def resolve_weights(
+    repo_id: str,
+    filename: str,
+    revision: str = MODEL_REVISION,
+    token: Optional[str] = None,
+    offline: bool = MODEL_OFFLINE,
+    store_dir: str = MODEL_STORE_DIR,
+) -> str:
+    """Local path to verified weights, downloading only if the store lacks them.
+
+    MODEL_PATH replaces the configured revision only; asking for any other
+    revision while it is set is an error rather than a silent substitution.
+    """
+    if MODEL_PATH:
+        if revision != MODEL_REVISION:
+            raise ValueError(f"MODEL_PATH={MODEL_PATH} is set; refusing to substitute it for revision '{revision}'")
+        if not os.path.exists(MODEL_PATH):
+            raise FileNotFoundError(f"MODEL_PATH={MODEL_PATH} does not exist")
+        return MODEL_PATH
+
+    path = os.path.join(entry_dir(repo_id, revision, store_dir), filename)
+    if verify(repo_id, filename, revision, store_dir):
+        logger.info(f"Using stored weights {path}")
+        return path
+
+    if os.path.exists(path):
+        logger.warning(f"Stored weights {path} failed checksum verification")
+    if offline:
+        raise FileNotFoundError(
+            f"No verified copy of {repo_id}/{filename}@{revision} in {store_dir} and offline mode is on; "
+            "run 'python model_store.py prefetch' first"
+        )
+    return fetch(repo_id, filename, revision, token, store_dir)
+
+
+def main() -> None:
+    from model import MODEL_FILENAME, REPO_ID
+
+    parser = argparse.ArgumentParser(description="Manage the local model weight store")
+    parser.add_argument("command", choices=["prefetch", "verify"])
+    parser.add_argument("--repo-id", default=REPO_ID)
+    parser.add_argument("--filename", default=MODEL_FILENAME)
+    parser.add_argument("--revision", default=MODEL_REVISION)
+    parser.add_argument("--store-dir", default=MODEL_STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "prefetch":
+        if verify(args.repo_id, args.filename, args.revision, args.store_dir):
+            print(f"Already stored and verified: {args.repo_id}/{args.filename}@{args.revision}")
+            return
+        path = fetch(args.repo_id, args.filename, args.revision, os.getenv("HF_TOKEN"), args.store_dir)
+        print(f"Prefetched to {path}")
+        return
+
+    ok = verify(args.repo_id, args.filename, args.revision, args.store_dir)
+    print(f"{args.repo_id}/{args.filename}@{args.revision}: {'OK' if ok else 'MISSING OR CORRUPT'}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
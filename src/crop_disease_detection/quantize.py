@@ -0,0 +1,169 @@
+"""Static post-training INT8 quantization for ResNet9.
+
+Usage:
+    # Calibrate on a folder of sample leaves and write the INT8 model
+    python quantize.py calibrate --calibration-dir samples/ --output exported/model_int8.ts
+
+    # Compare the INT8 model against fp32 on another folder of images
+    python quantize.py compare --images samples/ --int8 exported/model_int8.ts
+
+Serve the result with MODEL_PRECISION=int8 (and INT8_MODEL_PATH if the
+output path differs from the default).
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from backends import QUANT_ENGINE, example_input, load_quantized
+from images import iter_batches, list_images
+from model import IMAGE_SIZE, INT8_MODEL_PATH, class_names, load_model
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------------
+# Calibration
+# -----------------------------
+def quantize_model(model: nn.Module, calibration_paths: List[str], batch_size: int = 16) -> nn.Module:
+    """Insert observers, run the calibration images through, convert to INT8"""
+    torch.backends.quantized.engine = QUANT_ENGINE
+    model = model.cpu().eval()
+    qconfig_mapping = get_default_qconfig_mapping(QUANT_ENGINE)
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs=(example_input(IMAGE_SIZE),))
+
+    seen = 0
+    with torch.no_grad():
+        for _, batch in iter_batches(calibration_paths, batch_size):
+            prepared(batch)
+            seen += batch.shape[0]
+    if seen == 0:
+        raise RuntimeError("No calibration images could be decoded")
+    logger.info(f"Calibrated observers on {seen} images")
+    return convert_fx(prepared)
+
+
+def save_quantized(quantized: nn.Module, path: str) -> None:
+    """Save as TorchScript so load_model can load it without the FX graph code"""
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(quantized, example_input(IMAGE_SIZE)))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.jit.save(scripted, path)
+    logger.info(f"Saved INT8 model to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+# -----------------------------
+# Accuracy Report
+# -----------------------------
+def compare(fp32: nn.Module, int8: nn.Module, paths: List[str], batch_size: int = 16) -> dict:
+    """Top-1 agreement and confidence drift of INT8 versus fp32, per class.
+
+    Classes are grouped by the fp32 prediction. When images sit in folders
+    named after a class (ImageFolder layout) accuracy of both models is
+    reported as well.
+    """
+    per_class: Dict[str, Dict[str, float]] = {
+        name: {"count": 0, "agree": 0, "drift_sum": 0.0, "drift_max": 0.0} for name in class_names
+    }
+    fp32_time = int8_time = 0.0
+    labelled = fp32_correct = int8_correct = 0
+
+    with torch.no_grad():
+        for batch_paths, batch in iter_batches(paths, batch_size):
+            start = time.perf_counter()
+            ref = torch.softmax(fp32(batch), dim=1)
+            fp32_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            out = torch.softmax(int8(batch), dim=1)
+            int8_time += time.perf_counter() - start
+
+            ref_conf, ref_idx = ref.max(dim=1)
+            out_idx = out.argmax(dim=1)
+            # Drift is measured on the fp32 label so it captures calibration error
+            drift = (out.gather(1, ref_idx[:, None]).squeeze(1) - ref_conf).abs()
+
+            for j in range(batch.shape[0]):
+                stats = per_class[class_names[int(ref_idx[j])]]
+                stats["count"] += 1
+                stats["agree"] += int(ref_idx[j] == out_idx[j])
+                stats["drift_sum"] += float(drift[j])
+                stats["drift_max"] = max(stats["drift_max"], float(drift[j]))
+
+                folder = os.path.basename(os.path.dirname(batch_paths[j]))
+                if folder in class_names:
+                    labelled += 1
+                    fp32_correct += int(class_names[int(ref_idx[j])] == folder)
+                    int8_correct += int(class_names[int(out_idx[j])] == folder)
+
+    total = sum(s["count"] for s in per_class.values())
+    if total == 0:
+        raise RuntimeError("No comparison images could be decoded")
+
+    report = {
+        "images": total,
+        "top1_agreement": sum(s["agree"] for s in per_class.values()) / total,
+        "mean_confidence_drift": sum(s["drift_sum"] for s in per_class.values()) / total,
+        "fp32_ms_per_image": 1000 * fp32_time / total,
+        "int8_ms_per_image": 1000 * int8_time / total,
+        "speedup": fp32_time / int8_time if int8_time else None,
+        "per_class": {
+            name: {
+                "count": s["count"],
+                "top1_agreement": s["agree"] / s["count"],
+                "mean_confidence_drift": s["drift_sum"] / s["count"],
+                "max_confidence_drift": s["drift_max"],
+            }
+            for name, s in per_class.items()
+            if s["count"]
+        },
+    }
+    if labelled:
+        report["fp32_accuracy"] = fp32_correct / labelled
+        report["int8_accuracy"] = int8_correct / labelled
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization for ResNet9")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cal = sub.add_parser("calibrate", help="Calibrate and write an INT8 model")
+    cal.add_argument("--calibration-dir", required=True)
+    cal.add_argument("--output", default=INT8_MODEL_PATH)
+    cal.add_argument("--max-images", type=int, default=512)
+    cal.add_argument("--batch-size", type=int, default=16)
+
+    cmp_ = sub.add_parser("compare", help="Compare an INT8 model against fp32")
+    cmp_.add_argument("--images", required=True)
+    cmp_.add_argument("--int8", default=INT8_MODEL_PATH)
+    cmp_.add_argument("--batch-size", type=int, default=16)
+    cmp_.add_argument("--report", help="Also write the JSON report to this path")
+
+    args = parser.parse_args()
+    fp32 = load_model(device=torch.device("cpu"), token=os.getenv("HF_TOKEN"), backend="eager", precision="fp32")
+
+    if args.command == "calibrate":
+        paths = list_images(args.calibration_dir)[:args.max_images]
+        quantized = quantize_model(fp32, paths, args.batch_size)
+        save_quantized(quantized, args.output)
+        return
+
+    int8 = load_quantized(args.int8, IMAGE_SIZE)
+    report = compare(fp32, int8, list_images(args.images), args.batch_size)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
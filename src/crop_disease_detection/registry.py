@@ -0,0 +1,494 @@
+"""Versioned models served side by side, with hot-swap and traffic splitting.
+
+Each version owns its model and its own micro-batcher. New versions are
+loaded and warmed up in a background thread and only then added to the
+routing table, which is replaced in a single assignment, so requests never
+see a half-loaded model. Versions that lose all their traffic are drained
+(in-flight requests finish) before their batcher is stopped.
+
+Deploys and traffic changes are not applied by whichever server process
+got the admin call. They are written to a small JSON state file shared by
+every process of the server, and each process polls it and converges:
+it loads the versions it lacks and only then swaps in the new split.
+"""
+import asyncio
+import contextlib
+import fcntl
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from backends import EXPORT_DIR, example_input
+from batching import BATCH_MAX_SIZE, MicroBatcher
+from cascade import Cascade, open_cascade
+from embeddings import EMBEDDING_INDEX_DIR, EMBEDDING_INDEX_SAVE_SECONDS, EmbeddingIndex, open_index
+from metrics import WARMUP_SECONDS
+from model import CHANNELS_LAST, DEVICE, IMAGE_SIZE, PREDICT_BATCH_SIZE, embedding_dim, preprocess, supports_embeddings
+from workers import InferencePool
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Registry Configuration
+# -----------------------------
+# Batch sizes pushed through a model before it takes traffic; by default
+# single images plus the micro-batcher and /api/predict/batch chunk sizes
+WARMUP_BATCH_SIZES = sorted({
+    int(b) for b in os.getenv("WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE},{PREDICT_BATCH_SIZE}").split(",")
+    if b.strip()
+})
+# Longest a retired version waits for its in-flight requests
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", 30))
+# Versions and split shared by the server's processes. The default is keyed
+# by the pid of the process importing this module, i.e. the gunicorn master
+# with preload_app, so the forked workers share it and a restart starts over
+# from the startup model.
+REGISTRY_STATE_PATH = os.getenv(
+    "REGISTRY_STATE_PATH", os.path.join(tempfile.gettempdir(), f"crop-disease-registry-{os.getpid()}.json")
+)
+# How often each process checks the state file for changes
+REGISTRY_SYNC_SECONDS = float(os.getenv("REGISTRY_SYNC_SECONDS", 2))
+
+
+class ModelNotFoundError(KeyError):
+    """Raised for a version the registry doesn't hold"""
+
+
+class VersionConflictError(ValueError):
+    """Raised when deploying a version that is already loaded or loading"""
+
+
+def warm_up(
+    model: nn.Module,
+    batch_sizes: List[int] = WARMUP_BATCH_SIZES,
+    device: torch.device = DEVICE,
+    channels_last: bool = CHANNELS_LAST,
+) -> float:
+    """Decode a synthetic photo and run a forward pass per batch size.
+
+    Loads the PIL codecs, spins up torch's intra-op threads and grows the
+    allocator to its working size on the calling thread, so the first real
+    requests don't pay for it. ``channels_last`` should match the layout
+    the model is served with (forward_logits uses CHANNELS_LAST), so the
+    warmed kernels are the ones requests run.
+    """
+    start = time.perf_counter()
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    buffer = io.BytesIO()
+    Image.new("RGB", (IMAGE_SIZE * 2, IMAGE_SIZE * 2), (90, 140, 60)).save(buffer, "JPEG")
+    preprocess(buffer.getvalue())
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            model(example_input(IMAGE_SIZE, batch_size).to(device, memory_format=memory_format))
+    return time.perf_counter() - start
+
+
+# -----------------------------
+# Shared State
+# -----------------------------
+def read_state(path: str = REGISTRY_STATE_PATH) -> Optional[dict]:
+    """``{"generation", "versions": {version: spec}, "traffic": {version: share}}``, or None before any change"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def update_state(change: Callable[[dict], None], path: str = REGISTRY_STATE_PATH) -> dict:
+    """Read-modify-write the shared state under a file lock, bumping its generation.
+
+    ``change`` edits the state in place; if it raises, nothing is written.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = read_state(path) or {"generation": 0, "versions": {}, "traffic": {}}
+        change(state)
+        state["generation"] += 1
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    return state
+
+
+def describe_source(spec: dict) -> str:
+    return spec.get("path") or f"revision {spec.get('revision') or 'main'}"
+
+
+class ModelVersion:
+    def __init__(
+        self,
+        version: str,
+        model: nn.Module,
+        batcher: MicroBatcher,
+        source: str,
+        index: Optional[EmbeddingIndex] = None,
+        cascade: Optional[Cascade] = None,
+    ):
+        self.version = version
+        self.model = model
+        self.batcher = batcher
+        self.source = source
+        # Past uploads' embeddings; None for backends without embeddings
+        self.index = index
+        # Healthy/diseased gate in front of the model; None without one
+        self.cascade = cascade
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.warm = False
+
+    @classmethod
+    def create(cls, version: str, model: nn.Module, source: str, pool: InferencePool) -> "ModelVersion":
+        """Wrap a loaded model with its batcher, its index if it has embeddings and its cascade gate if configured"""
+        index = open_index(version, embedding_dim(model)) if supports_embeddings(model) else None
+        cascade = open_cascade(version)
+        # Embeddings are only computed on every request when they can save work
+        match = index.match if index is not None and index.matching else None
+        batcher = MicroBatcher(model, pool=pool, match=match, gate=cascade)
+        return cls(version, model, batcher, source, index, cascade)
+
+    def save_index(self) -> None:
+        if self.index is not None and self.index.path and self.index.dirty:
+            self.index.save()
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at)),
+            "inflight": self.inflight,
+            "warm": self.warm,
+            "embeddings": self.index.stats() if self.index is not None else None,
+            "cascade_threshold": self.cascade.threshold if self.cascade is not None else None,
+        }
+
+
+class ModelRegistry:
+    """Routes requests across loaded model versions by traffic percentage.
+
+    Routing hashes the upload, so the same image always goes to the same
+    version for a given split and its cached result stays valid.
+    """
+
+    def __init__(
+        self,
+        pool: InferencePool,
+        loader_for: Optional[Callable[[str, dict], Callable[[], nn.Module]]] = None,
+        state_path: str = REGISTRY_STATE_PATH,
+    ):
+        self.pool = pool
+        # (version, spec) -> loader, for versions named in the shared state
+        self.loader_for = loader_for
+        self.state_path = state_path
+        # Shared state generation this process has applied, and how that went
+        self.generation = 0
+        self.sync_error: Optional[str] = None
+        self.synced = False
+        self._sync_lock = asyncio.Lock()
+        self._syncer: Optional[asyncio.Task] = None
+        self._versions: Dict[str, ModelVersion] = {}
+        # (cumulative upper bound out of 100, version), replaced as a whole
+        self._routes: List[Tuple[int, str]] = []
+        self._loading: Dict[str, str] = {}
+        # Background deploys and retirements, referenced so they aren't collected
+        self._tasks: Set[asyncio.Task] = set()
+        self._autosave: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # Lookup
+    # -----------------------------
+    @property
+    def loaded(self) -> bool:
+        return bool(self._routes)
+
+    @property
+    def ready(self) -> bool:
+        """Serving traffic, caught up with the shared state, and every version that gets some is warmed up"""
+        routes = self._routes
+        return bool(routes) and self.synced and all(self._versions[v].warm for _, v in routes)
+
+    @property
+    def traffic(self) -> Dict[str, int]:
+        split, lower = {}, 0
+        for upper, version in self._routes:
+            split[version] = upper - lower
+            lower = upper
+        return split
+
+    def get(self, version: str) -> ModelVersion:
+        try:
+            return self._versions[version]
+        except KeyError:
+            raise ModelNotFoundError(version) from None
+
+    def route(self, content: bytes) -> ModelVersion:
+        """Pick the version that serves ``content`` under the current split"""
+        routes = self._routes
+        if not routes:
+            raise RuntimeError("No model version is loaded")
+        bucket = zlib.crc32(content) % 100
+        for upper, version in routes:
+            if bucket < upper:
+                return self._versions[version]
+        return self._versions[routes[-1][1]]
+
+    @contextlib.contextmanager
+    def acquire(self, content: bytes) -> Iterator[ModelVersion]:
+        """Route ``content`` and keep its version from being retired until done"""
+        with self._lock:
+            entry = self.route(content)
+            entry.inflight += 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.inflight -= 1
+
+    def versions(self) -> List[ModelVersion]:
+        return list(self._versions.values())
+
+    def describe(self) -> dict:
+        """This process's view; ``generation`` says which shared state it has applied"""
+        return {
+            "traffic": self.traffic,
+            "versions": [entry.info() for entry in self._versions.values()],
+            "loading": dict(self._loading),
+            "generation": self.generation,
+            "sync_error": self.sync_error,
+            "pid": os.getpid(),
+        }
+
+    # -----------------------------
+    # Deploys
+    # -----------------------------
+    def add(self, version: str, model: nn.Module, source: str) -> ModelVersion:
+        """Register an already loaded model; the first one gets all the traffic.
+
+        Used for the model loaded at import time, before the event loop runs;
+        its batcher starts with ``start()``.
+        """
+        entry = ModelVersion.create(version, model, source, self.pool)
+        self._versions[version] = entry
+        if not self._routes:
+            self._routes = [(100, version)]
+        return entry
+
+    async def start(self) -> None:
+        for entry in self._versions.values():
+            await entry.batcher.start()
+        self._syncer = asyncio.create_task(self._sync_periodically())
+        if EMBEDDING_INDEX_DIR:
+            self._autosave = asyncio.create_task(self._save_indexes_periodically())
+
+    async def save_indexes(self) -> None:
+        """Persist every version's embedding index that changed since its last save"""
+        loop = asyncio.get_running_loop()
+        for entry in list(self._versions.values()):
+            try:
+                await loop.run_in_executor(None, entry.save_index)
+            except Exception:
+                logger.exception(f"Saving the embedding index of '{entry.version}' failed")
+
+    async def _save_indexes_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(EMBEDDING_INDEX_SAVE_SECONDS)
+            await self.save_indexes()
+
+    async def warm(self, entry: ModelVersion) -> float:
+        """Warm ``entry`` on every inference worker thread, then mark it warm.
+
+        One worker runs all the batch sizes; the others only need their
+        per-thread setup, so they get a single image.
+        """
+        start = time.perf_counter()
+        await asyncio.gather(
+            self.pool.execute(warm_up, entry.model),
+            *(self.pool.execute(warm_up, entry.model, [1]) for _ in range(self.pool.workers - 1)),
+        )
+        if entry.cascade is not None:
+            # The gate is fed the preprocessed batch as is
+            await self.pool.execute(warm_up, entry.cascade.gate, channels_last=False)
+        seconds = time.perf_counter() - start
+        entry.warm = True
+        WARMUP_SECONDS.set(seconds)
+        logger.info(f"Model version '{entry.version}' warmed up in {seconds:.2f}s (batch sizes {WARMUP_BATCH_SIZES})")
+        return seconds
+
+    async def load(self, version: str, loader: Callable[[], nn.Module], source: str) -> ModelVersion:
+        """Load and warm ``version`` off the event loop and start its batcher, without giving it traffic"""
+        if version in self._versions or version in self._loading:
+            raise VersionConflictError(f"Model version '{version}' is already loaded")
+        self._loading[version] = source
+        try:
+            loop = asyncio.get_running_loop()
+            model = await loop.run_in_executor(None, loader)
+            logger.info(f"Model version '{version}' loaded from {source}")
+
+            entry = await loop.run_in_executor(None, ModelVersion.create, version, model, source, self.pool)
+            await self.warm(entry)
+            await entry.batcher.start()
+            self._versions[version] = entry
+        finally:
+            self._loading.pop(version, None)
+        return entry
+
+    # -----------------------------
+    # Shared State
+    # -----------------------------
+    def _current(self, state: dict) -> Tuple[Dict[str, dict], Dict[str, int]]:
+        """Versions and split in effect: the shared state's, or this process's before the first change"""
+        if state["traffic"]:
+            return state["versions"], state["traffic"]
+        # Only the startup model is loaded, from the default configuration
+        return {version: {} for version in self.traffic}, self.traffic
+
+    async def plan_deploy(self, version: str, spec: dict, traffic: int = 100) -> dict:
+        """Record a deploy of ``version`` in the shared state; every process then loads it.
+
+        ``spec`` is passed to ``loader_for`` ({"path"} or {"revision"}). With
+        ``traffic=100`` this is a hot swap: the previous versions stop getting
+        new requests and are retired once their in-flight ones finish.
+        Otherwise the remaining share stays on the current primary version and
+        any other version (e.g. an earlier canary) is retired.
+        """
+        if not 0 <= traffic <= 100:
+            raise ValueError("traffic must be between 0 and 100")
+
+        def change(state: dict) -> None:
+            versions, split = self._current(state)
+            if version in versions or version in self._loading:
+                raise VersionConflictError(f"Model version '{version}' is already loaded")
+            primary = max(split, key=split.get) if split else None
+            if traffic == 100 or primary is None:
+                split = {version: 100}
+            else:
+                split = {primary: 100 - traffic, version: traffic}
+            state["versions"] = {v: versions[v] for v in split if v != version}
+            state["versions"][version] = spec
+            state["traffic"] = split
+
+        return await self._update_state(change)
+
+    async def plan_traffic(self, split: Dict[str, int]) -> dict:
+        """Record a new split in the shared state; versions left out of it are retired everywhere"""
+        if any(share < 0 for share in split.values()) or sum(split.values()) != 100:
+            raise ValueError("Traffic shares must be non-negative and add up to 100")
+
+        def change(state: dict) -> None:
+            versions, _ = self._current(state)
+            unknown = [v for v in split if v not in versions]
+            if unknown:
+                raise ModelNotFoundError(", ".join(unknown))
+            state["versions"] = {v: versions[v] for v in split}
+            state["traffic"] = dict(split)
+
+        return await self._update_state(change)
+
+    async def _update_state(self, change: Callable[[dict], None]) -> dict:
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, update_state, change, self.state_path)
+        logger.info(f"Shared registry state is now generation {state['generation']}: traffic {state['traffic']}")
+        # This process applies it right away; the others on their next poll
+        self._spawn(self.sync())
+        return state
+
+    async def sync(self) -> None:
+        """Apply a newer shared state: load the versions this process lacks, then swap in the split.
+
+        A generation that fails to apply is reported in ``sync_error`` and not
+        retried until the state changes again.
+        """
+        async with self._sync_lock:
+            loop = asyncio.get_running_loop()
+            state = await loop.run_in_executor(None, read_state, self.state_path)
+            if state is not None and state["generation"] > self.generation:
+                try:
+                    for version, spec in state["versions"].items():
+                        if version not in self._versions:
+                            await self.load(version, self.loader_for(version, spec), describe_source(spec))
+                    await self.set_traffic(state["traffic"])
+                    self.sync_error = None
+                except Exception as e:
+                    logger.exception(f"Applying registry state generation {state['generation']} failed")
+                    self.sync_error = f"generation {state['generation']}: {e}"
+                self.generation = state["generation"]
+            self.synced = True
+
+    async def _sync_periodically(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Reading the shared registry state failed")
+            await asyncio.sleep(REGISTRY_SYNC_SECONDS)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def set_traffic(self, split: Dict[str, int]) -> Dict[str, int]:
+        """Replace the traffic split; versions left out of it are retired"""
+        unknown = [v for v in split if v not in self._versions]
+        if unknown:
+            raise ModelNotFoundError(", ".join(unknown))
+        if any(share < 0 for share in split.values()) or sum(split.values()) != 100:
+            raise ValueError("Traffic shares must be non-negative and add up to 100")
+
+        routes, upper = [], 0
+        for version, share in split.items():
+            if share:
+                upper += share
+                routes.append((upper, version))
+        self._routes = routes
+        logger.info(f"Traffic split is now {self.traffic}")
+
+        for version in [v for v in self._versions if v not in split]:
+            self._spawn(self.retire(version))
+        return self.traffic
+
+    async def retire(self, version: str) -> None:
+        """Stop routing to ``version``, let in-flight requests finish, then drop it"""
+        entry = self.get(version)
+        if any(v == version for _, v in self._routes):
+            raise ValueError(f"Model version '{version}' still has traffic")
+
+        deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+        while entry.inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if entry.inflight:
+            logger.warning(f"Retiring '{version}' with {entry.inflight} requests still in flight")
+        await entry.batcher.stop()
+        await asyncio.get_running_loop().run_in_executor(None, entry.save_index)
+        self._versions.pop(version, None)
+        logger.info(f"Model version '{version}' retired")
+
+    async def stop(self) -> None:
+        self._routes = []
+        if self._syncer is not None:
+            self._syncer.cancel()
+        if self._autosave is not None:
+            self._autosave.cancel()
+        for entry in list(self._versions.values()):
+            await entry.batcher.stop()
+        await self.save_indexes()
+        self._versions.clear()
+
+
+def artifact_dir_for(version: str) -> str:
+    """Per-version directory for exported backend artifacts"""
+    return os.path.join(EXPORT_DIR, "versions", re.sub(r"[^A-Za-z0-9._-]+", "_", version))
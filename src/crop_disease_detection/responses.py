@@ -0,0 +1,172 @@
+"""Prediction response bodies assembled from precomputed JSON fragments.
+
+Everything about a class that never changes (label, description, remedy)
+is encoded once at import time, per language and class id. A response is
+then a join of those bytes plus the few per-request values, instead of a
+fresh dict that gets serialised on every call.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from model import CROPS, class_names, crop_of, disease_info
+
+try:
+    import orjson
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  # pragma: no cover - orjson is optional
+    def dumps(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# -----------------------------
+# Response Configuration
+# -----------------------------
+# Language code -> {label: {"description", "remedy"}}; add translations here
+LANGUAGES: Dict[str, Dict[str, Dict[str, str]]] = {"ne": disease_info}
+DEFAULT_LANG = os.getenv("DEFAULT_LANG", "ne")
+# Every field a prediction response can carry, in output order
+RESPONSE_FIELDS = (
+    "label", "confidence", "description", "remedy", "model_version", "crop", "inference_path", "tiling",
+    "embedding",
+)
+STATIC_FIELDS = ("label", "description", "remedy")
+
+FALLBACK_INFO = {
+    "description": "No detailed info available for this class.",
+    "remedy": "Please consult an agricultural expert.",
+}
+CLASS_INDEX = {name: i for i, name in enumerate(class_names)}
+
+
+def _key(field: str) -> bytes:
+    return dumps(field) + b":"
+
+
+_KEYS = {field: _key(field) for field in RESPONSE_FIELDS}
+
+
+def describe(class_id: int, lang: str = DEFAULT_LANG) -> Dict[str, str]:
+    """Description and remedy of a class in ``lang``"""
+    return LANGUAGES[lang].get(class_names[class_id], FALLBACK_INFO)
+
+
+def class_id_of(result: dict) -> int:
+    class_id = result.get("class_id")
+    if class_id is None:
+        # Results cached before class ids were recorded
+        class_id = CLASS_INDEX[result["label"]]
+    return class_id
+
+
+def _build_fragments() -> Dict[str, List[Dict[str, bytes]]]:
+    fragments = {}
+    for lang in LANGUAGES:
+        per_class = []
+        for class_id, label in enumerate(class_names):
+            values = {"label": label, **describe(class_id, lang)}
+            per_class.append({field: _KEYS[field] + dumps(values[field]) for field in STATIC_FIELDS})
+        fragments[lang] = per_class
+    return fragments
+
+
+# FRAGMENTS[lang][class_id][field] -> b'"field":<json value>'
+FRAGMENTS = _build_fragments()
+
+
+# -----------------------------
+# Request Options
+# -----------------------------
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """'label,confidence' -> ('label', 'confidence'); None or '' means every field"""
+    if not fields:
+        return RESPONSE_FIELDS
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(RESPONSE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Expected any of: {', '.join(RESPONSE_FIELDS)}")
+    return tuple(f for f in RESPONSE_FIELDS if f in requested)
+
+
+def parse_lang(lang: Optional[str]) -> str:
+    if not lang:
+        return DEFAULT_LANG
+    lang = lang.strip().lower()
+    if lang not in LANGUAGES:
+        raise ValueError(f"Unsupported lang '{lang}'. Expected one of: {', '.join(LANGUAGES)}")
+    return lang
+
+
+# -----------------------------
+# Rendering
+# -----------------------------
+def _prediction_parts(result: dict, fields: Sequence[str], lang: str, dynamic: dict) -> List[bytes]:
+    static = FRAGMENTS[lang][class_id_of(result)]
+    parts = []
+    for field in fields:
+        if field in static:
+            parts.append(static[field])
+        elif field == "confidence":
+            parts.append(_KEYS[field] + dumps(result["confidence"]))
+        elif field in dynamic:
+            parts.append(_KEYS[field] + dumps(dynamic[field]))
+        elif field in result:
+            # Optional result sections, e.g. "tiling" from tiled inference
+            parts.append(_KEYS[field] + dumps(result[field]))
+    return parts
+
+
+def render_prediction(
+    result: dict,
+    fields: Sequence[str] = RESPONSE_FIELDS,
+    lang: str = DEFAULT_LANG,
+    **dynamic,
+) -> bytes:
+    """JSON body for one prediction; ``dynamic`` holds per-request fields such as model_version"""
+    return b"{" + b",".join(_prediction_parts(result, fields, lang, dynamic)) + b"}"
+
+
+def render_batch(
+    items: Iterable[Tuple[str, dict]],
+    fields: Sequence[str] = RESPONSE_FIELDS,
+    lang: str = DEFAULT_LANG,
+) -> bytes:
+    """JSON body for /api/predict/batch from (filename, result) pairs in input order"""
+    rendered, count, failed = [], 0, 0
+    for filename, result in items:
+        count += 1
+        if "error" in result:
+            failed += 1
+            rendered.append(dumps({"error": result["error"], "filename": filename}))
+            continue
+        parts = _prediction_parts(result, fields, lang, result)
+        parts.append(b'"filename":' + dumps(filename))
+        rendered.append(b"{" + b",".join(parts) + b"}")
+    return (
+        b'{"count":' + dumps(count) + b',"failed":' + dumps(failed)
+        + b',"results":[' + b",".join(rendered) + b"]}"
+    )
+
+
+# -----------------------------
+# Static Disease Index
+# -----------------------------
+def _build_disease_index() -> Dict[str, Tuple[bytes, str]]:
+    index = {}
+    for lang in LANGUAGES:
+        body = dumps({
+            "lang": lang,
+            "crops": CROPS,
+            "classes": [
+                {"id": class_id, "label": label, "crop": crop_of(label), **describe(class_id, lang)}
+                for class_id, label in enumerate(class_names)
+            ],
+        })
+        index[lang] = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+    return index
+
+
+# lang -> (JSON body, strong ETag) for /api/diseases
+DISEASE_INDEX = _build_disease_index()
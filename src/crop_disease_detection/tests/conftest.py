@@ -0,0 +1,32 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+# The service modules are imported flat (``from model import ...``), as when run from their directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def image_bytes():
+    """Factory for encoded noise images: image_bytes(width, height, fmt="JPEG", seed=0)"""
+    def make(width: int = 96, height: int = 64, fmt: str = "JPEG", seed: int = 0) -> bytes:
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, fmt)
+        return buffer.getvalue()
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def random_model():
+    """Untrained ResNet9 in eval mode; enough to exercise the inference plumbing"""
+    from model import ResNet9
+
+    torch.manual_seed(0)
+    return ResNet9(3, 38).eval()
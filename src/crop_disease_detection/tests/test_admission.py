@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, Deadline, DeadlineExceededError, OverloadedError
+from workers import InferencePool, QueueFullError
+
+
+async def _hold(controller: AdmissionController, release: asyncio.Event, deadline: Deadline) -> None:
+    async with controller.admit(deadline):
+        await release.wait()
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    controller = AdmissionController(max_inflight=1, max_queued=1)
+
+    async def overload():
+        release = asyncio.Event()
+        holders = [asyncio.ensure_future(_hold(controller, release, Deadline(5000))) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert (controller.inflight, controller.waiting) == (1, 1)
+        with pytest.raises(OverloadedError) as rejected:
+            async with controller.admit(Deadline(5000)):
+                pass
+        release.set()
+        await asyncio.gather(*holders)
+        return rejected.value
+
+    error = asyncio.run(overload())
+    assert error.retry_after >= admission.RETRY_AFTER_SECONDS
+    assert (controller.inflight, controller.waiting) == (0, 0)
+
+
+def test_retry_after_grows_with_the_backlog():
+    controller = AdmissionController(max_inflight=2, max_queued=100)
+    controller._avg_seconds = 1.0
+    quiet = controller.retry_after()
+    controller.waiting = 20
+    busy = controller.retry_after()
+
+    assert quiet == admission.RETRY_AFTER_SECONDS
+    assert quiet < busy <= admission.RETRY_AFTER_MAX_SECONDS
+
+
+def test_queued_request_gives_up_at_its_deadline():
+    controller = AdmissionController(max_inflight=1, max_queued=4)
+
+    async def wait_past_deadline():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(controller, release, Deadline(5000)))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(DeadlineExceededError):
+                async with controller.admit(Deadline(50)):
+                    pass
+            assert controller.waiting == 0
+        finally:
+            release.set()
+            await holder
+
+    asyncio.run(wait_past_deadline())
+
+
+@pytest.mark.parametrize("value, timeout_ms", [(None, admission.REQUEST_TIMEOUT_MS), ("250", 250)])
+def test_deadline_from_header(value, timeout_ms):
+    deadline = Deadline.from_header(value)
+    assert deadline.remaining() == pytest.approx(timeout_ms / 1000, abs=0.05)
+
+
+@pytest.mark.parametrize("value", ["soon", "0", "-5", str(admission.MAX_REQUEST_TIMEOUT_MS + 1)])
+def test_bad_timeout_headers_are_rejected(value):
+    with pytest.raises(ValueError):
+        Deadline.from_header(value)
+
+
+def test_guard_refuses_to_start_expired_work():
+    deadline = Deadline(1000)
+    deadline.at -= 2
+    with pytest.raises(DeadlineExceededError):
+        deadline.guard(lambda: None)()
+
+
+def test_pool_fails_fast_when_its_backlog_is_full():
+    pool = InferencePool(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def overload():
+        busy = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(QueueFullError):
+                await pool.run(lambda: None)
+        finally:
+            release.set()
+            await asyncio.gather(*busy)
+
+    try:
+        asyncio.run(overload())
+    finally:
+        pool.shutdown()
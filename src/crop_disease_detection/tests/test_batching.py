@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+import torch
+
+import batching
+from admission import Deadline, DeadlineExceededError
+from batching import MicroBatcher
+
+
+@pytest.fixture
+def forwards(monkeypatch):
+    """Replace the model call with one that records batch sizes and echoes each item's id"""
+    calls = []
+
+    def fake_predict_tensors(tensors, model, device, crops, tta, embed, match, gate):
+        calls.append(len(tensors))
+        return [{"id": int(t[0, 0, 0]), "crop": crop} for t, crop in zip(tensors, crops)]
+
+    monkeypatch.setattr(batching, "predict_tensors", fake_predict_tensors)
+    return calls
+
+
+def _item(i: int) -> torch.Tensor:
+    return torch.full((3, 4, 4), float(i))
+
+
+async def _run(batcher: MicroBatcher, coro_fn):
+    await batcher.start()
+    try:
+        return await coro_fn()
+    finally:
+        await batcher.stop()
+
+
+def test_results_go_back_to_their_callers(forwards):
+    batcher = MicroBatcher(model=None, max_batch_size=4, max_wait_ms=50)
+
+    async def submit_all():
+        return await asyncio.gather(*(batcher.submit(_item(i), crop=f"crop{i}") for i in range(6)))
+
+    results = asyncio.run(_run(batcher, submit_all))
+    assert [r["id"] for r in results] == list(range(6))
+    assert [r["crop"] for r in results] == [f"crop{i}" for i in range(6)]
+    assert forwards == [4, 2]
+
+
+def test_lone_request_waits_at_most_max_wait(forwards):
+    batcher = MicroBatcher(model=None, max_batch_size=8, max_wait_ms=50)
+
+    async def submit_one():
+        start = time.perf_counter()
+        result = await batcher.submit(_item(7))
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(_run(batcher, submit_one))
+    assert result["id"] == 7
+    assert 0.04 <= elapsed < 1.0
+    assert forwards == [1]
+
+
+def test_expired_requests_are_dropped_before_the_forward_pass(forwards):
+    batcher = MicroBatcher(model=None, max_batch_size=4, max_wait_ms=50)
+    expired = Deadline(1000)
+    expired.at = time.monotonic() - 1
+
+    async def submit_both():
+        return await asyncio.gather(
+            batcher.submit(_item(1), deadline=expired),
+            batcher.submit(_item(2), deadline=Deadline(5000)),
+            return_exceptions=True,
+        )
+
+    late, on_time = asyncio.run(_run(batcher, submit_both))
+    assert isinstance(late, DeadlineExceededError)
+    assert on_time["id"] == 2
+    assert forwards == [1]
+
+
+def test_stop_fails_waiting_callers(forwards):
+    batcher = MicroBatcher(model=None, max_batch_size=4, max_wait_ms=10_000)
+
+    async def stop_while_waiting():
+        await batcher.start()
+        waiting = [asyncio.ensure_future(batcher.submit(_item(i))) for i in range(2)]
+        await asyncio.sleep(0.01)
+        await batcher.stop()
+        return await asyncio.gather(*waiting, return_exceptions=True)
+
+    results = asyncio.run(stop_while_waiting())
+    assert all(isinstance(r, (RuntimeError, asyncio.CancelledError)) for r in results)
+    assert forwards == []
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+
+from cache import PredictionCache, cache_key
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PredictionCache(max_entries=2, directory=None)
+    cache.set("a", {"label": "a"})
+    cache.set("b", {"label": "b"})
+    assert cache.get("a") == {"label": "a"}
+    cache.set("c", {"label": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"label": "a"}
+    assert cache.get("c") == {"label": "c"}
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = PredictionCache(max_entries=4, ttl_seconds=10, directory=None)
+    cache.set("a", {"label": "a"})
+    now[0] += 9
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_results_are_copies():
+    cache = PredictionCache(directory=None)
+    result = {"label": "a"}
+    cache.set("a", result)
+    result["label"] = "changed"
+    cache.get("a")["label"] = "changed too"
+    assert cache.get("a") == {"label": "a"}
+
+
+def test_cache_key_depends_on_model_and_variant():
+    key = cache_key(b"image", "v1")
+    assert key == cache_key(b"image", "v1", "")
+    assert len({key, cache_key(b"image", "v2"), cache_key(b"image", "v1", "tomato"), cache_key(b"other", "v1")}) == 4
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    PredictionCache(directory=str(tmp_path)).set("ab12", {"label": "a", "confidence": 0.9})
+
+    restarted = PredictionCache(directory=str(tmp_path))
+    assert restarted.get("ab12") == {"label": "a", "confidence": 0.9}
+    stats = restarted.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["entries"]) == (1, 1, 1)
+
+
+def test_async_round_trip_through_disk(tmp_path):
+    async def round_trip():
+        await PredictionCache(directory=str(tmp_path)).aset("cd34", {"label": "c"})
+        return await PredictionCache(directory=str(tmp_path)).aget("cd34")
+
+    assert asyncio.run(round_trip()) == {"label": "c"}
+
+
+def test_sweep_removes_expired_then_least_recently_used(tmp_path):
+    cache = PredictionCache(ttl_seconds=100, directory=str(tmp_path), max_disk_entries=2)
+    for key in ("aa01", "aa02", "aa03", "aa04"):
+        cache.set(key, {"label": key})
+    now = time.time()
+    os.utime(cache._path("aa01"), (now - 200, now - 200))
+    os.utime(cache._path("aa02"), (now - 50, now - 50))
+    os.utime(cache._path("aa03"), (now - 40, now - 40))
+
+    assert cache.sweep() == 2
+    assert not os.path.exists(cache._path("aa01"))
+    assert not os.path.exists(cache._path("aa02"))
+    assert os.path.exists(cache._path("aa03")) and os.path.exists(cache._path("aa04"))
+    assert cache.stats()["disk_entries"] == 2
@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+import model
+from model import CROP_CLASS_INDICES, class_probabilities, crop_of, predict_tensors, resolve_crop, restrict_logits
+
+
+@pytest.mark.parametrize("name, crop", [
+    ("tomato", "Tomato"),
+    (" Corn ", "Corn_(maize)"),
+    ("pepper", "Pepper,_bell"),
+    ("Pepper, bell", "Pepper,_bell"),
+    ("cherry", "Cherry_(including_sour)"),
+    (None, None),
+    ("", None),
+])
+def test_resolve_crop_accepts_short_and_full_names(name, crop):
+    assert resolve_crop(name) == crop
+
+
+def test_resolve_crop_rejects_unknown_crops():
+    with pytest.raises(ValueError, match="Unknown crop"):
+        resolve_crop("banana")
+
+
+def test_restriction_is_per_row():
+    logits = torch.randn(3, len(model.class_names))
+    probs = class_probabilities(logits, ["Tomato", None, "Apple"])
+
+    tomato, apple = CROP_CLASS_INDICES["Tomato"], CROP_CLASS_INDICES["Apple"]
+    assert probs[0, tomato].sum() == pytest.approx(1.0)
+    assert probs[2, apple].sum() == pytest.approx(1.0)
+    torch.testing.assert_close(probs[1], torch.softmax(logits[1], dim=0))
+
+
+def test_outputs_of_another_width_are_left_alone():
+    logits = torch.randn(2, 5)
+    assert restrict_logits(logits, ["Tomato", None]) is logits
+
+
+def test_predictions_stay_within_the_requested_crop(random_model):
+    batch = torch.rand(3, 3, 64, 64)
+    results = predict_tensors(batch, random_model, crops=["Grape", "Potato", None], tta=["off"] * 3)
+
+    assert crop_of(results[0]["label"]) == "Grape"
+    assert crop_of(results[1]["label"]) == "Potato"
+    assert results[2]["label"] in model.class_names
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingIndex
+
+DIM = 8
+
+
+def _vector(seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _result(class_id: int = 3, confidence: float = 0.9) -> dict:
+    return {"class_id": class_id, "confidence": confidence}
+
+
+def _index(capacity: int = 3, **kwargs) -> EmbeddingIndex:
+    return EmbeddingIndex(capacity=capacity, dim=DIM, duplicate_threshold=0.99, **kwargs)
+
+
+def _ids(index: EmbeddingIndex) -> set:
+    return {f"img{i}" for i in range(20) if index.lookup(f"img{i}") is not None}
+
+
+def test_ring_overwrites_the_oldest_entries():
+    index = _index(capacity=3)
+    for i in range(5):
+        index.add(_vector(i), f"img{i}", _result(class_id=i))
+
+    assert len(index) == 3
+    assert _ids(index) == {"img2", "img3", "img4"}
+    assert index.lookup("img4")["class_id"] == 4
+
+
+def test_reindexing_an_image_replaces_its_row():
+    index = _index(capacity=3)
+    for i in range(3):
+        index.add(_vector(i), f"img{i}", _result(class_id=i))
+    index.add(_vector(0), "img0", _result(class_id=9))
+
+    assert len(index) == 3
+    assert index.lookup("img0")["class_id"] == 9
+    assert _ids(index) == {"img0", "img1", "img2"}
+
+
+def test_index_grows_past_its_initial_allocation():
+    index = _index(capacity=1500)
+    for i in range(1100):
+        index.add(_vector(i), f"id{i}", _result())
+    assert len(index) == 1100
+    assert index.similar(_vector(1099), k=1)[0]["image_id"] == "id1099"
+
+
+def test_match_needs_the_threshold_and_the_same_crop():
+    index = _index()
+    index.add(_vector(1), "img1", _result(class_id=5), crop="Tomato")
+
+    near, unrelated, other_crop = index.match(
+        np.stack([_vector(1), _vector(2), _vector(1)]), ["Tomato", "Tomato", None]
+    )
+    assert near["class_id"] == 5
+    assert unrelated is None and other_crop is None
+    assert index.lookup("img1", crop="Tomato")["class_id"] == 5
+    assert index.lookup("img1") is None
+
+
+def test_reuse_is_off_above_a_threshold_of_one():
+    index = EmbeddingIndex(capacity=3, dim=DIM, duplicate_threshold=1.01)
+    index.add(_vector(1), "img1", _result())
+    assert not index.matching
+    assert index.match(_vector(1)[None, :], [None]) == [None]
+    assert index.lookup("img1") is None
+
+
+def test_saved_ring_reloads_in_overwrite_order(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = _index(capacity=3, path=path)
+    for i in range(4):
+        index.add(_vector(i), f"img{i}", _result(class_id=i))
+    index.save()
+    assert not index.dirty
+
+    restored = _index(capacity=3, path=path)
+    assert restored.load() == 3
+    assert _ids(restored) == {"img1", "img2", "img3"}
+    assert restored.similar(_vector(2), k=1)[0]["image_id"] == "img2"
+
+    # The oldest saved entry is the next one overwritten
+    restored.add(_vector(10), "img10", _result())
+    assert _ids(restored) == {"img2", "img3", "img10"}
+
+
+def test_load_keeps_the_newest_entries_when_capacity_shrinks(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = _index(capacity=4, path=path)
+    for i in range(4):
+        index.add(_vector(i), f"img{i}", _result())
+    index.save()
+
+    smaller = _index(capacity=2, path=path)
+    assert smaller.load() == 2
+    assert _ids(smaller) == {"img2", "img3"}
+
+
+def test_load_ignores_an_index_of_another_dimension(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = _index(path=path)
+    index.add(_vector(1), "img1", _result())
+    index.save()
+
+    other = EmbeddingIndex(capacity=3, dim=DIM * 2, path=path)
+    assert other.load() == 0
+    assert len(other) == 0
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        EmbeddingIndex(capacity=0, dim=DIM)
@@ -0,0 +1,35 @@
+import copy
+
+import torch
+from torch import nn
+
+from model import ResNet9, fold_batchnorm
+
+
+def _trained_like_model() -> ResNet9:
+    """ResNet9 with non-trivial BatchNorm statistics, in eval mode"""
+    torch.manual_seed(0)
+    model = ResNet9(3, 38)
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model.eval()
+
+
+def test_folded_logits_match_unfolded():
+    model = _trained_like_model()
+    folded = fold_batchnorm(copy.deepcopy(model))
+    xb = torch.rand(4, 3, 64, 64)
+    with torch.no_grad():
+        torch.testing.assert_close(folded(xb), model(xb), rtol=1e-4, atol=1e-4)
+
+
+def test_folding_leaves_conv_next_to_relu():
+    folded = fold_batchnorm(_trained_like_model())
+    assert not any(isinstance(m, (nn.BatchNorm2d, nn.Identity)) for m in folded.modules())
+    for block in (folded.conv1, folded.res1[0], folded.res2[1]):
+        assert isinstance(block[0], nn.Conv2d)
+        assert isinstance(block[1], nn.ReLU)
@@ -0,0 +1,22 @@
+from images import is_image_path, iter_batches, list_images
+
+
+def test_list_images_filters_by_extension_and_sorts(tmp_path):
+    (tmp_path / "b").mkdir()
+    for name in ("b/leaf.PNG", "a.jpg", "notes.txt", "scan.bmp"):
+        (tmp_path / name).write_bytes(b"")
+
+    assert list_images(str(tmp_path)) == [str(tmp_path / n) for n in ("a.jpg", "b/leaf.PNG", "scan.bmp")]
+    assert not is_image_path("archive.tar.gz")
+
+
+def test_iter_batches_skips_undecodable_files(tmp_path, image_bytes):
+    paths = []
+    for i, content in enumerate([image_bytes(seed=1), b"broken", image_bytes(seed=2), image_bytes(seed=3)]):
+        path = tmp_path / f"{i}.jpg"
+        path.write_bytes(content)
+        paths.append(str(path))
+
+    batches = list(iter_batches(paths, batch_size=2))
+    assert [kept for kept, _ in batches] == [[paths[0]], paths[2:]]
+    assert [len(batch) for _, batch in batches] == [1, 2]
@@ -0,0 +1,38 @@
+import pytest
+
+import model
+from model import predict_batch
+
+
+def test_undecodable_image_only_fails_its_own_slot(random_model, image_bytes):
+    images = [image_bytes(seed=1), b"not an image", image_bytes(seed=2, fmt="PNG")]
+    results = predict_batch(images, random_model, batch_size=2)
+
+    assert len(results) == 3
+    assert "error" in results[1] and "label" not in results[1]
+    for result in (results[0], results[2]):
+        assert "error" not in result
+        assert result["label"] in model.class_names
+
+
+def test_failed_chunk_does_not_fail_the_others(random_model, image_bytes, monkeypatch):
+    real_predict_tensors = model.predict_tensors
+    calls = []
+
+    def fail_second_chunk(batch, *args, **kwargs):
+        calls.append(len(batch))
+        if len(calls) == 2:
+            raise RuntimeError("boom")
+        return real_predict_tensors(batch, *args, **kwargs)
+
+    monkeypatch.setattr(model, "predict_tensors", fail_second_chunk)
+    results = predict_batch([image_bytes(seed=i) for i in range(5)], random_model, batch_size=2)
+
+    assert calls == [2, 2, 1]
+    assert ["error" in r for r in results] == [False, False, True, True, False]
+    assert "boom" in results[2]["error"]
+
+
+def test_crops_must_match_images(random_model, image_bytes):
+    with pytest.raises(ValueError):
+        predict_batch([image_bytes()], random_model, crops=["tomato", "corn"])
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from torch import nn
+
+from registry import ModelNotFoundError, ModelRegistry, VersionConflictError
+from workers import InferencePool
+
+
+def _tiny_model() -> nn.Module:
+    """Cheap stand-in with the classifier's output shape; no embeddings"""
+    return nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(3, 38)).eval()
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def _registry(pool, tmp_path, *versions) -> ModelRegistry:
+    registry = ModelRegistry(pool, lambda version, spec: _tiny_model, state_path=str(tmp_path / "state.json"))
+    for version in versions:
+        registry.add(version, _tiny_model(), source="test")
+    return registry
+
+
+def test_routing_is_sticky_per_upload(pool, tmp_path):
+    registry = _registry(pool, tmp_path, "v1", "v2")
+    uploads = [f"leaf-{i}".encode() for i in range(200)]
+
+    async def split_traffic():
+        await registry.set_traffic({"v1": 50, "v2": 50})
+        return [registry.route(content).version for content in uploads]
+
+    first = asyncio.run(split_traffic())
+    assert first == [registry.route(content).version for content in uploads]
+    assert 50 < first.count("v1") < 150
+    assert registry.traffic == {"v1": 50, "v2": 50}
+
+
+def test_retired_version_drains_in_flight_requests(pool, tmp_path):
+    registry = _registry(pool, tmp_path, "v1", "v2")
+
+    async def swap_while_busy():
+        with registry.acquire(b"leaf") as entry:
+            assert entry.version == "v1"
+            await registry.set_traffic({"v2": 100})
+            assert registry.route(b"leaf").version == "v2"
+            await asyncio.sleep(0.2)
+            still_loaded = "v1" in {e.version for e in registry.versions()}
+        await asyncio.gather(*registry._tasks)
+        return still_loaded
+
+    assert asyncio.run(swap_while_busy())
+    assert [e.version for e in registry.versions()] == ["v2"]
+
+
+def test_set_traffic_rejects_bad_splits(pool, tmp_path):
+    registry = _registry(pool, tmp_path, "v1")
+    with pytest.raises(ModelNotFoundError):
+        asyncio.run(registry.set_traffic({"v1": 50, "v9": 50}))
+    with pytest.raises(ValueError):
+        asyncio.run(registry.set_traffic({"v1": 90}))
+    assert registry.traffic == {"v1": 100}
+
+
+def test_processes_converge_on_the_shared_state(pool, tmp_path):
+    deployer = _registry(pool, tmp_path, "v1")
+    other = _registry(pool, tmp_path, "v1")
+
+    async def deploy_canary():
+        state = await deployer.plan_deploy("v2", {"path": "canary.pth"}, traffic=20)
+        await deployer.sync()
+        await other.sync()
+        with pytest.raises(VersionConflictError):
+            await deployer.plan_deploy("v2", {"path": "canary.pth"})
+        with pytest.raises(ModelNotFoundError):
+            await deployer.plan_traffic({"v3": 100})
+        converged = other.traffic, sorted(e.version for e in other.versions())
+        await deployer.stop()
+        await other.stop()
+        return state, converged
+
+    state, (traffic, versions) = asyncio.run(deploy_canary())
+    assert state["traffic"] == traffic == {"v1": 80, "v2": 20}
+    assert versions == ["v1", "v2"]
+    for registry in (deployer, other):
+        assert registry.generation == state["generation"]
+        assert registry.sync_error is None
@@ -0,0 +1,64 @@
+import pytest
+import torch
+
+import model
+from tiling import aggregate, check_options, decode_tiles, plan_tiles
+
+TILE = 256
+
+
+def _covers(length: int, origins, tile: int = TILE) -> bool:
+    return origins[0] == 0 and origins[-1] + tile == length and all(0 <= o <= length - tile for o in origins)
+
+
+def test_small_photo_is_scaled_up_to_one_tile_across():
+    (w, h), xs, ys = plan_tiles(100, 80, max_tiles=16, overlap=0.25, tile=TILE)
+    assert (w, h) == (320, 256)
+    assert ys == [0]
+    assert _covers(w, xs)
+
+
+def test_large_photo_keeps_resolution_within_the_tile_budget():
+    (w, h), xs, ys = plan_tiles(4000, 3000, max_tiles=16, overlap=0.25, tile=TILE)
+    assert len(xs) * len(ys) <= 16
+    assert len(xs) > 1 and len(ys) > 1
+    assert _covers(w, xs) and _covers(h, ys)
+    assert w / h == pytest.approx(4000 / 3000, rel=0.01)
+
+
+def test_elongated_photo_spreads_fewer_tiles_along_its_long_side():
+    (w, h), xs, ys = plan_tiles(20000, 256, max_tiles=4, overlap=0.25, tile=TILE)
+    assert (w, h) == (20000, 256)
+    assert ys == [0] and len(xs) == 4
+    assert _covers(w, xs)
+
+
+def test_decoded_tiles_match_the_plan(image_bytes):
+    tiles, boxes, (rows, cols) = decode_tiles(image_bytes(900, 500), max_tiles=8)
+    assert tiles.shape == (rows * cols, 3, model.IMAGE_SIZE, model.IMAGE_SIZE)
+    assert len(boxes) == rows * cols <= 8
+    assert all(0 <= x0 < x1 <= 900 and 0 <= y0 < y1 <= 500 for x0, y0, x1, y1 in boxes)
+
+
+def test_max_pooling_flags_a_lesion_seen_in_one_tile():
+    n = len(model.class_names)
+    probs = torch.full((4, n), 0.5 / (n - 1))
+    probs[:, 0] = 0.5
+    probs[3] = 0.0
+    probs[3, 7] = 1.0
+    boxes = [[0, 0, 1, 1]] * 4
+
+    pooled = aggregate(probs, boxes, (2, 2), pooling="max", top_k=2)
+    assert pooled["label"] == model.class_names[7]
+    background = round(0.5 / (n - 1), 4)
+    assert pooled["tiling"]["heatmap"] == [[background, background], [background, 1.0]]
+    assert [t["label"] for t in pooled["tiling"]["top_k"]] == [model.class_names[7], model.class_names[0]]
+
+    averaged = aggregate(probs, boxes, (2, 2), pooling="mean")
+    assert averaged["label"] == model.class_names[0]
+
+
+@pytest.mark.parametrize("pooling, top_k, max_tiles", [("median", 3, 4), ("max", 0, 4), ("max", 3, 10_000)])
+def test_check_options_rejects_out_of_range_values(pooling, top_k, max_tiles):
+    with pytest.raises(ValueError):
+        check_options(pooling, top_k, max_tiles)
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+import model
+from model import forward_logits, predict, predict_tensors, tta_views
+
+
+def test_views_are_flips_then_resized_crops():
+    batch = torch.rand(2, 3, 32, 32)
+    views = tta_views(batch, crop_scale=0.75)
+
+    assert views.shape == (2, 7, 3, 32, 32)
+    torch.testing.assert_close(views[:, 0], batch.flip(-1))
+    torch.testing.assert_close(views[:, 1], batch.flip(-2))
+    centre = batch[:, :, 4:28, 4:28]
+    expected = torch.nn.functional.interpolate(centre, size=(32, 32), mode="bilinear", align_corners=False)
+    torch.testing.assert_close(views[:, 2], expected)
+
+
+def test_modes_apply_per_row(random_model, monkeypatch):
+    batch = torch.rand(3, 3, 64, 64)
+    # Untrained weights are never confident, so "auto" always re-scores
+    monkeypatch.setattr(model, "TTA_CONFIDENCE_THRESHOLD", 1.01)
+    results = predict_tensors(batch, random_model, tta=["off", "auto", "always"])
+    assert [r["inference_path"] for r in results] == ["single", "tta", "tta"]
+
+    monkeypatch.setattr(model, "TTA_CONFIDENCE_THRESHOLD", 0.0)
+    results = predict_tensors(batch, random_model, tta=["off", "auto", "always"])
+    assert [r["inference_path"] for r in results] == ["single", "single", "tta"]
+
+
+def test_tta_averages_the_image_with_its_views(random_model):
+    batch = torch.rand(1, 3, 64, 64)
+    result = predict_tensors(batch, random_model, tta=["always"])[0]
+
+    with torch.inference_mode():
+        views = torch.cat([batch, tta_views(batch)[0]])
+        expected = torch.softmax(forward_logits(views, random_model), dim=1).mean(dim=0)
+    assert result["confidence"] == pytest.approx(float(expected.max()), rel=1e-4)
+    assert result["label"] == model.class_names[int(expected.argmax())]
+
+
+def test_predict_rejects_unknown_modes(random_model, image_bytes):
+    with pytest.raises(ValueError, match="tta must be one of"):
+        predict(image_bytes(), random_model, tta="sometimes")
@@ -0,0 +1,86 @@
+import io
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from model import class_names
+from video import Frame, FrameSampler, RowDiagnosis, diagnose_row, iter_frames
+
+HEALTHY = class_names.index("Tomato___healthy")
+BLIGHT = class_names.index("Tomato___Late_blight")
+
+
+def _frame(index: int, level: float, time: float = None) -> Frame:
+    return Frame(index, time, np.full((32, 32), level, dtype=np.float32), lambda: None)
+
+
+def _kept(sampler: FrameSampler, levels) -> list:
+    return [frame.index for frame in sampler(_frame(i, level) for i, level in enumerate(levels))]
+
+
+def test_sampler_skips_frames_that_barely_changed():
+    sampler = FrameSampler(min_change=0.05, max_frames=10)
+    assert _kept(sampler, [0.0, 0.01, 0.02, 0.3, 0.32, 0.9]) == [0, 3, 5]
+    assert (sampler.decoded, sampler.kept) == (6, 3)
+
+
+def test_sampler_stops_at_its_budgets():
+    assert _kept(FrameSampler(min_change=0.0, max_frames=2), [0.1, 0.5, 0.9, 0.2]) == [0, 1]
+
+    sampler = FrameSampler(min_change=0.5, max_frames=10, max_decoded=3)
+    assert _kept(sampler, itertools.repeat(0.0)) == [0]
+    assert sampler.decoded == 3
+
+
+def test_photos_and_animation_frames_are_numbered_in_order(image_bytes):
+    frames = [Image.new("RGB", (40, 30), (i * 60, 90, 30)) for i in range(3)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:], duration=200)
+
+    decoded = list(iter_frames([image_bytes(seed=1), buffer.getvalue(), image_bytes(seed=2, fmt="PNG")]))
+    assert [f.index for f in decoded] == [0, 1, 2, 3, 4]
+    assert [f.time for f in decoded] == [None, 0.0, 0.2, 0.4, None]
+    assert decoded[2].load().shape[0] == 3
+
+
+def _row(labels, min_diseased_fraction: float = 0.15) -> dict:
+    row = RowDiagnosis(min_diseased_fraction)
+    for i, class_id in enumerate(labels):
+        row.add(_frame(i, 0.0, time=i / 2), {"class_id": class_id, "confidence": 0.8})
+    return row.summary()
+
+
+def test_row_reports_a_disease_seen_in_enough_frames():
+    summary = _row([HEALTHY] * 8 + [BLIGHT] * 2)
+    assert summary["label"] == class_names[BLIGHT]
+    assert summary["diseased_frames"] == 2
+    assert summary["diseased_fraction"] == 0.2
+    assert summary["confidence"] == 0.2
+    (detection,) = summary["detections"]
+    assert (detection["first_frame"], detection["last_frame"]) == (8, 9)
+    assert (detection["first_time"], detection["last_time"]) == (4.0, 4.5)
+
+
+def test_row_stays_healthy_below_the_diseased_fraction():
+    summary = _row([HEALTHY] * 19 + [BLIGHT])
+    assert summary["label"] == class_names[HEALTHY]
+    assert len(summary["detections"]) == 1
+
+
+def test_empty_row_has_no_summary():
+    with pytest.raises(ValueError):
+        RowDiagnosis().summary()
+
+
+def test_diagnose_row_streams_frames_then_the_summary(random_model, image_bytes):
+    uploads = [image_bytes(seed=i) for i in range(3)]
+    chunks = list(diagnose_row(uploads, random_model, batch_size=2, min_change=0.0))
+
+    events = [event for chunk in chunks for event in chunk]
+    assert [e["type"] for e in events] == ["frame", "frame", "frame", "summary"]
+    assert [len(chunk) for chunk in chunks] == [2, 1, 1]
+    summary = events[-1]
+    assert summary["frames_analysed"] == summary["frames_decoded"] == 3
+    assert summary["label"] in class_names
@@ -0,0 +1,195 @@
+"""Tiled inference for wide, high-resolution field photos.
+
+Instead of squashing the whole photo to IMAGE_SIZE x IMAGE_SIZE, the image
+is resized once to a working resolution and cut into overlapping
+IMAGE_SIZE tiles, which go through the model as a single batch. Tile
+probabilities are pooled into one answer, and the per-tile scores are
+returned as a heatmap so the client can show where the lesions are.
+"""
+import io
+import math
+import os
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from metrics import maybe_profile, stage_timer
+from model import (
+    DEVICE,
+    IMAGE_SIZE,
+    build_result,
+    class_names,
+    class_probabilities,
+    forward_logits,
+    image_to_tensor,
+    resolve_crop,
+)
+
+# -----------------------------
+# Tiling Configuration
+# -----------------------------
+# Upper bound on tiles per image, i.e. on the forward-pass batch size
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", 16))
+# Fraction of a tile shared with its neighbour
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", 0.25))
+# "max" flags a lesion seen in any tile; "mean" favours what covers most of the photo
+TILE_POOLING = os.getenv("TILE_POOLING", "max").lower()
+TILE_TOP_K = int(os.getenv("TILE_TOP_K", 3))
+
+POOLINGS = ("max", "mean")
+
+
+def check_options(pooling: str, top_k: int, max_tiles: int) -> None:
+    """Raise ValueError for request options outside the supported range"""
+    if pooling not in POOLINGS:
+        raise ValueError(f"pooling must be one of {', '.join(POOLINGS)}")
+    if not 1 <= top_k <= len(class_names):
+        raise ValueError(f"top_k must be between 1 and {len(class_names)}")
+    if not 1 <= max_tiles <= TILE_MAX_TILES:
+        raise ValueError(f"max_tiles must be between 1 and {TILE_MAX_TILES}")
+
+
+# -----------------------------
+# Tile Planning
+# -----------------------------
+def _tile_count(length: int, tile: int, stride: float) -> int:
+    return 1 if length <= tile else 1 + math.ceil((length - tile) / stride)
+
+
+def _positions(length: int, tile: int, count: int) -> List[int]:
+    """``count`` tile origins spread evenly from one edge to the other"""
+    if count == 1:
+        return [max(0, (length - tile) // 2)]
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def plan_tiles(
+    width: int,
+    height: int,
+    max_tiles: int = TILE_MAX_TILES,
+    overlap: float = TILE_OVERLAP,
+    tile: int = IMAGE_SIZE,
+) -> Tuple[Tuple[int, int], List[int], List[int]]:
+    """Working size and tile origins (xs, ys) for a ``width`` x ``height`` photo.
+
+    Keeps as much native resolution as the tile budget allows: the scale is
+    lowered until the grid fits in ``max_tiles``, but never below the point
+    where the short side is exactly one tile. Very elongated photos that
+    still don't fit get fewer, more widely spaced tiles along the long side.
+    """
+    stride = tile * (1 - overlap)
+    min_scale = tile / min(width, height)
+    # Small photos are scaled up just enough for one tile across the short side
+    scale = max(1.0, min_scale)
+    while True:
+        w, h = max(tile, round(width * scale)), max(tile, round(height * scale))
+        cols, rows = _tile_count(w, tile, stride), _tile_count(h, tile, stride)
+        if cols * rows <= max_tiles or scale <= min_scale:
+            break
+        scale = max(min_scale, scale * 0.9)
+
+    if cols * rows > max_tiles:
+        if cols >= rows:
+            cols = max(1, max_tiles // rows)
+        else:
+            rows = max(1, max_tiles // cols)
+    return (w, h), _positions(w, tile, cols), _positions(h, tile, rows)
+
+
+def decode_tiles(
+    image_bytes: Union[bytes, BinaryIO],
+    max_tiles: int = TILE_MAX_TILES,
+    overlap: float = TILE_OVERLAP,
+) -> Tuple[torch.Tensor, List[List[int]], Tuple[int, int]]:
+    """Decode an upload into a (N, C, IMAGE_SIZE, IMAGE_SIZE) tile batch.
+
+    Returns the tiles, each tile's box in original-image pixels, and the
+    (rows, cols) grid shape.
+    """
+    with stage_timer("decode"):
+        if isinstance(image_bytes, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image_bytes))
+        else:
+            image = Image.open(image_bytes)
+        width, height = image.size
+        (w, h), xs, ys = plan_tiles(width, height, max_tiles, overlap)
+
+        if image.format == "JPEG":
+            image.draft("RGB", (w, h))
+        image = image.convert("RGB")
+        factor = min(image.width // w, image.height // h)
+        if factor >= 2:
+            image = image.reduce(factor)
+        image = image.resize((w, h), Image.BILINEAR)
+
+    with stage_timer("transform"):
+        tensor = image_to_tensor(image)
+        tiles = torch.stack([
+            tensor[:, y:y + IMAGE_SIZE, x:x + IMAGE_SIZE] for y in ys for x in xs
+        ])
+    sx, sy = width / w, height / h
+    boxes = [
+        [round(x * sx), round(y * sy), round((x + IMAGE_SIZE) * sx), round((y + IMAGE_SIZE) * sy)]
+        for y in ys for x in xs
+    ]
+    return tiles, boxes, (len(ys), len(xs))
+
+
+# -----------------------------
+# Tiled Prediction
+# -----------------------------
+def aggregate(
+    probs: torch.Tensor,
+    boxes: List[List[int]],
+    grid: Tuple[int, int],
+    pooling: str = TILE_POOLING,
+    top_k: int = TILE_TOP_K,
+) -> dict:
+    """Pool (N, num_classes) tile probabilities into one result plus tile details"""
+    pooled = probs.max(dim=0).values if pooling == "max" else probs.mean(dim=0)
+    result = build_result(pooled)
+    result["inference_path"] = "tiled"
+    top_scores, top_ids = torch.topk(pooled, min(top_k, pooled.shape[0]))
+    tile_conf, tile_ids = probs.max(dim=1)
+    rows, cols = grid
+
+    result["tiling"] = {
+        "pooling": pooling,
+        "grid": [rows, cols],
+        "top_k": [
+            {"label": class_names[int(i)], "score": round(float(p), 4)}
+            for p, i in zip(top_scores, top_ids)
+        ],
+        # Probability of the pooled label in each tile, row-major
+        "heatmap": [
+            [round(float(p), 4) for p in row]
+            for row in probs[:, result["class_id"]].reshape(rows, cols)
+        ],
+        "tiles": [
+            {"box": box, "label": class_names[int(i)], "confidence": round(float(c), 4)}
+            for box, c, i in zip(boxes, tile_conf, tile_ids)
+        ],
+    }
+    return result
+
+
+def predict_tiled(
+    image_bytes: Union[bytes, BinaryIO],
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    crop: Optional[str] = None,
+    pooling: str = TILE_POOLING,
+    top_k: int = TILE_TOP_K,
+    max_tiles: int = TILE_MAX_TILES,
+) -> dict:
+    """Predict one photo from up to ``max_tiles`` overlapping tiles in one batch"""
+    check_options(pooling, top_k, max_tiles)
+    crop = resolve_crop(crop)
+    tiles, boxes, grid = decode_tiles(image_bytes, max_tiles)
+    with torch.inference_mode(), maybe_profile("forward"):
+        outputs = forward_logits(tiles, model, device)
+        with stage_timer("postprocess"):
+            probs = class_probabilities(outputs, [crop] * len(boxes))
+            return aggregate(probs, boxes, grid, pooling, top_k)
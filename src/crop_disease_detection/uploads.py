@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import List
+
+from fastapi import UploadFile
+
+from images import is_image_path
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Upload Configuration
+# -----------------------------
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Allowance for multipart boundaries and headers around a single file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload into memory in chunks, stopping as soon as it is too big"""
+    buffer = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise UploadTooLargeError(f"File too large. Maximum size is {max_bytes / (1024 * 1024):.1f} MB.")
+    return bytes(buffer)
+
+
+async def read_uploads(files: List[UploadFile], max_total_bytes: int) -> List[bytes]:
+    """Read several uploads, stopping as soon as together they are too big"""
+    contents = []
+    remaining = max_total_bytes
+    for file in files:
+        try:
+            contents.append(await read_upload(file, remaining))
+        except UploadTooLargeError:
+            raise UploadTooLargeError(
+                f"Files too large. Maximum total size is {max_total_bytes / (1024 * 1024):.1f} MB."
+            ) from None
+        remaining -= len(contents[-1])
+    return contents
+
+
+def content_length_too_large(content_length: str, max_bytes: int = MAX_UPLOAD_BYTES) -> bool:
+    """Early check on a request's Content-Length header"""
+    try:
+        return int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES
+    except (TypeError, ValueError):
+        return False
+
+
+def save_upload(content: bytes, filename: str, upload_dir: str) -> str:
+    """Store an upload under its content hash and return the stored file name.
+
+    Identical uploads map to the same file and are only written once, and
+    concurrent uploads that share a client file name can't overwrite each
+    other. Writes go through a temp file so readers never see partial data.
+    """
+    # Stored files keep an image extension; anything else is saved without one
+    extension = os.path.splitext(filename or "")[1].lower() if is_image_path(filename or "") else ""
+    name = hashlib.sha256(content).hexdigest() + extension
+    path = os.path.join(upload_dir, name)
+    if os.path.exists(path):
+        return name
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save upload {name}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return name
@@ -0,0 +1,274 @@
+"""Row-level diagnosis from a video, or a burst of photos, of a crop row.
+
+Frames are decoded one at a time and compared with the last frame that
+was kept, using the mean absolute difference of a tiny grayscale
+thumbnail. Frames that barely changed (standing still, slow panning) are
+skipped before they are ever resized to the model's input. The kept
+frames are scored in batches, and the per-frame results are pooled into
+one diagnosis for the row.
+
+Videos are decoded with PyAV (``pip install av``). Photos and animated
+GIF/WebP bursts only need Pillow.
+"""
+import io
+import os
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+from model import DEVICE, IMAGE_SIZE, class_names, decode_image, image_to_tensor, predict_stream, resolve_crop
+
+# -----------------------------
+# Video Configuration
+# -----------------------------
+# Total size of the files in one request (one video, or every photo of a burst)
+VIDEO_MAX_BYTES = int(os.getenv("VIDEO_MAX_BYTES", 200 * 1024 * 1024))
+VIDEO_MAX_FILES = int(os.getenv("VIDEO_MAX_FILES", 32))
+# Most frames scored per request, after near-identical ones are skipped
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", 64))
+# Decoding stops after this many frames (about 2 minutes at 30 fps)
+VIDEO_MAX_DECODED_FRAMES = int(os.getenv("VIDEO_MAX_DECODED_FRAMES", 3600))
+# Mean absolute pixel change (0-1) from the last kept frame needed to keep a frame
+VIDEO_FRAME_DIFF = float(os.getenv("VIDEO_FRAME_DIFF", 0.05))
+# Frames per forward pass, and per chunk of streamed results
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", 8))
+# Share of scored frames showing a disease from which the row is reported as diseased
+VIDEO_MIN_DISEASED_FRACTION = float(os.getenv("VIDEO_MIN_DISEASED_FRACTION", 0.15))
+# Deadline for video requests without an X-Request-Timeout header
+VIDEO_TIMEOUT_MS = float(os.getenv("VIDEO_TIMEOUT_MS", 120000))
+
+THUMB_SIZE = 32
+
+
+class Frame(NamedTuple):
+    index: int
+    # Seconds into the clip; None for separate photos
+    time: Optional[float]
+    # (THUMB_SIZE, THUMB_SIZE) grayscale in [0, 1], for the change check
+    thumb: np.ndarray
+    # Builds the (C, IMAGE_SIZE, IMAGE_SIZE) model input, only for kept frames
+    load: Callable[[], torch.Tensor]
+
+
+def check_options(max_frames: int, min_change: float) -> None:
+    if not 1 <= max_frames <= VIDEO_MAX_FRAMES:
+        raise ValueError(f"max_frames must be between 1 and {VIDEO_MAX_FRAMES}")
+    if not 0 <= min_change < 1:
+        raise ValueError("min_change must be between 0 and 1")
+
+
+# -----------------------------
+# Decoding
+# -----------------------------
+def _thumb(image: Image.Image) -> np.ndarray:
+    small = image.convert("L").resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32) / 255
+
+
+def _image_frames(image: Image.Image, data: bytes) -> Iterator[tuple]:
+    """(time, thumb, load) for a photo, or for every frame of an animated image"""
+    if getattr(image, "n_frames", 1) == 1:
+        rgb = decode_image(data)
+        yield None, _thumb(rgb), lambda: image_to_tensor(rgb)
+        return
+    elapsed = 0.0
+    for frame in ImageSequence.Iterator(image):
+        # Only the thumbnail is made up front; the iterator is still on this
+        # frame when the sampler keeps it and calls load
+        def load(frame=frame) -> torch.Tensor:
+            return image_to_tensor(frame.convert("RGB").resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR))
+
+        yield elapsed, _thumb(frame), load
+        elapsed += frame.info.get("duration", 0) / 1000
+
+
+def _video_frames(data: bytes) -> Iterator[tuple]:
+    """(time, thumb, load) for each frame of a video; scaling happens in libswscale"""
+    try:
+        import av
+    except ImportError as e:
+        raise RuntimeError("Video input requires the 'av' package (pip install av)") from e
+
+    try:
+        container = av.open(io.BytesIO(data))
+    except av.FFmpegError as e:
+        raise ValueError("Upload is neither an image nor a readable video") from e
+    try:
+        if not container.streams.video:
+            raise ValueError("Upload has no video stream")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            gray = frame.reformat(width=THUMB_SIZE, height=THUMB_SIZE, format="gray").to_ndarray()
+
+            def load(frame=frame) -> torch.Tensor:
+                rgb = frame.reformat(width=IMAGE_SIZE, height=IMAGE_SIZE, format="rgb24").to_ndarray()
+                return torch.from_numpy(rgb).permute(2, 0, 1).float().div_(255)
+
+            yield frame.time, gray.astype(np.float32) / 255, load
+    finally:
+        container.close()
+
+
+def iter_frames(uploads: Sequence[bytes]) -> Iterator[Frame]:
+    """Frames of each upload in order: a video, a photo or an animated image"""
+    index = 0
+    for data in uploads:
+        try:
+            image = Image.open(io.BytesIO(data))
+        except UnidentifiedImageError:
+            source = _video_frames(data)
+        else:
+            source = _image_frames(image, data)
+        try:
+            for time, thumb, load in source:
+                yield Frame(index, time, thumb, load)
+                index += 1
+        finally:
+            # Closes the video container when the caller stops early
+            source.close()
+
+
+# -----------------------------
+# Adaptive Sampling
+# -----------------------------
+class FrameSampler:
+    """Keeps frames that changed enough since the last kept one, up to a budget"""
+
+    def __init__(
+        self,
+        min_change: float = VIDEO_FRAME_DIFF,
+        max_frames: int = VIDEO_MAX_FRAMES,
+        max_decoded: int = VIDEO_MAX_DECODED_FRAMES,
+    ):
+        self.min_change = min_change
+        self.max_frames = max_frames
+        self.max_decoded = max_decoded
+        self.decoded = 0
+        self.kept = 0
+
+    def __call__(self, frames: Iterator[Frame]) -> Iterator[Frame]:
+        last = None
+        for frame in frames:
+            if self.kept >= self.max_frames or self.decoded >= self.max_decoded:
+                return
+            self.decoded += 1
+            if last is None or float(np.abs(frame.thumb - last).mean()) > self.min_change:
+                last = frame.thumb
+                self.kept += 1
+                yield frame
+
+
+# -----------------------------
+# Row Diagnosis
+# -----------------------------
+def is_healthy(label: str) -> bool:
+    return label.endswith("healthy")
+
+
+class RowDiagnosis:
+    """Pools per-frame predictions into one diagnosis for the row"""
+
+    def __init__(self, min_diseased_fraction: float = VIDEO_MIN_DISEASED_FRACTION):
+        self.min_diseased_fraction = min_diseased_fraction
+        self.frames = 0
+        # class id -> {"frames", "votes" (summed confidence), first/last frame and time}
+        self.seen: Dict[int, dict] = {}
+
+    def add(self, frame: Frame, result: dict) -> None:
+        self.frames += 1
+        stats = self.seen.get(result["class_id"])
+        if stats is None:
+            stats = self.seen[result["class_id"]] = {
+                "frames": 0, "votes": 0.0, "first_frame": frame.index, "first_time": frame.time,
+            }
+        stats["frames"] += 1
+        stats["votes"] += result["confidence"]
+        stats["last_frame"], stats["last_time"] = frame.index, frame.time
+
+    def summary(self) -> dict:
+        """Row label: the most-voted disease if enough frames show one, else the most-voted label.
+
+        ``confidence`` is that label's share of all frame votes.
+        """
+        if not self.frames:
+            raise ValueError("No frames could be decoded")
+        total = sum(stats["votes"] for stats in self.seen.values())
+        diseased = {c: s for c, s in self.seen.items() if not is_healthy(class_names[c])}
+        diseased_frames = sum(stats["frames"] for stats in diseased.values())
+        diseased_fraction = diseased_frames / self.frames
+
+        candidates = diseased if diseased and diseased_fraction >= self.min_diseased_fraction else self.seen
+        class_id = max(candidates, key=lambda c: candidates[c]["votes"])
+        detections = sorted(diseased.items(), key=lambda item: item[1]["frames"], reverse=True)
+        return {
+            "label": class_names[class_id],
+            "class_id": class_id,
+            "confidence": round(self.seen[class_id]["votes"] / total, 4) if total else 0.0,
+            "frames_analysed": self.frames,
+            "diseased_frames": diseased_frames,
+            "diseased_fraction": round(diseased_fraction, 4),
+            "detections": [
+                {
+                    "label": class_names[c],
+                    "frames": stats["frames"],
+                    "mean_confidence": round(stats["votes"] / stats["frames"], 4),
+                    "first_frame": stats["first_frame"],
+                    "last_frame": stats["last_frame"],
+                    "first_time": _seconds(stats["first_time"]),
+                    "last_time": _seconds(stats["last_time"]),
+                }
+                for c, stats in detections
+            ],
+        }
+
+
+def _seconds(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(float(value), 3)
+
+
+def diagnose_row(
+    uploads: Sequence[bytes],
+    model: nn.Module,
+    device: torch.device = DEVICE,
+    crop: Optional[str] = None,
+    tta: str = "off",
+    max_frames: int = VIDEO_MAX_FRAMES,
+    min_change: float = VIDEO_FRAME_DIFF,
+    batch_size: int = VIDEO_BATCH_SIZE,
+    gate: Optional[Callable] = None,
+) -> Iterator[List[dict]]:
+    """Stream events for a video or burst: one list of frame events per batch, then the summary.
+
+    Each step decodes only as far as the next batch needs, so callers can
+    advance the generator from a worker thread and forward every chunk as
+    it arrives. ``gate`` is the model version's cascade, if any. Closing
+    the generator early releases the decoder.
+    """
+    check_options(max_frames, min_change)
+    crop = resolve_crop(crop)
+    sampler = FrameSampler(min_change, max_frames)
+    row = RowDiagnosis()
+    frames = iter_frames(uploads)
+    kept = ((frame, frame.load()) for frame in sampler(frames))
+    try:
+        for batch in predict_stream(kept, model, device, batch_size, crop=crop, tta=tta, gate=gate):
+            events = []
+            for frame, result in batch:
+                row.add(frame, result)
+                events.append({
+                    "type": "frame",
+                    "frame": frame.index,
+                    "time": _seconds(frame.time),
+                    "label": result["label"],
+                    "class_id": result["class_id"],
+                    "confidence": round(result["confidence"], 4),
+                    "inference_path": result["inference_path"],
+                })
+            yield events
+    finally:
+        frames.close()
+    yield [{"type": "summary", **row.summary(), "frames_decoded": sampler.decoded, "crop": crop}]
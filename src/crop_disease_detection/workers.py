@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------
+# Worker Pool Configuration
+# -----------------------------
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 2))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", 64))
+# 0 means "split the CPU cores evenly between the inference workers"
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", 0))
+# Server processes sharing this machine (set by gunicorn.conf.py)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the inference pool already has its maximum backlog"""
+
+
+def configure_torch_threads(
+    workers: int = INFERENCE_WORKERS,
+    num_threads: int = TORCH_NUM_THREADS,
+    processes: int = SERVER_WORKERS,
+) -> int:
+    """Size torch's intra-op thread pool so the workers don't oversubscribe the CPU"""
+    if num_threads <= 0:
+        num_threads = max(1, (os.cpu_count() or 1) // max(1, workers * processes))
+    torch.set_num_threads(num_threads)
+    try:
+        # Only the worker threads issue torch ops, so one inter-op thread is enough
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set once, before any parallel work has started
+        pass
+    logger.info(
+        f"torch intra-op threads={num_threads} for {workers} inference workers x {processes} processes"
+    )
+    return num_threads
+
+
+# -----------------------------
+# Bounded Inference Pool
+# -----------------------------
+class InferencePool:
+    """Runs blocking decode/inference calls off the asyncio event loop.
+
+    At most ``workers`` calls execute at once and at most ``queue_size`` more
+    may wait; anything beyond that fails fast with ``QueueFullError`` rather
+    than piling up unbounded work behind the model. PIL decoding and torch
+    kernels release the GIL, so threads give real parallelism here while
+    sharing one copy of the model.
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        # Only touched from the event loop thread, so no lock is needed
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Calls currently running or waiting for a worker"""
+        return self._pending
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn`` on a worker, failing fast if the backlog is full"""
+        if self._pending >= self.workers + self.queue_size:
+            raise QueueFullError("Inference queue is full. Try again later.")
+        return await self.execute(fn, *args, **kwargs)
+
+    async def execute(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn`` on a worker without the backlog check.
+
+        For callers that are already bounded on their own, such as the single
+        batcher task, which must not be rejected after requests were admitted.
+        """
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)